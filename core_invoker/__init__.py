@@ -1,5 +1,7 @@
 from .handler import handler as invoke
+from .adapters import sqs_handler, s3_handler
+from .streaming import stream, ndjson_stream
 
 __version__ = "0.1.2-pre.7+2ddf387"
 
-__all__ = ["invoke"]
+__all__ = ["invoke", "sqs_handler", "s3_handler", "stream", "ndjson_stream"]
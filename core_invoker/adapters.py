@@ -0,0 +1,221 @@
+"""
+Event-source adapters for the invoker.
+
+These adapters let the invoker Lambda be subscribed directly to an SQS queue
+or to S3 upload notifications, without a glue Lambda re-invoking
+``core_invoker.invoke`` for each message.
+
+``sqs_handler`` unwraps a batch of SQS records into task payloads, runs them
+concurrently and reports ``batchItemFailures`` so only the failed messages
+are retried (enable ReportBatchItemFailures on the event source mapping).
+An SQS message may carry a TaskPayload or an S3 notification.
+
+``s3_handler`` maps a package upload to a compile task.  Package keys are
+expected in the packages layout ``[<client>/]packages/<portfolio>/<app>/<branch>/<build>/<name>``;
+other objects in the bucket are logged and skipped, so they never fail
+(and retry) a notification or an SQS message.
+"""
+
+from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+
+import json
+import contextvars
+
+import core_logging as log
+
+import core_framework as util
+from core_framework.constants import TASK_COMPILE, TR_RESPONSE, V_PIPELINE, OBJ_PACKAGES
+from core_framework.models import TaskPayload
+
+from .handler import handler
+from .responses import is_failure
+
+DEFAULT_BATCH_WORKERS = 10
+
+EVENT_SOURCE_SQS = "aws:sqs"
+EVENT_SOURCE_S3 = "aws:s3"
+
+
+def _map_concurrently(fn, items: list, max_workers: int) -> list:
+    """Call ``fn`` for every item on a bounded pool and return results (or exceptions) in order."""
+
+    def call(item):
+        try:
+            return fn(item)
+        except Exception as e:
+            return e
+
+    if len(items) <= 1 or max_workers <= 1:
+        return [call(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, call, item) for item in items]
+        return [future.result() for future in futures]
+
+
+def _package_location(key: str) -> tuple[int, list[str]]:
+    """Return the index of the packages folder in a key and the deployment parts after it.
+
+    Raises:
+        ValueError: If the key is not in the packages layout.
+    """
+    parts = key.split("/")
+    if OBJ_PACKAGES not in parts:
+        raise ValueError(f"Object key '{key}' is not a package key")
+    index = parts.index(OBJ_PACKAGES)
+    deployment = parts[index + 1 :]
+    if len(deployment) != 5:
+        raise ValueError(f"Package key '{key}' must be {OBJ_PACKAGES}/<portfolio>/<app>/<branch>/<build>/<name>")
+    return index, deployment
+
+
+def is_package_key(key: str) -> bool:
+    """Return True if an object key is in the packages layout."""
+    try:
+        _package_location(key)
+    except ValueError:
+        return False
+    return True
+
+
+def task_payload_from_s3_record(record: dict, task: str = TASK_COMPILE, type_: str = V_PIPELINE) -> TaskPayload:
+    """Build the task payload for a package upload notification.
+
+    Args:
+        record (dict): One record of an S3 event notification.
+        task (str): The task to run.  Defaults to "compile".
+        type_ (str): The task type.  Defaults to "pipeline".
+
+    Returns:
+        TaskPayload: The task with the package pointing at the uploaded object.
+
+    Raises:
+        ValueError: If the object key is not in the packages layout.
+    """
+    bucket_name = record["s3"]["bucket"]["name"]
+    key = _s3_key(record)
+
+    parts = key.split("/")
+    index, deployment = _package_location(key)
+
+    client = parts[index - 1] if index > 0 else util.get_client()
+    portfolio, app, branch, build, _name = deployment
+
+    task_payload = TaskPayload.from_arguments(
+        task=task,
+        client=client,
+        portfolio=portfolio,
+        app=app,
+        branch=branch,
+        build=build,
+    )
+    task_payload.type = type_
+    task_payload.package.bucket_name = bucket_name
+    task_payload.package.bucket_region = record.get("awsRegion") or util.get_artefact_bucket_region()
+    task_payload.package.key = key
+
+    return task_payload
+
+
+def _handle_s3_record(record: dict, context: Any | None) -> dict:
+    task_payload = task_payload_from_s3_record(record)
+    log.info("Package uploaded to s3://{}/{}", task_payload.package.bucket_name, task_payload.package.key)
+    return handler(task_payload.model_dump(), context)
+
+
+def _s3_key(record: dict) -> str:
+    return unquote_plus(record["s3"]["object"]["key"])
+
+
+def _s3_records(event: dict) -> list[dict]:
+    return [
+        record
+        for record in event.get("Records", [])
+        if record.get("eventSource") == EVENT_SOURCE_S3 and str(record.get("eventName", "")).startswith("ObjectCreated")
+    ]
+
+
+def _package_records(records: list[dict]) -> tuple[list[dict], list[str]]:
+    """Split S3 records into package uploads and the keys of other objects."""
+    packages = []
+    skipped = []
+    for record in records:
+        key = _s3_key(record)
+        if is_package_key(key):
+            packages.append(record)
+        else:
+            log.info("Skipping s3://{}/{}: not a package upload", record["s3"]["bucket"]["name"], key)
+            skipped.append(key)
+    return packages, skipped
+
+
+def s3_handler(event: dict, context: Any | None = None, max_workers: int = DEFAULT_BATCH_WORKERS) -> dict:
+    """Entry point for S3 upload notifications.
+
+    Every ObjectCreated record of a package becomes a compile task.  Other
+    records, and objects outside the packages layout, are skipped.
+
+    Args:
+        event (dict): The S3 event notification.
+        context (Any, optional): Lambda context object.
+        max_workers (int): Maximum number of records processed at the same time.
+
+    Returns:
+        dict: {"Results": [<invoker response per package>], "Skipped": [<keys of other objects>]}
+
+    Raises:
+        RuntimeError: If any record failed, so the asynchronous invocation is retried
+            or sent to its dead-letter destination.
+    """
+    records, skipped = _package_records(_s3_records(event))
+    results = _map_concurrently(lambda record: _handle_s3_record(record, context), records, max_workers)
+
+    failures = [str(r) if isinstance(r, Exception) else r for r in results if isinstance(r, Exception) or is_failure(r)]
+    if failures:
+        log.error("{} of {} package uploads failed", len(failures), len(records), details={"Failures": failures})
+        raise RuntimeError(f"{len(failures)} of {len(records)} package uploads failed")
+
+    return {"Results": results, "Skipped": skipped}
+
+
+def _handle_sqs_record(record: dict, context: Any | None) -> Any:
+    body = json.loads(record["body"])
+
+    # S3 notifications delivered through a queue
+    if isinstance(body, dict) and _s3_records(body):
+        records, _skipped = _package_records(_s3_records(body))
+        results = [_handle_s3_record(r, context) for r in records]
+        return next((r for r in results if is_failure(r)), {TR_RESPONSE: {"Status": "ok"}})
+
+    return handler(body, context)
+
+
+def sqs_handler(event: dict, context: Any | None = None, max_workers: int = DEFAULT_BATCH_WORKERS) -> dict:
+    """Entry point for an SQS event source mapping.
+
+    Each message body is a TaskPayload dump (or an S3 notification).  Messages
+    are processed concurrently.  A message is reported as failed if its body
+    cannot be read, the invoker raises or the invoker response has status
+    "error", "retry" or "continue" (stopped before its deadline).
+
+    Args:
+        event (dict): The SQS batch event.
+        context (Any, optional): Lambda context object.
+        max_workers (int): Maximum number of messages processed at the same time.
+
+    Returns:
+        dict: {"batchItemFailures": [{"itemIdentifier": <messageId>}, ...]}
+    """
+    records = [r for r in event.get("Records", []) if r.get("eventSource") == EVENT_SOURCE_SQS]
+    results = _map_concurrently(lambda record: _handle_sqs_record(record, context), records, max_workers)
+
+    failures = []
+    for record, result in zip(records, results):
+        if isinstance(result, Exception) or is_failure(result):
+            log.warning("SQS message {} failed: {}", record.get("messageId"), result)
+            failures.append({"itemIdentifier": record["messageId"]})
+
+    log.info("Processed {} SQS messages, {} failed", len(records), len(failures))
+    return {"batchItemFailures": failures}
@@ -0,0 +1,362 @@
+"""
+Admission control and load shedding at the invoker entry point.
+
+Every routed task is attributed to a downstream target ("pipeline_compiler",
+"deployspec_compiler", "runner" or "plan").  Per target, the controller
+tracks the number of tasks in flight and their latency as two moving
+averages: a fast one (recent latency) and a slow one (the baseline).
+
+A target is saturated when:
+
+* the tasks in flight reach the share of ``max_in_flight`` allowed for the
+  task's priority (high 100%, normal 75%, low 50%), or
+* recent latency is more than ``latency_factor`` times the baseline (or
+  above ``CORE_INVOKER_ADMISSION_LATENCY_MS`` when set); this sheds low and
+  normal priority tasks only.
+
+Only admitted tasks report their latency, so while a target is saturated by
+latency one low or normal priority task is still admitted every
+``probe_interval`` seconds as a probe.  Once the target recovers, the probes
+bring the recent latency back down and the target admits all priorities again.
+
+A task that is not admitted is answered immediately with
+
+    {"Response": {"Status": "retry", "RetryAfter": <seconds>, "Target": ..., "Priority": ..., "Message": ...}}
+
+so that high-priority tasks keep their latency.  The SQS adapter reports
+"retry" responses as batch item failures, so shed messages are redelivered.
+
+The priority is taken from ``"priority"`` in the event ("high", "normal" or
+"low") and otherwise from the task: deploy, release and teardown are high,
+compile is normal, plan and bulk operations are low.
+
+The counters are kept per process: they cover concurrent invocations of one
+invoker (local mode, the SQS adapter) and the latency of a warm Lambda
+container.  Install a controller backed by a shared store with
+``set_controller`` to coordinate across containers.
+
+Admission control is off unless ``CORE_INVOKER_ADMISSION=true`` is set.
+``CORE_INVOKER_ADMISSION_MAX_IN_FLIGHT`` sets the in-flight limit (default 32).
+"""
+
+from typing import Callable
+from dataclasses import dataclass
+
+import math
+import os
+import time
+import threading
+
+import core_logging as log
+
+from core_framework.constants import (
+    TASK_DEPLOY,
+    TASK_RELEASE,
+    TASK_TEARDOWN,
+    TASK_PLAN,
+    TASK_COMPILE,
+    V_PIPELINE,
+)
+
+from . import tracing
+
+ADMISSION_ENV = "CORE_INVOKER_ADMISSION"
+MAX_IN_FLIGHT_ENV = "CORE_INVOKER_ADMISSION_MAX_IN_FLIGHT"
+LATENCY_ENV = "CORE_INVOKER_ADMISSION_LATENCY_MS"
+
+# Key in the incoming event that sets the priority of the task
+PRIORITY = "priority"
+
+PRIORITY_HIGH = "high"
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+
+STATUS_RETRY = "retry"
+
+DEFAULT_MAX_IN_FLIGHT = 32
+DEFAULT_LATENCY_FACTOR = 2.0
+
+# Share of max_in_flight a priority may use
+PRIORITY_SHARES = {
+    PRIORITY_HIGH: 1.0,
+    PRIORITY_NORMAL: 0.75,
+    PRIORITY_LOW: 0.5,
+}
+
+DEFAULT_PRIORITIES = {
+    TASK_DEPLOY: PRIORITY_HIGH,
+    TASK_RELEASE: PRIORITY_HIGH,
+    TASK_TEARDOWN: PRIORITY_HIGH,
+    TASK_COMPILE: PRIORITY_NORMAL,
+    TASK_PLAN: PRIORITY_LOW,
+}
+
+FAST_ALPHA = 0.3
+SLOW_ALPHA = 0.02
+
+# Samples needed before latency is used as a signal
+MIN_LATENCY_SAMPLES = 5
+
+# Seconds between probe tasks admitted while a target is saturated by latency
+DEFAULT_PROBE_INTERVAL = 5.0
+
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+
+
+def priority_of(event: dict, task: str, bulk: bool = False) -> str:
+    """Return the priority of a task and remove ``"priority"`` from the event.
+
+    Args:
+        event (dict): The incoming event.
+        task (str): The task, e.g. "deploy".
+        bulk (bool): True for a bulk operation.
+
+    Returns:
+        str: "high", "normal" or "low".
+    """
+    requested = event.pop(PRIORITY, None)
+    if requested is not None:
+        requested = str(requested).lower()
+        if requested in PRIORITY_SHARES:
+            return requested
+        log.warning("Unknown priority '{}', using the default for task {}", requested, task)
+    if bulk:
+        return PRIORITY_LOW
+    return DEFAULT_PRIORITIES.get(task, PRIORITY_NORMAL)
+
+
+def target_of(type_: str, task: str) -> str:
+    """Return the downstream target that does the work of a task."""
+    if task == TASK_COMPILE:
+        return "pipeline_compiler" if type_ == V_PIPELINE else "deployspec_compiler"
+    if task == TASK_PLAN:
+        return "plan"
+    return "runner"
+
+
+@dataclass
+class Admission:
+    """The admission decision for one task.
+
+    Attributes:
+        target (str): The downstream target.
+        priority (str): The task priority.
+        admitted (bool): True if the task may run.
+        reason (str): Why the task was rejected.
+        in_flight (int): Tasks in flight for the target when the decision was made.
+        retry_after (int): Seconds the caller should wait before retrying a rejected task.
+        probe (bool): True if the task was admitted as a probe of a saturated target.
+        released (bool): True once the task has been released.
+    """
+
+    target: str
+    priority: str
+    admitted: bool
+    reason: str = ""
+    in_flight: int = 0
+    retry_after: int = 0
+    probe: bool = False
+    released: bool = False
+
+
+class _TargetState:
+    def __init__(self):
+        self.in_flight = 0
+        self.fast_ms: float | None = None
+        self.slow_ms: float | None = None
+        self.samples = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.last_probe: float | None = None
+
+
+class AdmissionController:
+    """Admits or sheds tasks per downstream target.
+
+    Args:
+        max_in_flight (int, optional): Tasks in flight per target at full share.
+        latency_factor (float): Recent latency over baseline that marks a target as saturated.
+        latency_ms (float, optional): Absolute latency that marks a target as saturated.
+        probe_interval (float): Seconds between probe tasks admitted while latency is high.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int | None = None,
+        latency_factor: float = DEFAULT_LATENCY_FACTOR,
+        latency_ms: float | None = None,
+        probe_interval: float = DEFAULT_PROBE_INTERVAL,
+    ):
+        if max_in_flight is None:
+            max_in_flight = int(os.getenv(MAX_IN_FLIGHT_ENV, DEFAULT_MAX_IN_FLIGHT))
+        if latency_ms is None and os.getenv(LATENCY_ENV):
+            latency_ms = float(os.getenv(LATENCY_ENV))
+        self.max_in_flight = max_in_flight
+        self.latency_factor = latency_factor
+        self.latency_ms = latency_ms
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._targets: dict[str, _TargetState] = {}
+
+    def _latency_saturated(self, state: _TargetState) -> bool:
+        if state.samples < MIN_LATENCY_SAMPLES or state.fast_ms is None:
+            return False
+        if self.latency_ms is not None and state.fast_ms > self.latency_ms:
+            return True
+        return state.slow_ms is not None and state.fast_ms > state.slow_ms * self.latency_factor
+
+    def _retry_after(self, state: _TargetState) -> int:
+        expected_ms = state.fast_ms or 0.0
+        return min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, math.ceil(expected_ms / 1000.0)))
+
+    def try_acquire(self, target: str, priority: str) -> Admission:
+        """Admit a task or decide to shed it.  An admitted task must be released.
+
+        Args:
+            target (str): The downstream target.
+            priority (str): The task priority.
+
+        Returns:
+            Admission: The decision.
+        """
+        share = PRIORITY_SHARES.get(priority, PRIORITY_SHARES[PRIORITY_NORMAL])
+        limit = max(1, int(self.max_in_flight * share))
+
+        with self._lock:
+            state = self._targets.setdefault(target, _TargetState())
+            admission = Admission(target=target, priority=priority, admitted=False, in_flight=state.in_flight)
+
+            if state.in_flight >= limit:
+                admission.reason = f"{state.in_flight} tasks in flight (limit {limit} for {priority} priority)"
+            elif priority != PRIORITY_HIGH and self._latency_saturated(state):
+                now = time.monotonic()
+                if state.last_probe is None or now - state.last_probe >= self.probe_interval:
+                    # Let one task through to measure whether the target has recovered
+                    state.last_probe = now
+                    admission.probe = True
+                else:
+                    admission.reason = f"recent latency {state.fast_ms:.0f} ms (baseline {state.slow_ms:.0f} ms)"
+
+            if not admission.reason:
+                admission.admitted = True
+                state.in_flight += 1
+                state.admitted += 1
+                return admission
+
+            state.rejected += 1
+            admission.retry_after = self._retry_after(state)
+            return admission
+
+    def release(self, admission: Admission, duration_ms: float) -> None:
+        """Release an admitted task and record its latency.
+
+        Args:
+            admission (Admission): The admission returned by ``try_acquire``.
+            duration_ms (float): How long the task took.
+
+        Raises:
+            ValueError: If the task was not admitted or has already been released.
+        """
+        if not admission.admitted:
+            raise ValueError(f"Cannot release a task that was not admitted for {admission.target}")
+        with self._lock:
+            if admission.released:
+                raise ValueError(f"Task for {admission.target} has already been released")
+            admission.released = True
+            state = self._targets[admission.target]
+            state.in_flight -= 1
+            state.samples += 1
+            if state.fast_ms is None:
+                state.fast_ms = state.slow_ms = duration_ms
+            else:
+                state.fast_ms = FAST_ALPHA * duration_ms + (1 - FAST_ALPHA) * state.fast_ms
+                state.slow_ms = SLOW_ALPHA * duration_ms + (1 - SLOW_ALPHA) * state.slow_ms
+
+    def snapshot(self) -> dict:
+        """Return the state of every target as a dictionary."""
+        with self._lock:
+            return {
+                target: {
+                    "InFlight": state.in_flight,
+                    "Admitted": state.admitted,
+                    "Rejected": state.rejected,
+                    "RecentMs": round(state.fast_ms, 1) if state.fast_ms is not None else None,
+                    "BaselineMs": round(state.slow_ms, 1) if state.slow_ms is not None else None,
+                }
+                for target, state in self._targets.items()
+            }
+
+
+_controller: AdmissionController | None = None
+
+
+def set_controller(controller: AdmissionController | None) -> None:
+    """Install the admission controller.  Pass None to restore the default."""
+    global _controller
+    _controller = controller
+
+
+def get_controller() -> AdmissionController:
+    """Return the process-wide admission controller."""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
+
+
+def is_enabled() -> bool:
+    """Return True if admission control is switched on."""
+    return os.getenv(ADMISSION_ENV, "false").lower() in ("1", "true", "yes")
+
+
+def retry_response(admission: Admission) -> dict:
+    """Build the response for a task that was not admitted."""
+    return {
+        "Response": {
+            "Status": STATUS_RETRY,
+            "RetryAfter": admission.retry_after,
+            "Target": admission.target,
+            "Priority": admission.priority,
+            "Message": f"Target {admission.target} is saturated: {admission.reason}",
+        }
+    }
+
+
+def run(target: str, priority: str, fn: Callable[[], dict]) -> dict:
+    """Run a task if the target admits it, otherwise return a retry response.
+
+    Args:
+        target (str): The downstream target.
+        priority (str): The task priority.
+        fn (Callable): Runs the task and returns the invoker response.
+
+    Returns:
+        dict: The response of ``fn`` or a "retry" response.
+    """
+    if not is_enabled():
+        return fn()
+
+    controller = get_controller()
+    admission = controller.try_acquire(target, priority)
+
+    span = tracing.current_span()
+    if span is not None:
+        span.set_attribute("priority", priority)
+        span.set_attribute("admitted", admission.admitted)
+
+    if not admission.admitted:
+        log.warning(
+            "Shedding {} priority task for {}: {}",
+            priority,
+            target,
+            admission.reason,
+            details={"RetryAfter": admission.retry_after, "InFlight": admission.in_flight},
+        )
+        return retry_response(admission)
+
+    start = time.perf_counter()
+    try:
+        return fn()
+    finally:
+        controller.release(admission, (time.perf_counter() - start) * 1000.0)
@@ -0,0 +1,342 @@
+"""
+In-process artefact cache for local mode.
+
+In local mode the compilers and the runner run in the invoker process but
+still hand artefacts to each other through S3 (or MinIO): the compile stage
+writes templates and actions, then the runner reads them straight back.
+
+While an ``artefact_cache.scope()`` is active in the current context,
+buckets returned by ``MagicS3Client.get_bucket`` are wrapped (through
+``buckets.add_wrapper``) so that objects written with ``put_object`` or
+``Object(key).put`` are kept in a bounded LRU cache and written to S3 in
+the background (write-behind).  Reads of a cached key are served from
+memory.  Objects that were only read are not cached, so changes made by
+other processes are always seen.  Each scope flushes the writes made while
+it was active when it exits, so durability is the same as before when the
+invocation returns.
+
+The cache is enabled with ``CORE_INVOKER_ARTEFACT_CACHE=true`` and only in
+local mode.  ``CORE_INVOKER_ARTEFACT_CACHE_MB`` sets the size (default 256).
+"""
+
+from typing import Any, Iterator
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import io
+import os
+import time
+import threading
+
+import core_logging as log
+
+import core_framework as util
+
+from . import buckets
+
+CACHE_ENV = "CORE_INVOKER_ARTEFACT_CACHE"
+CACHE_SIZE_ENV = "CORE_INVOKER_ARTEFACT_CACHE_MB"
+
+DEFAULT_CACHE_MB = 256
+DEFAULT_TTL_SECONDS = 900
+DEFAULT_WRITE_WORKERS = 4
+
+_MB = 1024 * 1024
+
+
+class ArtefactCache:
+    """A thread-safe LRU cache of object contents bounded by total size.
+
+    Args:
+        max_bytes (int): Maximum total size of the cached objects.
+        ttl_seconds (float): Entries older than this are treated as missing.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_MB * _MB, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, str], tuple[bytes, float]] = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def size(self) -> int:
+        """int: Total size of the cached objects in bytes."""
+        return self._size
+
+    def get(self, bucket: str, key: str) -> bytes | None:
+        """Return the cached content of an object, or None."""
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+            if entry is None or time.monotonic() - entry[1] > self.ttl_seconds:
+                if entry is not None:
+                    self._remove((bucket, key))
+                self.misses += 1
+                return None
+            self._entries.move_to_end((bucket, key))
+            self.hits += 1
+            return entry[0]
+
+    def put(self, bucket: str, key: str, data: bytes) -> None:
+        """Cache the content of an object, evicting the least recently used objects to make room.
+
+        Objects larger than the cache are not cached.
+        """
+        with self._lock:
+            self._remove((bucket, key))
+            if len(data) > self.max_bytes:
+                return
+            self._entries[(bucket, key)] = (data, time.monotonic())
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, bucket: str, key: str) -> None:
+        """Forget an object."""
+        with self._lock:
+            self._remove((bucket, key))
+
+    def clear(self) -> None:
+        """Forget all objects and reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def _remove(self, entry_key: tuple[str, str]) -> None:
+        entry = self._entries.pop(entry_key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+
+class WriteBehind:
+    """Writes objects to S3 on background threads and tracks the pending writes."""
+
+    def __init__(self, max_workers: int = DEFAULT_WRITE_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="core-invoker-write-behind")
+        self._lock = threading.Lock()
+        self._pending: dict[tuple[str, str], Future] = {}
+
+    def submit(self, bucket: str, key: str, fn, *args, **kwargs) -> Future:
+        """Schedule a write of ``bucket/key``."""
+        future = self._pool.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._pending[(bucket, key)] = future
+        future.add_done_callback(lambda f: self._done(bucket, key, f))
+        return future
+
+    def _done(self, bucket: str, key: str, future: Future) -> None:
+        with self._lock:
+            if self._pending.get((bucket, key)) is future:
+                del self._pending[(bucket, key)]
+
+    def wait_for(self, bucket: str, key: str) -> None:
+        """Wait until a pending write of ``bucket/key`` has finished."""
+        with self._lock:
+            future = self._pending.get((bucket, key))
+        if future is not None:
+            wait([future])
+
+
+class _Scope:
+    """The writes made while one ``scope()`` was active."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._writes: dict[Future, str] = {}
+
+    def track(self, future: Future, bucket: str, key: str) -> None:
+        with self._lock:
+            self._writes[future] = f"s3://{bucket}/{key}"
+
+    def flush(self) -> None:
+        """Wait for the writes of this scope.
+
+        Raises:
+            RuntimeError: If any of them failed.
+        """
+        with self._lock:
+            writes, self._writes = self._writes, {}
+        wait(list(writes))
+        errors = [f"{target}: {future.exception()}" for future, target in writes.items() if future.exception() is not None]
+        if errors:
+            raise RuntimeError("Write-behind failed for {} object(s): {}".format(len(errors), "; ".join(errors)))
+
+
+def _read_body(body: Any) -> bytes:
+    if body is None:
+        return b""
+    if isinstance(body, bytes):
+        return body
+    if isinstance(body, str):
+        return body.encode("utf-8")
+    if hasattr(body, "read"):
+        data = body.read()
+        return data.encode("utf-8") if isinstance(data, str) else data
+    return bytes(body)
+
+
+class CachingObject:
+    """Wraps an S3 object so that writes go to the cache and reads hit it first."""
+
+    def __init__(self, bucket: "CachingBucket", key: str):
+        self._bucket = bucket
+        self._object = bucket._bucket.Object(key)
+        self.key = key
+
+    def get(self, **kwargs) -> dict:
+        data = self._bucket._cached(self.key)
+        if data is not None:
+            return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+        self._bucket._wait_pending(self.key)
+        return self._object.get(**kwargs)
+
+    def put(self, **kwargs) -> dict:
+        return self._bucket._write(self.key, kwargs, lambda **kw: self._object.put(**kw))
+
+    def copy_from(self, **kwargs) -> Any:
+        self._bucket._invalidate(self.key)
+        return self._object.copy_from(**kwargs)
+
+    def delete(self, **kwargs) -> Any:
+        self._bucket._invalidate(self.key)
+        return self._object.delete(**kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._object, name)
+
+
+class CachingBucket:
+    """Wraps a bucket returned by ``MagicS3Client.get_bucket``.
+
+    Args:
+        bucket (Any): The real bucket.
+        bucket_name (str): The bucket name (part of the cache key).
+        cache (ArtefactCache): The shared cache.
+        writer (WriteBehind): The shared background writer.
+    """
+
+    def __init__(self, bucket: Any, bucket_name: str, cache: ArtefactCache, writer: WriteBehind):
+        self._bucket = bucket
+        self._bucket_name = bucket_name
+        self._cache = cache
+        self._writer = writer
+
+    def _cached(self, key: str) -> bytes | None:
+        return self._cache.get(self._bucket_name, key)
+
+    def _wait_pending(self, key: str) -> None:
+        # An evicted object may still be on its way to S3
+        self._writer.wait_for(self._bucket_name, key)
+
+    def _invalidate(self, key: str) -> None:
+        self._writer.wait_for(self._bucket_name, key)
+        self._cache.invalidate(self._bucket_name, key)
+
+    def _write(self, key: str, kwargs: dict, write) -> dict:
+        data = _read_body(kwargs.get("Body"))
+        kwargs = dict(kwargs, Body=data)
+        active = _current_scope.get()
+        if active is None:
+            # The bucket outlived its scope: write through
+            self._invalidate(key)
+            return write(**kwargs)
+        self._cache.put(self._bucket_name, key, data)
+        active.track(self._writer.submit(self._bucket_name, key, write, **kwargs), self._bucket_name, key)
+        return {"Key": key, "ContentLength": len(data), "WriteBehind": True}
+
+    def Object(self, key: str) -> CachingObject:
+        return CachingObject(self, key)
+
+    def put_object(self, **kwargs) -> dict:
+        return self._write(kwargs["Key"], kwargs, self._bucket.put_object)
+
+    def download_fileobj(self, Key: str, Fileobj: Any, **kwargs) -> None:
+        data = self._cached(Key)
+        if data is not None:
+            Fileobj.write(data)
+            return
+        self._wait_pending(Key)
+        self._bucket.download_fileobj(Key, Fileobj, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._bucket, name)
+
+
+_cache: ArtefactCache | None = None
+_writer: WriteBehind | None = None
+_current_scope: ContextVar[_Scope | None] = ContextVar("core_invoker_artefact_cache_scope", default=None)
+
+
+def is_cache_enabled() -> bool:
+    """Return True if the artefact cache is switched on and we are in local mode."""
+    return os.getenv(CACHE_ENV, "false").lower() in ("1", "true", "yes") and util.is_local_mode()
+
+
+def get_cache() -> ArtefactCache:
+    """Return the process-wide artefact cache."""
+    global _cache
+    if _cache is None:
+        _cache = ArtefactCache(int(os.getenv(CACHE_SIZE_ENV, DEFAULT_CACHE_MB)) * _MB)
+    return _cache
+
+
+def _get_writer() -> WriteBehind:
+    global _writer
+    if _writer is None:
+        _writer = WriteBehind()
+    return _writer
+
+
+def _wrap_bucket(get_bucket, *args, **kwargs) -> Any:
+    bucket = get_bucket(*args, **kwargs)
+    if _current_scope.get() is None:
+        return bucket
+    bucket_name = kwargs.get("BucketName") or getattr(bucket, "name", "")
+    return CachingBucket(bucket, bucket_name, get_cache(), _get_writer())
+
+
+@contextmanager
+def scope(enabled: bool | None = None) -> Iterator[ArtefactCache | None]:
+    """Route bucket access through the artefact cache for the duration of the block.
+
+    The scope applies to the current context (thread or task).  Scopes may be
+    nested or overlap across threads; each one flushes the writes made while
+    it was the innermost scope of its context when it exits.
+
+    Args:
+        enabled (bool, optional): Override ``is_cache_enabled()``.
+
+    Yields:
+        ArtefactCache | None: The cache, or None if the cache is disabled.
+
+    Raises:
+        RuntimeError: On exit, if a write made in the scope failed.
+    """
+    if not (is_cache_enabled() if enabled is None else enabled):
+        yield None
+        return
+
+    buckets.add_wrapper(_wrap_bucket)
+    active = _Scope()
+    token = _current_scope.set(active)
+    try:
+        yield get_cache()
+    finally:
+        _current_scope.reset(token)
+        cache = get_cache()
+        log.debug(
+            "Artefact cache: {} hits, {} misses, {} evictions, {:.1f} MB",
+            cache.hits,
+            cache.misses,
+            cache.evictions,
+            cache.size / _MB,
+        )
+        active.flush()
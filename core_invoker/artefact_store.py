@@ -0,0 +1,493 @@
+"""
+Content-addressed storage for compiled artefacts and packages.
+
+Artefacts are stored once as blobs keyed by their SHA-256 digest.  A small
+ref document maps a deployment (portfolio/app/branch/build) to the digests
+of its objects.  Promoting unchanged content from one build to another, for
+example from branch "latest" to a release build, then only writes a new ref
+instead of copying and compiling again.
+
+Layout under the store prefix (default "artefacts/cas"):
+
+    blobs/sha256/ab/ab12...ef              the content
+    refs/<deployment folder>.json          {"Objects": {"package.zip": {"Digest": "sha256:ab12...", "Size": 1024}}}
+
+Blobs that are no longer referenced by any ref are removed by
+``ContentAddressedStore.collect_garbage()``.  Reusing a blob refreshes its
+modification time so a blob that was just referenced again is inside the
+collector's grace period.
+
+The compilers and the runner read the classic
+``dd.get_object_key(OBJ_ARTEFACTS, ...)`` layout.  With
+``CORE_INVOKER_ARTEFACT_STORE=true`` the invoker captures that folder after
+every compile.  A compile of a deployment that was promoted (its ref has
+"PromotedFrom") writes the promoted blobs into the classic layout instead of
+copying the package and compiling again.  Release tooling calls
+``promote()`` to create such a deployment.
+
+The store works against any backend implementing ``StorageBackend``;
+``S3Backend`` is used in AWS and ``MemoryBackend`` is a local stand-in for
+tests and Core Docker.
+
+Example:
+    >>> store = ContentAddressedStore(MemoryBackend())
+    >>> store.stage(dd_latest, {"package.zip": data})
+    >>> store.promote(dd_latest, dd_release)   # writes one small ref object
+    >>> store.collect_garbage()
+"""
+
+from typing import Iterator, Protocol
+from datetime import datetime, timezone, timedelta
+
+import os
+import json
+import hashlib
+import threading
+
+import core_logging as log
+
+import core_framework as util
+from core_framework.constants import OBJ_ARTEFACTS
+from core_framework.models import DeploymentDetails
+
+from core_helper.magic import MagicS3Client
+
+STORE_ENV = "CORE_INVOKER_ARTEFACT_STORE"
+
+DIGEST_ALGORITHM = "sha256"
+
+DEFAULT_PREFIX = f"{OBJ_ARTEFACTS}/cas"
+
+REF_VERSION = 1
+
+# Status of the compile response for a promoted deployment, as returned by the compilers
+STATUS_COMPILE_COMPLETE = "COMPILE_COMPLETE"
+
+# Blobs younger than this are never collected; they may belong to a ref that is still being written
+DEFAULT_GC_GRACE = timedelta(hours=1)
+
+
+class StorageBackend(Protocol):
+    """The object operations the content-addressed store needs."""
+
+    def put(self, key: str, data: bytes) -> None:  # pragma: no cover - protocol
+        ...
+
+    def get(self, key: str) -> bytes | None:  # pragma: no cover - protocol
+        ...
+
+    def exists(self, key: str) -> bool:  # pragma: no cover - protocol
+        ...
+
+    def touch(self, key: str) -> None:  # pragma: no cover - protocol
+        ...
+
+    def modified(self, key: str) -> datetime | None:  # pragma: no cover - protocol
+        ...
+
+    def delete(self, key: str) -> None:  # pragma: no cover - protocol
+        ...
+
+    def list(self, prefix: str) -> Iterator[tuple[str, datetime]]:  # pragma: no cover - protocol
+        ...
+
+
+class MemoryBackend:
+    """An in-memory stand-in for an S3 bucket."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects: dict[str, tuple[bytes, datetime]] = {}
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            self._objects[key] = (bytes(data), datetime.now(timezone.utc))
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            item = self._objects.get(key)
+        return item[0] if item else None
+
+    def exists(self, key: str) -> bool:
+        with self._lock:
+            return key in self._objects
+
+    def touch(self, key: str) -> None:
+        with self._lock:
+            if key in self._objects:
+                self._objects[key] = (self._objects[key][0], datetime.now(timezone.utc))
+
+    def modified(self, key: str) -> datetime | None:
+        with self._lock:
+            item = self._objects.get(key)
+        return item[1] if item else None
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._objects.pop(key, None)
+
+    def list(self, prefix: str) -> Iterator[tuple[str, datetime]]:
+        with self._lock:
+            items = [(key, modified) for key, (_data, modified) in self._objects.items() if key.startswith(prefix)]
+        yield from sorted(items)
+
+
+class S3Backend:
+    """Objects in an S3 bucket.
+
+    Args:
+        region (str): The bucket region.  Defaults to the artefacts bucket region.
+        bucket_name (str): The bucket name.  Defaults to the artefacts bucket.
+    """
+
+    def __init__(self, region: str | None = None, bucket_name: str | None = None):
+        self.region = region or util.get_artefact_bucket_region()
+        self.bucket_name = bucket_name or util.get_artefact_bucket_name()
+
+    def _bucket(self):
+        return MagicS3Client.get_bucket(Region=self.region, BucketName=self.bucket_name)
+
+    def put(self, key: str, data: bytes) -> None:
+        self._bucket().put_object(Key=key, Body=data, ServerSideEncryption="AES256")
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            response = self._bucket().Object(key).get()
+        except Exception as e:
+            log.debug("Object {} not found: {}", key, e)
+            return None
+        return response["Body"].read()
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._bucket().Object(key).load()
+            return True
+        except Exception:
+            return False
+
+    def touch(self, key: str) -> None:
+        # Copying an object onto itself with new metadata refreshes LastModified
+        self._bucket().Object(key).copy_from(
+            CopySource={"Bucket": self.bucket_name, "Key": key},
+            MetadataDirective="REPLACE",
+            ServerSideEncryption="AES256",
+        )
+
+    def modified(self, key: str) -> datetime | None:
+        try:
+            obj = self._bucket().Object(key)
+            obj.load()
+        except Exception as e:
+            log.debug("Object {} not found: {}", key, e)
+            return None
+        return obj.last_modified
+
+    def delete(self, key: str) -> None:
+        self._bucket().Object(key).delete()
+
+    def list(self, prefix: str) -> Iterator[tuple[str, datetime]]:
+        for summary in self._bucket().objects.filter(Prefix=prefix):
+            yield summary.key, summary.last_modified
+
+
+def _deployment_prefix(dd: DeploymentDetails) -> str:
+    """Return the artefacts folder of a deployment, e.g. "artefacts/portfolio/app/branch/build"."""
+    return dd.get_object_key(OBJ_ARTEFACTS, "ref.json").rsplit("/", 1)[0]
+
+
+def compute_digest(data: bytes) -> str:
+    """Return the digest of the content in "sha256:<hex>" form."""
+    return f"{DIGEST_ALGORITHM}:{hashlib.sha256(data).hexdigest()}"
+
+
+class ContentAddressedStore:
+    """Blobs keyed by digest plus refs that map deployments to digests.
+
+    Args:
+        backend (StorageBackend): Where objects are stored.  Defaults to the artefacts bucket.
+        prefix (str): Key prefix for blobs and refs.  Defaults to "artefacts/cas".
+    """
+
+    def __init__(self, backend: StorageBackend | None = None, prefix: str = DEFAULT_PREFIX):
+        self.backend = backend or S3Backend()
+        self.prefix = prefix.rstrip("/")
+
+    def blob_key(self, digest: str) -> str:
+        """Return the object key of a blob."""
+        algorithm, _, hexdigest = digest.partition(":")
+        if algorithm != DIGEST_ALGORITHM or len(hexdigest) != 64:
+            raise ValueError(f"Invalid digest '{digest}'")
+        return f"{self.prefix}/blobs/{algorithm}/{hexdigest[:2]}/{hexdigest}"
+
+    def ref_key(self, dd: DeploymentDetails) -> str:
+        """Return the object key of the ref for a deployment."""
+        return f"{self.prefix}/refs/{_deployment_prefix(dd)}.json"
+
+    def put_blob(self, data: bytes) -> tuple[str, bool]:
+        """Store content unless a blob with the same digest exists.
+
+        A reused blob is touched so the garbage collector sees it as recent.
+
+        Args:
+            data (bytes): The content.
+
+        Returns:
+            tuple[str, bool]: The digest and True if the blob was written, False if it was reused.
+        """
+        digest = compute_digest(data)
+        key = self.blob_key(digest)
+        if self.backend.exists(key):
+            self.backend.touch(key)
+            return digest, False
+        self.backend.put(key, data)
+        return digest, True
+
+    def get_blob(self, digest: str) -> bytes:
+        """Return the content of a blob.
+
+        Raises:
+            KeyError: If the blob does not exist.
+        """
+        data = self.backend.get(self.blob_key(digest))
+        if data is None:
+            raise KeyError(digest)
+        return data
+
+    def read_ref(self, dd: DeploymentDetails) -> dict | None:
+        """Return the ref document of a deployment, or None if the deployment has no ref."""
+        data = self.backend.get(self.ref_key(dd))
+        return json.loads(data) if data else None
+
+    def write_ref(self, dd: DeploymentDetails, objects: dict[str, dict], promoted_from: str | None = None) -> dict:
+        """Write the ref document of a deployment.
+
+        Args:
+            dd (DeploymentDetails): The deployment.
+            objects (dict[str, dict]): Object name to {"Digest": ..., "Size": ...}.
+            promoted_from (str, optional): The deployment folder the objects were promoted from.
+
+        Returns:
+            dict: The ref document.
+        """
+        ref = {
+            "Version": REF_VERSION,
+            "Deployment": _deployment_prefix(dd),
+            "Created": datetime.now(timezone.utc).isoformat(),
+            "Objects": objects,
+        }
+        if promoted_from:
+            ref["PromotedFrom"] = promoted_from
+        self.backend.put(self.ref_key(dd), json.dumps(ref, sort_keys=True).encode("utf-8"))
+        return ref
+
+    def stage(self, dd: DeploymentDetails, files: dict[str, bytes]) -> dict:
+        """Store the objects of a deployment and point its ref at them.
+
+        Content that is already stored is not written again.
+
+        Args:
+            dd (DeploymentDetails): The deployment.
+            files (dict[str, bytes]): Object name to content.
+
+        Returns:
+            dict: {"Ref": <ref document>, "Written": <blobs written>, "Reused": <blobs reused>}
+        """
+        objects = {}
+        written = 0
+        for name, data in files.items():
+            digest, was_written = self.put_blob(data)
+            written += int(was_written)
+            objects[name] = {"Digest": digest, "Size": len(data)}
+
+        ref = self.write_ref(dd, objects)
+        log.info("Staged {} objects ({} new blobs) for {}", len(objects), written, ref["Deployment"])
+        return {"Ref": ref, "Written": written, "Reused": len(objects) - written}
+
+    def capture(self, dd: DeploymentDetails) -> dict:
+        """Stage the objects the compilers wrote to the artefacts folder of a deployment.
+
+        The compilers write to the classic ``dd.get_object_key(OBJ_ARTEFACTS, ...)``
+        layout.  Capturing turns that folder into blobs and a ref so later
+        builds with the same content can be promoted instead of recompiled.
+
+        Args:
+            dd (DeploymentDetails): The deployment.
+
+        Returns:
+            dict: The result of ``stage()``.
+        """
+        folder = _deployment_prefix(dd) + "/"
+        files = {}
+        for key, _modified in self.backend.list(folder):
+            data = self.backend.get(key)
+            if data is not None:
+                files[key[len(folder):]] = data
+        return self.stage(dd, files)
+
+    def promote(self, source: DeploymentDetails, target: DeploymentDetails) -> dict:
+        """Point the target deployment at the content of the source deployment.
+
+        Only the ref of the target is written; no blobs are copied.  The next
+        compile of the target writes the blobs into its artefacts folder
+        (see ``materialize()``) instead of compiling.
+
+        Raises:
+            KeyError: If the source deployment has no ref.
+
+        Returns:
+            dict: The ref document of the target.
+        """
+        ref = self.read_ref(source)
+        if ref is None:
+            raise KeyError(f"No artefact ref for {_deployment_prefix(source)}")
+        return self.write_ref(target, ref["Objects"], promoted_from=ref["Deployment"])
+
+    def materialize(self, dd: DeploymentDetails) -> dict | None:
+        """Write the objects of a promoted deployment into its classic artefacts folder.
+
+        Args:
+            dd (DeploymentDetails): The deployment.
+
+        Returns:
+            dict | None: The ref document, or None if the deployment was not promoted.
+        """
+        ref = self.read_ref(dd)
+        if ref is None or not ref.get("PromotedFrom"):
+            return None
+        folder = _deployment_prefix(dd)
+        for name, entry in ref["Objects"].items():
+            self.backend.put(f"{folder}/{name}", self.get_blob(entry["Digest"]))
+        log.info("Wrote {} promoted objects from {} to {}", len(ref["Objects"]), ref["PromotedFrom"], folder)
+        return ref
+
+    def read_object(self, dd: DeploymentDetails, name: str) -> bytes:
+        """Return the content of one object of a deployment.
+
+        Raises:
+            KeyError: If the deployment has no ref or the ref has no such object.
+        """
+        ref = self.read_ref(dd)
+        if ref is None or name not in ref["Objects"]:
+            raise KeyError(name)
+        return self.get_blob(ref["Objects"][name]["Digest"])
+
+    def _referenced_digests(self) -> tuple[int, set[str]]:
+        """Return the number of refs and the digests they point at."""
+        referenced: set[str] = set()
+        refs = 0
+        for key, _modified in self.backend.list(f"{self.prefix}/refs/"):
+            data = self.backend.get(key)
+            if not data:
+                continue
+            refs += 1
+            referenced.update(entry["Digest"] for entry in json.loads(data).get("Objects", {}).values())
+        return refs, referenced
+
+    def collect_garbage(self, grace: timedelta = DEFAULT_GC_GRACE, dry_run: bool = False) -> dict:
+        """Delete blobs that no ref points at.
+
+        Blobs modified (written or reused) within ``grace`` are kept so
+        content staged by a concurrent writer that has not yet written its
+        ref survives.  The refs are read again before deleting, so a blob
+        that a ref written during the scan points at is kept as well, and
+        each blob's modification time is read again just before it is
+        deleted, so a blob reused during the scan is kept even if its ref
+        has not been written yet.
+
+        Args:
+            grace (timedelta): Minimum age of a blob before it can be deleted.  Defaults to one hour.
+            dry_run (bool): Report what would be deleted without deleting.
+
+        Returns:
+            dict: {"Refs": <refs scanned>, "Blobs": <blobs scanned>, "Deleted": [<digest>, ...]}
+        """
+        refs, referenced = self._referenced_digests()
+
+        cutoff = datetime.now(timezone.utc) - grace
+        blob_prefix = f"{self.prefix}/blobs/{DIGEST_ALGORITHM}/"
+        candidates = {}
+        blobs = 0
+        for key, modified in self.backend.list(blob_prefix):
+            blobs += 1
+            digest = f"{DIGEST_ALGORITHM}:{key.rsplit('/', 1)[-1]}"
+            if digest in referenced or modified > cutoff:
+                continue
+            candidates[digest] = key
+
+        # Refs written while the blobs were listed may point at a candidate
+        if candidates:
+            refs, referenced = self._referenced_digests()
+
+        deleted = []
+        for digest, key in candidates.items():
+            if digest in referenced:
+                continue
+            # put_blob touches a reused blob before the ref that points at it is written
+            modified = self.backend.modified(key)
+            if modified is None or modified > cutoff:
+                continue
+            if not dry_run:
+                self.backend.delete(key)
+            deleted.append(digest)
+
+        log.info("Artefact garbage collection: {} refs, {} blobs, {} unreferenced", refs, blobs, len(deleted))
+        return {"Refs": refs, "Blobs": blobs, "Deleted": deleted}
+
+
+_store: ContentAddressedStore | None = None
+
+
+def set_store(store: ContentAddressedStore | None) -> None:
+    """Install the store used on the compile path.  Pass None to restore the default."""
+    global _store
+    _store = store
+
+
+def get_store() -> ContentAddressedStore:
+    """Return the store used on the compile path (the artefacts bucket by default)."""
+    global _store
+    if _store is None:
+        _store = ContentAddressedStore()
+    return _store
+
+
+def is_enabled() -> bool:
+    """Return True if the compile path uses the store."""
+    return os.getenv(STORE_ENV, "false").lower() in ("1", "true", "yes")
+
+
+def compile_promoted(dd: DeploymentDetails) -> dict | None:
+    """Answer the compile of a promoted deployment from the store.
+
+    Args:
+        dd (DeploymentDetails): The deployment to compile.
+
+    Returns:
+        dict | None: The compile response, or None if the deployment must be compiled.
+    """
+    if not is_enabled():
+        return None
+    ref = get_store().materialize(dd)
+    if ref is None:
+        return None
+    return {
+        "Status": STATUS_COMPILE_COMPLETE,
+        "Message": f"Promoted from {ref['PromotedFrom']}; not compiled again",
+        "Ref": ref,
+    }
+
+
+def capture_compiled(dd: DeploymentDetails) -> None:
+    """Capture the artefacts of a compiled deployment so later builds can be promoted from it.
+
+    A failure is logged; the compile itself has succeeded.
+
+    Args:
+        dd (DeploymentDetails): The deployment that was compiled.
+    """
+    if not is_enabled():
+        return
+    try:
+        get_store().capture(dd)
+    except Exception as e:
+        log.warning("Could not capture the artefacts of {}: {}", _deployment_prefix(dd), e)
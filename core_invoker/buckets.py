@@ -0,0 +1,84 @@
+"""
+A single interception point for ``MagicS3Client.get_bucket``.
+
+The compilers and the runner get their buckets from
+``MagicS3Client.get_bucket``.  Invoker features that need to see those
+buckets (the local-mode artefact cache, traffic recording and replay) do not
+replace the classmethod themselves; they register a bucket wrapper here:
+
+    def wrapper(get_bucket, *args, **kwargs):
+        return MyBucket(get_bucket(*args, **kwargs))
+
+    buckets.add_wrapper(wrapper)
+
+A wrapper is called with the next provider in the chain and the arguments
+of ``get_bucket``; the last provider is the original ``get_bucket``.  The
+most recently added wrapper runs first.  A wrapper decides on every call
+whether it applies (for example from a ContextVar) and otherwise returns
+``get_bucket(*args, **kwargs)`` unchanged.
+
+The classmethod is replaced once by a dispatcher that runs the chain and is
+never put back, so wrappers can be added and removed in any order without
+one of them restoring a stale wrapper of another.
+"""
+
+from typing import Any, Callable
+
+import inspect
+import functools
+import threading
+
+from core_helper.magic import MagicS3Client
+
+BucketWrapper = Callable[..., Any]
+
+_lock = threading.Lock()
+_wrappers: list[BucketWrapper] = []
+_original: Any = None
+
+
+def _call(cls, wrappers: list[BucketWrapper], original: Any, index: int, *args, **kwargs) -> Any:
+    if index < 0:
+        return original.__get__(None, cls)(*args, **kwargs)
+    next_provider = functools.partial(_call, cls, wrappers, original, index - 1)
+    return wrappers[index](next_provider, *args, **kwargs)
+
+
+def _dispatch(cls, *args, **kwargs) -> Any:
+    with _lock:
+        wrappers = list(_wrappers)
+        original = _original
+    return _call(cls, wrappers, original, len(wrappers) - 1, *args, **kwargs)
+
+
+_dispatcher = classmethod(_dispatch)
+
+
+def _install() -> None:
+    """Put the dispatcher in front of ``MagicS3Client.get_bucket`` unless it is already there."""
+    global _original
+    current = inspect.getattr_static(MagicS3Client, "get_bucket")
+    if current is not _dispatcher:
+        _original = current
+        MagicS3Client.get_bucket = _dispatcher
+
+
+def add_wrapper(wrapper: BucketWrapper, innermost: bool = False) -> None:
+    """Route ``MagicS3Client.get_bucket`` through a wrapper.  Adding a wrapper twice has no effect.
+
+    Args:
+        wrapper (BucketWrapper): Called as ``wrapper(get_bucket, *args, **kwargs)``.
+        innermost (bool): Run the wrapper after all the others, just before the original
+            ``get_bucket``.  Use it for a wrapper that replaces the buckets altogether.
+    """
+    with _lock:
+        _install()
+        if wrapper not in _wrappers:
+            _wrappers.insert(0 if innermost else len(_wrappers), wrapper)
+
+
+def remove_wrapper(wrapper: BucketWrapper) -> None:
+    """Stop routing ``MagicS3Client.get_bucket`` through a wrapper."""
+    with _lock:
+        if wrapper in _wrappers:
+            _wrappers.remove(wrapper)
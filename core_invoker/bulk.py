@@ -0,0 +1,341 @@
+"""
+Bulk deploy and teardown across the apps of a portfolio.
+
+A bulk request runs the same runner task for many apps.  The apps and
+their declared dependencies form a DAG which is executed in topological
+waves: every app in a wave runs in parallel (bounded by ``max_parallel``)
+and a wave starts when the previous one has finished.  The runner only
+starts an app's step function, so an app has finished when its step function
+execution has ended: the execution is polled until then, and its status
+decides whether the app succeeded.  Deploys run
+dependencies first; teardowns run in the reverse order so dependants are
+removed before the apps they depend on.  When an app fails, every app that
+depends on it (directly or transitively) is skipped while independent
+branches carry on.
+
+A bulk request is a TaskPayload dump (the template for every app) with an
+extra "bulk" selector:
+
+    {
+        ...TaskPayload fields...,
+        "bulk": {
+            "apps": ["network", {"app": "db", "depends_on": ["network"]}, {"app": "web", "depends_on": ["db"]}],
+            "include": ["*"],
+            "max_parallel": 4
+        }
+    }
+
+The apps are resolved by a pluggable resolver.  The default takes them
+from "apps" in the selector when it is given, and otherwise from the app
+registry of the portfolio (core_db); a registry app declares its
+dependencies with ``Metadata: {"DependsOn": [...]}``.  "include" filters
+the apps in both cases, so ``{"bulk": {"include": ["web-*"]}}`` deploys
+every registered web app.
+"""
+
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from fnmatch import fnmatch
+
+import re
+import contextvars
+
+import core_logging as log
+
+from core_framework.constants import TASK_TEARDOWN
+from core_framework.models import TaskPayload
+
+from . import tracing, executions, deadline
+from .responses import is_failure
+from .invoker import execute_runner
+
+BULK = "bulk"
+
+DEFAULT_MAX_PARALLEL = 4
+
+NODE_SUCCEEDED = "succeeded"
+NODE_FAILED = "failed"
+NODE_SKIPPED = "skipped"
+
+
+@dataclass
+class BulkNode:
+    """One app of a bulk operation.
+
+    Attributes:
+        app (str): The app name.
+        depends_on (list[str]): Apps that must be deployed before this one.
+    """
+
+    app: str
+    depends_on: list[str] = field(default_factory=list)
+
+
+AppResolver = Callable[[TaskPayload, dict], list[BulkNode]]
+
+
+def selector_resolver(task_payload: TaskPayload, selector: dict) -> list[BulkNode]:
+    """Resolve the apps listed in the bulk selector.
+
+    Entries are app names or ``{"app": ..., "depends_on": [...]}``.  The
+    optional "include" glob patterns filter the apps by name.
+
+    Args:
+        task_payload (TaskPayload): The template task payload.
+        selector (dict): The bulk selector.
+
+    Returns:
+        list[BulkNode]: The selected apps.
+    """
+    include = selector.get("include") or ["*"]
+    nodes = []
+    for entry in selector.get("apps", []):
+        if isinstance(entry, str):
+            node = BulkNode(app=entry)
+        else:
+            node = BulkNode(app=entry["app"], depends_on=list(entry.get("depends_on", [])))
+        if any(fnmatch(node.app, pattern) for pattern in include):
+            nodes.append(node)
+    return nodes
+
+
+# Metadata key of a registry app that lists the apps it depends on
+DEPENDS_ON_METADATA = "DependsOn"
+
+_APP_REGEX = re.compile(r"^\^?prn:[^:]+:([\w.-]+):")
+
+
+def registry_resolver(task_payload: TaskPayload, selector: dict) -> list[BulkNode]:
+    """Resolve the apps registered for the portfolio of the template task payload.
+
+    Apps are read from the app registry of the client.  An app registered
+    with a pattern (for example ``^prn:portfolio:.*:.*:.*$``) rather than a
+    name is ignored.  The optional "include" glob patterns filter the apps
+    by name.
+
+    Args:
+        task_payload (TaskPayload): The template task payload.
+        selector (dict): The bulk selector.
+
+    Returns:
+        list[BulkNode]: The registered apps.
+    """
+    # Imported here so the registry is only loaded for bulk requests
+    from core_db.registry.app import AppFactsFactory
+
+    dd = task_payload.deployment_details
+    include = selector.get("include") or ["*"]
+
+    nodes: dict[str, BulkNode] = {}
+    for facts in AppFactsFactory.get_model(dd.client).query(dd.portfolio):
+        match = _APP_REGEX.match(facts.AppRegex or "")
+        if not match:
+            log.debug("Skipping registry entry {}: not a single app", facts.AppRegex)
+            continue
+        app = match.group(1)
+        if app in nodes or not any(fnmatch(app, pattern) for pattern in include):
+            continue
+        depends_on = (facts.Metadata or {}).get(DEPENDS_ON_METADATA) or []
+        nodes[app] = BulkNode(app=app, depends_on=list(depends_on))
+    return list(nodes.values())
+
+
+def default_resolver(task_payload: TaskPayload, selector: dict) -> list[BulkNode]:
+    """Resolve the apps listed in the selector, or the registered apps when the selector lists none."""
+    if selector.get("apps"):
+        return selector_resolver(task_payload, selector)
+    return registry_resolver(task_payload, selector)
+
+
+_resolver: AppResolver = default_resolver
+
+
+def set_resolver(resolver: AppResolver | None) -> None:
+    """Install the resolver that turns a bulk selector into apps.  Pass None to restore the default.
+
+    A resolver is called with the template task payload and the selector and
+    returns the list of ``BulkNode``, for example from the app registry.
+    """
+    global _resolver
+    _resolver = resolver or default_resolver
+
+
+def resolve_apps(task_payload: TaskPayload, selector: dict) -> list[BulkNode]:
+    """Resolve the apps of a bulk selector with the installed resolver."""
+    return _resolver(task_payload, selector)
+
+
+def build_waves(nodes: list[BulkNode], reverse: bool = False) -> list[list[str]]:
+    """Group apps into waves that can run in parallel.
+
+    Dependencies on apps that are not part of the selection are ignored.
+
+    Args:
+        nodes (list[BulkNode]): The apps.
+        reverse (bool): Reverse the dependencies (for teardown).
+
+    Returns:
+        list[list[str]]: App names per wave, sorted within a wave.
+
+    Raises:
+        ValueError: If an app is listed twice or the dependencies contain a cycle.
+    """
+    names = [node.app for node in nodes]
+    if len(set(names)) != len(names):
+        raise ValueError("Apps must be listed only once")
+
+    # requires[a] = apps that must finish before a
+    requires: dict[str, set[str]] = {name: set() for name in names}
+    for node in nodes:
+        for dependency in node.depends_on:
+            if dependency not in requires:
+                log.warning("App {} depends on {} which is not part of the bulk operation", node.app, dependency)
+                continue
+            if reverse:
+                requires[dependency].add(node.app)
+            else:
+                requires[node.app].add(dependency)
+
+    waves = []
+    done: set[str] = set()
+    while len(done) < len(names):
+        wave = sorted(name for name in names if name not in done and requires[name] <= done)
+        if not wave:
+            cycle = sorted(name for name in names if name not in done)
+            raise ValueError("Dependency cycle between apps: {}".format(", ".join(cycle)))
+        waves.append(wave)
+        done.update(wave)
+    return waves
+
+
+def _dependants(nodes: list[BulkNode], reverse: bool) -> dict[str, set[str]]:
+    """Return, for every app, the apps that must not run if it fails."""
+    names = {node.app for node in nodes}
+    dependants: dict[str, set[str]] = {name: set() for name in names}
+    for node in nodes:
+        for dependency in node.depends_on:
+            if dependency not in names:
+                continue
+            if reverse:
+                dependants[node.app].add(dependency)
+            else:
+                dependants[dependency].add(node.app)
+    return dependants
+
+
+def app_task_payload(task_payload: TaskPayload, app: str) -> TaskPayload:
+    """Build the task payload of one app from the template.
+
+    The template is copied, so options such as ``dry_run``, ``force``, the
+    identity and the flow control carry over to every app.  Only the
+    deployment details, the package, actions and state locations (and the
+    correlation id, which identifies the app's execution) are taken from
+    ``TaskPayload.from_arguments`` for the app.
+    """
+    dd = task_payload.deployment_details
+    located = TaskPayload.from_arguments(
+        task=task_payload.task,
+        client=dd.client,
+        portfolio=dd.portfolio,
+        app=app,
+        branch=dd.branch,
+        build=dd.build,
+    )
+    app_payload = task_payload.model_copy(deep=True)
+    app_payload.correlation_id = located.correlation_id
+    app_payload.deployment_details = located.deployment_details
+    app_payload.package = located.package
+    app_payload.actions = located.actions
+    app_payload.state = located.state
+    return app_payload
+
+
+def _wait_timeout() -> float | None:
+    """Return the seconds left to wait for an execution before the invocation's deadline."""
+    stages = deadline.get_current()
+    remaining = stages.remaining_ms()
+    if remaining is None:
+        return None
+    return max(0.0, (remaining - stages.reserve_ms) / 1000.0)
+
+
+def execute_bulk(
+    task_payload: TaskPayload,
+    nodes: list[BulkNode],
+    max_parallel: int = DEFAULT_MAX_PARALLEL,
+    execute: Callable[[TaskPayload], dict] | None = None,
+    payload_factory: Callable[[TaskPayload, str], TaskPayload] = app_task_payload,
+    poll_interval: float = executions.DEFAULT_POLL_INTERVAL,
+) -> dict:
+    """Run the task of ``task_payload`` for every app in dependency-ordered waves.
+
+    Args:
+        task_payload (TaskPayload): The template task (deploy, release or teardown).
+        nodes (list[BulkNode]): The apps and their dependencies.
+        max_parallel (int): Maximum number of apps running at the same time.
+        execute (Callable, optional): Runs one app.  Defaults to ``execute_runner``.
+        payload_factory (Callable): Builds the task payload of one app.
+        poll_interval (float): Seconds between status checks of an app's step function execution.
+
+    Returns:
+        dict: {"Status": "ok" | "error", "Waves": [[app, ...], ...], "Results": {app: {"Status": ..., ...}}}
+    """
+    execute = execute or execute_runner
+
+    reverse = task_payload.task == TASK_TEARDOWN
+    waves = build_waves(nodes, reverse=reverse)
+    dependants = _dependants(nodes, reverse=reverse)
+
+    results: dict[str, dict] = {}
+    blocked: set[str] = set()
+
+    def block(app: str) -> None:
+        for dependant in dependants[app]:
+            if dependant not in blocked:
+                blocked.add(dependant)
+                block(dependant)
+
+    def run(app: str) -> dict:
+        with tracing.start_span("invoker.bulk.app", {"app": app, "task": task_payload.task}):
+            response = execute(payload_factory(task_payload, app))
+            if is_failure(response):
+                return {"Status": NODE_FAILED, "Response": response}
+
+            arn = executions.execution_arn(response)
+            if arn is None:
+                # The runner finished in process; there is no execution to wait for
+                return {"Status": NODE_SUCCEEDED, "Response": response}
+
+            outcome = executions.wait_for_execution(arn, poll_interval=poll_interval, timeout=_wait_timeout())
+        if outcome["Status"] == executions.STATUS_COMPLETE:
+            return {"Status": NODE_SUCCEEDED, "Response": response, "Execution": outcome}
+        message = outcome.get("Message") or "Execution was still running at the deadline"
+        return {"Status": NODE_FAILED, "Response": response, "Execution": outcome, "Message": message}
+
+    log.info("Bulk {} of {} apps in {} waves", task_payload.task, len(nodes), len(waves), details={"Waves": waves})
+
+    with tracing.start_span("invoker.bulk", {"task": task_payload.task, "apps": len(nodes), "waves": len(waves)}):
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as pool:
+            for number, wave in enumerate(waves, start=1):
+                runnable = []
+                for app in wave:
+                    if app in blocked:
+                        results[app] = {"Status": NODE_SKIPPED, "Message": "A dependency failed"}
+                    else:
+                        runnable.append(app)
+
+                futures = {app: pool.submit(contextvars.copy_context().run, run, app) for app in runnable}
+                for app, future in futures.items():
+                    try:
+                        results[app] = future.result()
+                    except Exception as e:
+                        results[app] = {"Status": NODE_FAILED, "Message": str(e)}
+                    if results[app]["Status"] == NODE_FAILED:
+                        log.error("Bulk {} failed for app {}", task_payload.task, app)
+                        block(app)
+
+                log.debug("Bulk wave {} of {} finished: {}", number, len(waves), runnable)
+
+    failed = any(result["Status"] != NODE_SUCCEEDED for result in results.values())
+    return {"Status": "error" if failed else "ok", "Waves": waves, "Results": results}
@@ -0,0 +1,317 @@
+"""
+Deadline-aware execution with resumable stage checkpoints.
+
+A compile or deploy runs in stages: "copy" (package to artefacts),
+"compile" and "runner"; a plan runs in a single "plan" stage.  Each invocation has a deadline: the Lambda
+timeout (``context.get_remaining_time_in_millis()``), or an earlier
+``"deadline"`` (epoch milliseconds) set in the event by the caller.
+
+Before a stage starts, the invoker checks that the stage's time budget fits
+in the time left (keeping a reserve to return the response).  If it does
+not, the invocation stops and returns a resumable response instead of being
+killed by the Lambda timeout:
+
+    {"Response": {"Status": "continue", "Stage": "compile", "Message": ...,
+                  "Checkpoint": {"completed": ["copy"]}}}
+
+Re-submit the original event with ``"checkpoint"`` set to that checkpoint to
+pick up where the previous invocation stopped; completed stages are skipped.
+A checkpoint that already includes the last stage of the task has nothing
+left to run and is answered with
+
+    {"Response": {"Status": "completed", "Stage": "runner", "Message": ...,
+                  "Checkpoint": {"completed": ["copy", "compile", "runner"]}}}
+
+The remaining deadline is passed downstream in the payload (``"deadline"``)
+so the compilers and the runner can make the same decision.  A stage that
+has started is not interrupted.
+
+Stage budgets start at ``DEFAULT_STAGE_BUDGETS_MS`` and follow the measured
+stage durations (with a safety margin) once a stage has run.
+"""
+
+from typing import Any, Callable, TypeVar
+from contextvars import ContextVar
+
+import time
+import threading
+
+import core_logging as log
+
+from . import policy, tracing, streaming
+
+DEADLINE = "deadline"
+CHECKPOINT = "checkpoint"
+
+STATUS_CONTINUE = "continue"
+STATUS_COMPLETED = "completed"
+
+STAGE_COPY = "copy"
+STAGE_COMPILE = "compile"
+STAGE_RUNNER = "runner"
+STAGE_PLAN = "plan"
+
+DEFAULT_STAGE_BUDGETS_MS = {
+    STAGE_COPY: 2000.0,
+    STAGE_COMPILE: 10000.0,
+    STAGE_RUNNER: 5000.0,
+    STAGE_PLAN: 10000.0,
+}
+
+# Time kept back to build and return the response
+DEFAULT_RESERVE_MS = 1000.0
+
+# Budget = measured duration * margin, never below the default budget
+BUDGET_MARGIN = 1.5
+
+EWMA_ALPHA = 0.3
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage does not fit in the time left.
+
+    Attributes:
+        stage (str): The stage that was not started.
+        remaining_ms (float): The time left.
+        budget_ms (float): The budget of the stage.
+        completed (list[str]): The stages completed so far.
+    """
+
+    def __init__(self, stage: str, remaining_ms: float, budget_ms: float, completed: list[str]):
+        super().__init__(f"Not enough time left for stage {stage}: {remaining_ms:.0f} ms left, {budget_ms:.0f} ms budgeted")
+        self.stage = stage
+        self.remaining_ms = remaining_ms
+        self.budget_ms = budget_ms
+        self.completed = completed
+
+
+class _StageBudgets:
+    """Measured stage durations (EWMA) shared by all invocations of the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ewma: dict[str, float] = {}
+
+    def budget(self, stage: str) -> float:
+        default = DEFAULT_STAGE_BUDGETS_MS.get(stage, 0.0)
+        with self._lock:
+            measured = self._ewma.get(stage)
+        if measured is None:
+            return default
+        return max(default, measured * BUDGET_MARGIN)
+
+    def record(self, stage: str, duration_ms: float) -> None:
+        with self._lock:
+            previous = self._ewma.get(stage)
+            if previous is None:
+                self._ewma[stage] = duration_ms
+            else:
+                self._ewma[stage] = EWMA_ALPHA * duration_ms + (1 - EWMA_ALPHA) * previous
+
+    def reset(self) -> None:
+        with self._lock:
+            self._ewma.clear()
+
+
+_budgets = _StageBudgets()
+
+
+def get_budgets() -> _StageBudgets:
+    """Return the process-wide stage budgets."""
+    return _budgets
+
+
+class Deadline:
+    """The deadline of one invocation and the stages it has completed.
+
+    Args:
+        expires_at_ms (float, optional): The deadline in epoch milliseconds.  None means no deadline.
+        completed (list[str], optional): Stages completed by earlier invocations.
+        reserve_ms (float): Time kept back to return the response.
+    """
+
+    def __init__(
+        self,
+        expires_at_ms: float | None = None,
+        completed: list[str] | None = None,
+        reserve_ms: float = DEFAULT_RESERVE_MS,
+    ):
+        self.expires_at_ms = expires_at_ms
+        self.completed = list(completed or [])
+        self.reserve_ms = reserve_ms
+
+    def remaining_ms(self) -> float | None:
+        """Return the time left in milliseconds, or None if there is no deadline."""
+        if self.expires_at_ms is None:
+            return None
+        return self.expires_at_ms - time.time() * 1000.0
+
+    def check(self, stage: str) -> None:
+        """Make sure the budget of a stage fits in the time left.
+
+        Raises:
+            DeadlineExceeded: If the stage should not be started.
+        """
+        remaining = self.remaining_ms()
+        if remaining is None:
+            return
+        budget = get_budgets().budget(stage)
+        if budget > remaining - self.reserve_ms:
+            raise DeadlineExceeded(stage, remaining, budget, list(self.completed))
+
+    def run_stage(self, stage: str, fn: Callable[[], T]) -> T | None:
+        """Run a stage unless an earlier invocation completed it.
+
+        Args:
+            stage (str): The stage name.
+            fn (Callable): Runs the stage.
+
+        Returns:
+            The result of ``fn``, or None if the stage was skipped.
+
+        Raises:
+            DeadlineExceeded: If the stage does not fit in the time left.
+        """
+        if stage in self.completed:
+            log.info("Stage {} was completed by an earlier invocation, skipping", stage)
+            return None
+
+        self.check(stage)
+        streaming.emit(streaming.EVENT_STAGE_STARTED, stage=stage, remaining_ms=self.remaining_ms())
+
+        start = time.perf_counter()
+        result = fn()
+        duration_ms = (time.perf_counter() - start) * 1000.0
+
+        get_budgets().record(stage, duration_ms)
+        self.completed.append(stage)
+        log.debug("Stage {} completed in {:.0f} ms", stage, duration_ms)
+        streaming.emit(streaming.EVENT_STAGE_FINISHED, stage=stage, duration_ms=round(duration_ms, 1))
+        return result
+
+    def run_final_stage(self, stage: str, fn: Callable[[], dict]) -> dict:
+        """Run the last stage of a task.
+
+        Args:
+            stage (str): The stage name.
+            fn (Callable): Runs the stage and returns the invoker response.
+
+        Returns:
+            dict: The response of ``fn``, or a "completed" response if an earlier invocation completed the stage.
+
+        Raises:
+            DeadlineExceeded: If the stage does not fit in the time left.
+        """
+        if stage in self.completed:
+            log.info("Stage {} was completed by an earlier invocation, nothing left to run", stage)
+            return completed_response(stage, list(self.completed))
+        return self.run_stage(stage, fn)
+
+
+_current: ContextVar[Deadline | None] = ContextVar("core_invoker_deadline", default=None)
+
+
+def from_invocation(event: dict, context: Any | None) -> Deadline:
+    """Build the deadline of an invocation and remove the deadline keys from the event.
+
+    The deadline is the earlier of the Lambda timeout and the ``"deadline"``
+    in the event.  The completed stages come from the ``"checkpoint"`` in the event.
+
+    Args:
+        event (dict): The incoming event.  ``"deadline"`` and ``"checkpoint"`` are removed.
+        context (Any, optional): Lambda context object.
+
+    Returns:
+        Deadline: The deadline.
+    """
+    candidates = []
+
+    requested = event.pop(DEADLINE, None)
+    if requested is not None:
+        candidates.append(float(requested))
+
+    policy.set_lambda_context(context)
+    remaining = policy.remaining_time_ms()
+    if remaining is not None:
+        candidates.append(time.time() * 1000.0 + remaining)
+
+    checkpoint = event.pop(CHECKPOINT, None) or {}
+
+    return Deadline(expires_at_ms=min(candidates) if candidates else None, completed=checkpoint.get("completed"))
+
+
+def set_current(deadline: Deadline | None) -> None:
+    """Make a deadline the deadline of the current invocation."""
+    _current.set(deadline)
+
+
+def get_current() -> Deadline:
+    """Return the deadline of the current invocation (no deadline if none was set)."""
+    return _current.get() or Deadline()
+
+
+def remaining_ms() -> float | None:
+    """Return the time left in the current invocation, or None if there is no deadline."""
+    return get_current().remaining_ms()
+
+
+def inject(payload: dict) -> dict:
+    """Add the deadline of the current invocation to a downstream payload.
+
+    Args:
+        payload (dict): The payload to be sent downstream.
+
+    Returns:
+        dict: The same payload, with "deadline" set if there is one.
+    """
+    deadline = get_current()
+    if deadline.expires_at_ms is not None:
+        payload[DEADLINE] = int(deadline.expires_at_ms)
+    return payload
+
+
+def continue_response(error: DeadlineExceeded) -> dict:
+    """Build the resumable response for a stage that did not fit.
+
+    Args:
+        error (DeadlineExceeded): The exceeded deadline.
+
+    Returns:
+        dict: {"Response": {"Status": "continue", "Stage": ..., "Message": ..., "Checkpoint": ...}}
+    """
+    span = tracing.current_span()
+    if span is not None:
+        span.set_attribute("deadline_stage", error.stage)
+
+    log.warning("Stopping before stage {}: {}", error.stage, error, details={"Completed": error.completed})
+    return {
+        "Response": {
+            "Status": STATUS_CONTINUE,
+            "Stage": error.stage,
+            "Message": str(error),
+            "RemainingMs": int(error.remaining_ms),
+            "Checkpoint": {"completed": error.completed},
+        }
+    }
+
+
+def completed_response(stage: str, completed: list[str]) -> dict:
+    """Build the response for a task whose last stage an earlier invocation completed.
+
+    Args:
+        stage (str): The last stage of the task.
+        completed (list[str]): The completed stages from the checkpoint.
+
+    Returns:
+        dict: {"Response": {"Status": "completed", "Stage": ..., "Message": ..., "Checkpoint": ...}}
+    """
+    return {
+        "Response": {
+            "Status": STATUS_COMPLETED,
+            "Stage": stage,
+            "Message": f"Stage {stage} was completed by an earlier invocation",
+            "Checkpoint": {"completed": completed},
+        }
+    }
@@ -0,0 +1,373 @@
+"""
+Execution handles for runner tasks started without waiting.
+
+When a deploy, release or teardown is started in fire-and-forget mode the
+invoker returns an execution handle keyed by the task correlation_id.  The
+progress of the execution is kept in an execution store and can be looked up
+with the "status" task, which is answered without validating a TaskPayload
+or touching the runner.
+
+In local mode the store is in memory (the runner runs on a background thread
+of the same process).  In Lambda mode the store is a small JSON document per
+execution in the artefacts bucket.  The runner Lambda is invoked
+asynchronously and its result is recorded when the invoker receives the
+Lambda destination record (configure the invoker as the OnSuccess/OnFailure
+destination of the runner function).
+
+The runner only starts the deployment's step function, so a runner that
+returned is recorded as STARTED, not COMPLETE.  When its result contains the
+step function execution ARN (``executionArn``), the ARN is stored with the
+record and the "status" task resolves the progress from Step Functions:
+RUNNING, COMPLETE or FAILED.
+"""
+
+from typing import Any, Callable, Protocol
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import json
+import time
+import threading
+
+import boto3
+
+import core_logging as log
+
+import core_framework as util
+from core_framework.constants import OBJ_ARTEFACTS, TR_RESPONSE
+
+from core_helper.magic import MagicS3Client
+
+TASK_STATUS = "status"
+
+# Key in the incoming event that selects fire-and-forget execution
+INVOCATION_MODE = "invocation_mode"
+MODE_ASYNC = "async"
+
+STATUS_SUBMITTED = "SUBMITTED"
+STATUS_RUNNING = "RUNNING"
+STATUS_STARTED = "STARTED"
+STATUS_COMPLETE = "COMPLETE"
+STATUS_FAILED = "FAILED"
+STATUS_UNKNOWN = "UNKNOWN"
+
+# Statuses that still change
+ACTIVE_STATUSES = (STATUS_SUBMITTED, STATUS_RUNNING, STATUS_STARTED)
+
+# Step Functions execution status to execution record status
+_STEP_FUNCTION_STATUSES = {
+    "RUNNING": STATUS_RUNNING,
+    "PENDING_REDRIVE": STATUS_RUNNING,
+    "SUCCEEDED": STATUS_COMPLETE,
+    "FAILED": STATUS_FAILED,
+    "TIMED_OUT": STATUS_FAILED,
+    "ABORTED": STATUS_FAILED,
+}
+
+_EXECUTION_ARN_KEYS = ("executionArn", "ExecutionArn")
+
+# Execution records kept by the in-memory store of a warm container
+DEFAULT_MAX_RECORDS = 1000
+
+DEFAULT_POLL_INTERVAL = 5.0
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _get(event: dict, *keys: str) -> Any:
+    for key in keys:
+        if key in event:
+            return event[key]
+    return None
+
+
+class ExecutionStore(Protocol):
+    """Persists execution records keyed by correlation_id."""
+
+    def get(self, execution_id: str) -> dict | None:  # pragma: no cover - protocol
+        ...
+
+    def put(self, execution_id: str, record: dict) -> None:  # pragma: no cover - protocol
+        ...
+
+
+class InMemoryExecutionStore:
+    """Execution records held in process memory.  Used in local mode.
+
+    Args:
+        max_records (int): Records kept; the least recently updated are dropped first.
+    """
+
+    def __init__(self, max_records: int = DEFAULT_MAX_RECORDS):
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self._records: OrderedDict[str, dict] = OrderedDict()
+
+    def get(self, execution_id: str) -> dict | None:
+        with self._lock:
+            record = self._records.get(execution_id)
+            return dict(record) if record else None
+
+    def put(self, execution_id: str, record: dict) -> None:
+        with self._lock:
+            self._records[execution_id] = dict(record)
+            self._records.move_to_end(execution_id)
+            while len(self._records) > self.max_records:
+                self._records.popitem(last=False)
+
+
+class S3ExecutionStore:
+    """Execution records stored as JSON documents in the artefacts bucket.
+
+    Args:
+        region (str): The artefacts bucket region.
+        bucket_name (str): The artefacts bucket name.
+        prefix (str): Key prefix for execution records.  Defaults to "artefacts/executions".
+    """
+
+    def __init__(self, region: str, bucket_name: str, prefix: str = f"{OBJ_ARTEFACTS}/executions"):
+        self.region = region
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def _key(self, execution_id: str) -> str:
+        return f"{self.prefix}/{execution_id}.json"
+
+    def get(self, execution_id: str) -> dict | None:
+        bucket = MagicS3Client.get_bucket(Region=self.region, BucketName=self.bucket_name)
+        try:
+            response = bucket.Object(self._key(execution_id)).get()
+        except Exception as e:
+            log.debug("No execution record for {}: {}", execution_id, e)
+            return None
+        body = response.get("Body") if response else None
+        if body is None:
+            return None
+        return json.loads(body.read())
+
+    def put(self, execution_id: str, record: dict) -> None:
+        bucket = MagicS3Client.get_bucket(Region=self.region, BucketName=self.bucket_name)
+        bucket.put_object(
+            Key=self._key(execution_id),
+            Body=json.dumps(record, default=str).encode("utf-8"),
+            ContentType="application/json",
+            ServerSideEncryption="AES256",
+        )
+
+
+_store: ExecutionStore | None = None
+_store_lock = threading.Lock()
+
+
+def set_store(store: ExecutionStore | None) -> None:
+    """Install the execution store.  Pass None to restore the default."""
+    global _store
+    _store = store
+
+
+def get_store() -> ExecutionStore:
+    """Return the execution store, creating the default one for the current mode on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if util.is_local_mode():
+                _store = InMemoryExecutionStore()
+            else:
+                _store = S3ExecutionStore(util.get_artefact_bucket_region(), util.get_artefact_bucket_name())
+        return _store
+
+
+StepFunctionsClientFactory = Callable[[str], Any]
+
+
+def default_client_factory(region: str) -> Any:
+    """Return a Step Functions client for a region."""
+    return boto3.client("stepfunctions", region_name=region)
+
+
+_client_factory: StepFunctionsClientFactory = default_client_factory
+
+
+def set_client_factory(factory: StepFunctionsClientFactory | None) -> None:
+    """Install the factory that creates Step Functions clients.  Pass None to restore the default."""
+    global _client_factory
+    _client_factory = factory or default_client_factory
+
+
+def execution_arn(result: Any) -> str | None:
+    """Return the step function execution ARN in a runner result, or None if it has none."""
+    if isinstance(result, dict):
+        for key in _EXECUTION_ARN_KEYS:
+            value = result.get(key)
+            if isinstance(value, str) and value.startswith("arn:"):
+                return value
+        for value in result.values():
+            found = execution_arn(value)
+            if found:
+                return found
+    return None
+
+
+def describe_execution(arn: str) -> dict:
+    """Return the progress of a step function execution.
+
+    Args:
+        arn (str): The execution ARN.
+
+    Returns:
+        dict: {"Status": "RUNNING" | "COMPLETE" | "FAILED", "StepFunctionStatus": ..., "ExecutionArn": ...}
+    """
+    region = arn.split(":")[3]
+    response = _client_factory(region).describe_execution(executionArn=arn)
+    state = response.get("status", "")
+    outcome = {"Status": _STEP_FUNCTION_STATUSES.get(state, STATUS_RUNNING), "StepFunctionStatus": state, "ExecutionArn": arn}
+    if response.get("error"):
+        outcome["Message"] = response.get("cause") or response["error"]
+    return outcome
+
+
+def wait_for_execution(arn: str, poll_interval: float = DEFAULT_POLL_INTERVAL, timeout: float | None = None) -> dict:
+    """Poll a step function execution until it ends or the timeout passes.
+
+    Args:
+        arn (str): The execution ARN.
+        poll_interval (float): Seconds between status checks.
+        timeout (float, optional): Seconds to wait.  None waits until the execution ends.
+
+    Returns:
+        dict: The last result of ``describe_execution``.  Its status is RUNNING if the timeout passed.
+    """
+    expires = None if timeout is None else time.monotonic() + timeout
+    while True:
+        outcome = describe_execution(arn)
+        if outcome["Status"] != STATUS_RUNNING:
+            return outcome
+        if expires is not None and time.monotonic() + poll_interval > expires:
+            return outcome
+        time.sleep(poll_interval)
+
+
+def record_runner_result(execution_id: str, result: Any) -> dict:
+    """Record the result of a runner that returned.
+
+    The runner has started the step function; the record is STARTED and keeps
+    the execution ARN so the status can be resolved later.
+
+    Args:
+        execution_id (str): The correlation_id of the task.
+        result (Any): The "Response" of the runner.
+
+    Returns:
+        dict: The updated record.
+    """
+    arn = execution_arn(result)
+    if arn:
+        return update(execution_id, STATUS_STARTED, Result=result, ExecutionArn=arn)
+    return update(execution_id, STATUS_STARTED, Result=result)
+
+
+def update(execution_id: str, status: str, **fields) -> dict:
+    """Create or update an execution record.
+
+    Args:
+        execution_id (str): The correlation_id of the task.
+        status (str): The new status.
+        **fields: Additional fields to record (e.g. Task, Result, Message).
+
+    Returns:
+        dict: The updated record.
+    """
+    store = get_store()
+    record = store.get(execution_id) or {"ExecutionId": execution_id, "Submitted": _now()}
+    record.update(fields)
+    record["Status"] = status
+    record["Updated"] = _now()
+    store.put(execution_id, record)
+    return record
+
+
+def execution_handle(execution_id: str) -> dict:
+    """Return the task response for a newly started execution.
+
+    Args:
+        execution_id (str): The correlation_id of the task.
+
+    Returns:
+        dict: ``{"Response": {"ExecutionId": ..., "Status": "SUBMITTED", ...}}``
+    """
+    record = get_store().get(execution_id) or {"ExecutionId": execution_id, "Status": STATUS_SUBMITTED}
+    return {TR_RESPONSE: record}
+
+
+def is_status_request(event: dict) -> bool:
+    """Return True if the event is a "status" task."""
+    return _get(event, "task", "Task") == TASK_STATUS
+
+
+def get_status(event: dict) -> dict:
+    """Answer a "status" task.
+
+    Args:
+        event (dict): ``{"task": "status", "correlation_id": "<execution id>"}``
+
+    Returns:
+        dict: The task response with the execution record, or status UNKNOWN.
+
+    Raises:
+        ValueError: If the event does not name an execution.
+    """
+    execution_id = _get(event, "correlation_id", "CorrelationId", "execution_id", "ExecutionId")
+    if not execution_id:
+        raise ValueError("Status task requires a correlation_id")
+
+    record = get_store().get(execution_id)
+    if record is None:
+        record = {"ExecutionId": execution_id, "Status": STATUS_UNKNOWN}
+    elif record.get("ExecutionArn") and record["Status"] in ACTIVE_STATUSES:
+        record = _resolve(execution_id, record)
+    return {TR_RESPONSE: record}
+
+
+def _resolve(execution_id: str, record: dict) -> dict:
+    """Update a record from the status of its step function execution."""
+    try:
+        outcome = describe_execution(record["ExecutionArn"])
+    except Exception as e:
+        log.warning("Could not read the step function status of execution {}: {}", execution_id, e)
+        return record
+    fields = {key: value for key, value in outcome.items() if key not in ("Status", "ExecutionArn")}
+    if outcome["Status"] == record["Status"] and fields.items() <= record.items():
+        return record
+    return update(execution_id, outcome["Status"], **fields)
+
+
+def is_destination_record(event: dict) -> bool:
+    """Return True if the event is a Lambda asynchronous invocation destination record."""
+    return isinstance(event.get("requestContext"), dict) and "requestPayload" in event
+
+
+def record_destination(event: dict) -> dict:
+    """Record the outcome of an asynchronous runner invocation.
+
+    Args:
+        event (dict): The destination record sent by Lambda.
+
+    Returns:
+        dict: The task response with the updated execution record.
+    """
+    request = event.get("requestPayload") or {}
+    execution_id = _get(request, "correlation_id", "CorrelationId")
+    if not execution_id:
+        raise ValueError("Destination record does not contain a correlation_id")
+
+    condition = event["requestContext"].get("condition")
+    response = event.get("responsePayload")
+    if condition == "Success" and isinstance(response, dict) and TR_RESPONSE in response:
+        record = record_runner_result(execution_id, response[TR_RESPONSE])
+    else:
+        record = update(execution_id, STATUS_FAILED, Condition=condition, Result=response)
+
+    log.info("Runner of execution {} returned with status {}", execution_id, record["Status"])
+    return {TR_RESPONSE: record}
@@ -17,10 +17,13 @@ from .invoker import (
     execute_pipeline_compiler,
     execute_deployspec_compiler,
     execute_runner,
+    start_runner,
 )
 
 from core_framework.models import TaskPayload
 
+from . import tracing, profiling, executions, bulk, recording, plan, deadline, streaming, admission, artefact_store, responses
+
 
 def handler(event: dict, context: Any | None = None) -> dict:
     """
@@ -29,6 +32,21 @@ def handler(event: dict, context: Any | None = None) -> dict:
     This function directs the incoming task to the appropriate execution engine
     based on the task type. It returns a Task Response object as a dictionary.
 
+    Set ``"invocation_mode": "async"`` in the event to start deploy, release and
+    teardown tasks without waiting for the runner; the response is an execution
+    handle.  ``{"task": "status", "correlation_id": ...}`` returns the progress
+    of such an execution.  A ``"bulk"`` selector runs the task for many apps
+    in dependency order (see ``core_invoker.bulk``).
+
+    A stage that would overrun the Lambda timeout (or the ``"deadline"`` in the
+    event) is not started; the response has status "continue" and a checkpoint
+    to resume from (see ``core_invoker.deadline``).
+
+    With admission control switched on, lower priority tasks (see
+    ``"priority"`` and ``core_invoker.admission``) for a saturated downstream
+    target are answered right away with status "retry" and a "RetryAfter" in
+    seconds.
+
     :param event: The Lambda event, typically created with TaskPayload.model_dump().
     :type event: dict
     :param context: Lambda context object (optional).
@@ -39,7 +57,40 @@ def handler(event: dict, context: Any | None = None) -> dict:
 
     :raises ValueError: If the task type is unsupported.
     """
+    recorder = recording.get_recorder()
+    if recorder is not None:
+        return recorder.record_invocation(_invoke, event, context)
+    return _invoke(event, context)
+
+
+def _invoke(event: dict, context: Any | None = None) -> dict:
+    """
+    Validates the event and routes it.  See :func:`handler`.
+
+    :param event: The Lambda event.
+    :type event: dict
+    :param context: Lambda context object (optional).
+    :type context: Any, optional
+
+    :returns: Dictionary with a "Response" key containing the result.
+    :rtype: dict
+    """
     try:
+        # The trace context and deadline are not part of the TaskPayload; remove them before validation
+        event = dict(event)
+        parent = tracing.extract(event)
+        deadline.set_current(deadline.from_invocation(event, context))
+
+        # Status lookups and async runner completions are answered without a TaskPayload
+        if executions.is_status_request(event):
+            return executions.get_status(event)
+        if executions.is_destination_record(event):
+            return executions.record_destination(event)
+
+        run_async = event.pop(executions.INVOCATION_MODE, None) == executions.MODE_ASYNC
+        bulk_selector = event.pop(bulk.BULK, None)
+        priority = admission.priority_of(event, event.get("task", ""), bulk=bulk_selector is not None)
+
         task_payload = TaskPayload.model_validate(event)
 
         log.set_correlation_id(task_payload.correlation_id)
@@ -51,68 +102,179 @@ def handler(event: dict, context: Any | None = None) -> dict:
             task_payload.type,
         )
 
+        with tracing.start_span(
+            "invoker.handler",
+            {"type": task_payload.type, "task": task_payload.task},
+            parent=parent,
+            correlation_id=task_payload.correlation_id,
+        ), profiling.profile(task_payload.type, task_payload.task):
+            # Shed low priority work while the downstream target is saturated
+            target = admission.target_of(task_payload.type, task_payload.task)
+            return admission.run(target, priority, lambda: _route(task_payload, run_async, bulk_selector))
+
+    except Exception as e:
+        log.error("Error executing task: {}", e)
+        return {"Response": {"Status": "error", "Message": str(e)}}
+
+
+def _route(task_payload: TaskPayload, run_async: bool, bulk_selector: dict | None) -> dict:
+    """
+    Routes a validated task to its handler.
+
+    :param task_payload: The task payload object.
+    :type task_payload: TaskPayload
+    :param run_async: Start the runner without waiting and return an execution handle.
+    :type run_async: bool
+    :param bulk_selector: The bulk selector, if the task runs for many apps.
+    :type bulk_selector: dict, optional
+
+    :returns: Dictionary with a "Response" key containing the result.
+    :rtype: dict
+
+    :raises ValueError: If the task type is unsupported or a bulk task is to run asynchronously.
+    """
+    try:
+        if bulk_selector is not None:
+            if run_async:
+                raise ValueError("Bulk operations cannot run asynchronously")
+            return _handle_bulk(task_payload, bulk_selector)
+
         if task_payload.type == V_PIPELINE:
-            return _handle_pipeline(task_payload)
+            return _handle_pipeline(task_payload, run_async)
 
         if task_payload.type == V_DEPLOYSPEC:
-            return _handle_deployspec(task_payload)
+            return _handle_deployspec(task_payload, run_async)
 
-        raise ValueError(f"Unsupported task type '{task_payload.type}'")
+    except deadline.DeadlineExceeded as e:
+        # Stop before a stage that would overrun and let the caller resume
+        return deadline.continue_response(e)
 
-    except Exception as e:
-        log.error("Error executing task: {}", e)
-        return {"Response": {"Status": "error", "Message": str(e)}}
+    raise ValueError(f"Unsupported task type '{task_payload.type}'")
+
+
+def _handle_bulk(task_payload: TaskPayload, selector: dict) -> dict:
+    """
+    Runs a deploy, release or teardown for many apps in dependency order.
+
+    :param task_payload: The template task payload for every app.
+    :type task_payload: TaskPayload
+    :param selector: The bulk selector (apps, dependencies, include patterns, max_parallel).
+    :type selector: dict
 
+    :returns: Dictionary with a "Response" key containing the per-app results.
+    :rtype: dict
 
-def _handle_deployspec(task_payload: TaskPayload) -> dict:
+    :raises ValueError: If the task is unsupported or the apps cannot be ordered.
+    """
+    if task_payload.task not in [TASK_DEPLOY, TASK_RELEASE, TASK_TEARDOWN]:
+        raise ValueError(f"Unsupported bulk task '{task_payload.task}'")
+
+    nodes = bulk.resolve_apps(task_payload, selector)
+    if not nodes:
+        raise ValueError("Bulk selector did not select any apps")
+
+    max_parallel = int(selector.get("max_parallel", bulk.DEFAULT_MAX_PARALLEL))
+    stages = deadline.get_current()
+    return stages.run_final_stage(
+        deadline.STAGE_RUNNER, lambda: {"Response": bulk.execute_bulk(task_payload, nodes, max_parallel=max_parallel)}
+    )
+
+
+def _handle_deployspec(task_payload: TaskPayload, run_async: bool = False) -> dict:
     """
     Handles deployment actions for a deploy spec.
 
     :param task_payload: The task payload object.
     :type task_payload: TaskPayload
+    :param run_async: Start the runner without waiting and return an execution handle.
+    :type run_async: bool
 
     :returns: Dictionary with a "Response" key containing the result.
     :rtype: dict
 
     :raises ValueError: If the task is unsupported.
     """
+    stages = deadline.get_current()
+
     if task_payload.task == TASK_COMPILE:
+        # A promoted build already has its compiled artefacts in the store
+        promoted = artefact_store.compile_promoted(task_payload.deployment_details)
+        if promoted is not None:
+            return promoted
         # Compile the package
-        compiler_response = execute_deployspec_compiler(task_payload)
+        compiler_response = stages.run_final_stage(deadline.STAGE_COMPILE, lambda: execute_deployspec_compiler(task_payload))
+        if not responses.is_failure(compiler_response):
+            artefact_store.capture_compiled(task_payload.deployment_details)
         return compiler_response
 
     if task_payload.task == TASK_PLAN:
-        return {"Response": {"Error": "Not implemented"}}
+        # Preview the changes with change sets built from the compiled actions
+        return stages.run_final_stage(
+            deadline.STAGE_PLAN,
+            lambda: {
+                "Response": plan.execute_plan(
+                    task_payload,
+                    on_result=lambda result: streaming.emit(streaming.EVENT_PLAN_TARGET, target=result),
+                )
+            },
+        )
 
     if task_payload.task == TASK_APPLY:
         return {"Response": {"Error": "Not implemented"}}
 
     if task_payload.task in [TASK_DEPLOY, TASK_TEARDOWN]:
-        return execute_runner(task_payload)
+        return stages.run_final_stage(deadline.STAGE_RUNNER, lambda: _run(task_payload, run_async))
 
     raise ValueError(f"Unsupported task '{task_payload.task}'")
 
 
-def _handle_pipeline(task_payload: TaskPayload) -> dict:
+def _handle_pipeline(task_payload: TaskPayload, run_async: bool = False) -> dict:
     """
     Handles deployment actions for a pipeline.
 
     :param task_payload: The task payload object.
     :type task_payload: TaskPayload
+    :param run_async: Start the runner without waiting and return an execution handle.
+    :type run_async: bool
 
     :returns: Dictionary with a "Response" key containing the result.
     :rtype: dict
 
     :raises ValueError: If the task is unsupported.
     """
+    stages = deadline.get_current()
+
     if task_payload.task == TASK_COMPILE:
+        # A promoted build already has its package and compiled artefacts in the store
+        promoted = artefact_store.compile_promoted(task_payload.deployment_details)
+        if promoted is not None:
+            return promoted
         # Copy package to artefacts bucket / key
-        copy_to_artefacts(task_payload)
+        stages.run_stage(deadline.STAGE_COPY, lambda: copy_to_artefacts(task_payload))
         # Compile the package
-        compiler_response = execute_pipeline_compiler(task_payload)
+        compiler_response = stages.run_final_stage(deadline.STAGE_COMPILE, lambda: execute_pipeline_compiler(task_payload))
+        if not responses.is_failure(compiler_response):
+            artefact_store.capture_compiled(task_payload.deployment_details)
         return compiler_response
 
     if task_payload.task in [TASK_DEPLOY, TASK_RELEASE, TASK_TEARDOWN]:
-        return execute_runner(task_payload)
+        return stages.run_final_stage(deadline.STAGE_RUNNER, lambda: _run(task_payload, run_async))
 
     raise ValueError(f"Unsupported task '{task_payload.task}'")
+
+
+def _run(task_payload: TaskPayload, run_async: bool) -> dict:
+    """
+    Runs the task's actions with the runner.
+
+    :param task_payload: The task payload object.
+    :type task_payload: TaskPayload
+    :param run_async: Start the runner without waiting and return an execution handle.
+    :type run_async: bool
+
+    :returns: Dictionary with a "Response" key containing the result.
+    :rtype: dict
+    """
+    if run_async:
+        return start_runner(task_payload)
+    return execute_runner(task_payload)
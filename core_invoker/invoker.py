@@ -1,4 +1,10 @@
-from typing import OrderedDict
+from typing import Callable, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+import os
+import json
+import time
+import contextvars
 import core_logging as log
 
 import core_framework as util
@@ -10,9 +16,72 @@ from core_component.handler import handler as component_compiler_handler
 from core_deployspec.handler import handler as deployspec_compiler_handler
 from core_runner.handler import handler as runner_handler
 
-from core_framework.models import TaskPayload
+from core_framework.models import TaskPayload, PackageDetails, DeploymentDetails
 from core_helper.magic import MagicS3Client
 
+from . import tracing, executions, artefact_cache, policy, projections, deadline, responses
+
+DEFAULT_STAGING_WORKERS = 8
+
+STAGE_COPIED = "copied"
+STAGE_FAILED = "failed"
+STAGE_ROLLED_BACK = "rolled_back"
+STAGE_KEPT = "kept"
+
+
+def _build_payload(task_payload: TaskPayload, target: str | None = None) -> dict:
+    """
+    Build the payload sent to a downstream handler or Lambda.
+
+    The payload is the projection of the TaskPayload for the target plus the
+    trace context of the active span and the deadline of the invocation.
+
+    Args:
+        task_payload (TaskPayload): the task definition
+        target (str, optional): the name of the target.  None sends the full TaskPayload dump.
+
+    Returns:
+        dict: the payload for the downstream target
+    """
+    return deadline.inject(tracing.inject(projections.project(task_payload, target)))
+
+
+def _dispatch(target: str, local_handler: Callable[[dict, object], dict], arn: str, task_payload: TaskPayload) -> dict:
+    """
+    Send the task to a downstream target, in process or to its Lambda function
+
+    The execution policy decides where the target runs and the outcome is
+    recorded so the policy can learn from it.
+
+    Args:
+        target (str): the name of the target, e.g. "deployspec_compiler"
+        local_handler (Callable): the in-process handler of the target
+        arn (str): the Lambda function of the target
+        task_payload (TaskPayload): the task definition
+
+    Returns:
+        dict: the response of the target
+    """
+    execution_policy = policy.get_policy()
+    decision = execution_policy.decide(target, task_payload, remaining_ms=deadline.remaining_ms())
+    local = decision.mode == policy.MODE_LOCAL
+
+    with tracing.start_span(f"invoker.execute_{target}", {"target": arn, "local": local}):
+        payload = _build_payload(task_payload, target)
+        start = time.perf_counter()
+        ok = False
+        try:
+            if local:
+                with artefact_cache.scope():
+                    response = local_handler(payload, None)
+            else:
+                response = aws.invoke_lambda(arn, payload)
+            ok = TR_RESPONSE in response and not responses.is_failure(response)
+        finally:
+            execution_policy.record(decision, (time.perf_counter() - start) * 1000.0, ok)
+
+    return response
+
 
 def execute_pipeline_compiler(task_payload: TaskPayload) -> dict:
     """
@@ -29,10 +98,7 @@ def execute_pipeline_compiler(task_payload: TaskPayload) -> dict:
 
     arn = util.get_component_compiler_lambda_arn()
 
-    if util.is_local_mode():
-        response = component_compiler_handler(task_payload.model_dump(), None)
-    else:
-        response = aws.invoke_lambda(arn, task_payload.model_dump())
+    response = _dispatch("pipeline_compiler", component_compiler_handler, arn, task_payload)
 
     if TR_RESPONSE not in response:
         raise RuntimeError("Pipeline compiler response does not contain a response: {}".format(response))
@@ -54,10 +120,7 @@ def execute_deployspec_compiler(task_payload: TaskPayload) -> dict:
 
     arn = util.get_deployspec_compiler_lambda_arn()
 
-    if util.is_local_mode():
-        response = deployspec_compiler_handler(task_payload.model_dump(), None)
-    else:
-        response = aws.invoke_lambda(arn, task_payload.model_dump())
+    response = _dispatch("deployspec_compiler", deployspec_compiler_handler, arn, task_payload)
 
     if TR_RESPONSE not in response:
         raise RuntimeError("Deployspec compiler response does not contain a response: {}".format(response))
@@ -82,11 +145,9 @@ def execute_runner(task_payload: TaskPayload) -> dict:
     """
     log.debug("Invoking runner")
 
-    if util.is_local_mode():
-        response = runner_handler(task_payload.model_dump(), None)
-    else:
-        arn = util.get_start_runner_lambda_arn()
-        response = aws.invoke_lambda(arn, task_payload.model_dump())
+    arn = util.get_start_runner_lambda_arn()
+
+    response = _dispatch("runner", runner_handler, arn, task_payload)
 
     if TR_RESPONSE not in response:
         raise RuntimeError("Runner response does not contain a response: {}".format(response))
@@ -94,25 +155,275 @@ def execute_runner(task_payload: TaskPayload) -> dict:
     return response
 
 
+_background_runner: ThreadPoolExecutor | None = None
+
+
+def _run_in_background(task_payload: TaskPayload, payload: dict) -> None:
+    """
+    Run the runner handler in process and record the outcome in the execution store.
+
+    Args:
+        task_payload (TaskPayload): the task definition
+        payload (dict): the payload for the runner handler
+    """
+    execution_id = task_payload.correlation_id
+    executions.update(execution_id, executions.STATUS_RUNNING)
+    try:
+        with artefact_cache.scope():
+            response = runner_handler(payload, None)
+        if TR_RESPONSE not in response:
+            raise RuntimeError("Runner response does not contain a response: {}".format(response))
+        executions.record_runner_result(execution_id, response[TR_RESPONSE])
+    except Exception as e:
+        log.error("Runner execution {} failed: {}", execution_id, e)
+        executions.update(execution_id, executions.STATUS_FAILED, Message=str(e))
+
+
+def start_runner(task_payload: TaskPayload) -> dict:
+    """
+    Start the runner without waiting for it to finish (fire-and-forget)
+
+    Returns an execution handle keyed by the correlation_id right away.  Use
+    the "status" task to follow the execution.
+
+    In local mode the runner handler runs on a background thread.  Otherwise
+    the runner Lambda is invoked asynchronously (InvocationType "Event") and
+    the outcome is recorded from the Lambda destination record.
+
+    Args:
+        task_payload (TaskPayload): the task definition.
+
+    Returns:
+        dict: Task Response with the execution handle
+    """
+    global _background_runner
+
+    execution_id = task_payload.correlation_id
+
+    log.debug("Starting runner asynchronously, execution {}", execution_id)
+
+    with tracing.start_span("invoker.start_runner", {"local": util.is_local_mode(), "execution_id": execution_id}) as span:
+        payload = _build_payload(task_payload, "runner")
+        executions.update(execution_id, executions.STATUS_SUBMITTED, Task=task_payload.task)
+
+        if util.is_local_mode():
+            if _background_runner is None:
+                _background_runner = ThreadPoolExecutor(thread_name_prefix="core-invoker-runner")
+            _background_runner.submit(_run_in_background, task_payload, payload)
+        else:
+            arn = util.get_start_runner_lambda_arn()
+            span.set_attribute("target", arn)
+            region = arn.split(":")[3]
+            client = aws.lambda_client(region=region)
+            response = client.invoke(FunctionName=arn, InvocationType="Event", Payload=json.dumps(payload, default=str))
+            if response.get("StatusCode") != 202:
+                executions.update(execution_id, executions.STATUS_FAILED, Message="Runner was not accepted")
+                raise RuntimeError("Runner async invocation was not accepted: {}".format(response.get("StatusCode")))
+
+    return executions.execution_handle(execution_id)
+
+
 def copy_to_artefacts(task_payload: TaskPayload) -> dict:
     """
-    Copies the packages to the artefacts bucket
+    Copies the package of the task to the artefacts bucket as "package.zip"
 
     Args:
         task_payload (TaskPayload): The task payload
 
     Raises:
-        RuntimeError: Something unexpected happened
+        RuntimeError: The package bucket is not in the artefacts region, or the copy failed
+            (the staged object is rolled back, see ``stage_artefacts``)
         ValueError: Package key not found in task payload
 
     Returns:
-        dict: results of the copy
+        dict: the staging result, {"Status": "ok", "Results": [{"Source", "Destination", "Status", "Message"}]}
     """
+    object_name = "package.zip"  # package.get_name()
 
-    artefact_bucket_region = util.get_artefact_bucket_region()
+    # Report an unusable package with its own error rather than as a failed copy
+    _validate_package(task_payload.package)
+
+    result = stage_artefacts(task_payload, [task_payload.package], object_names=[object_name])
+    if result["Status"] != "ok":
+        raise RuntimeError("Error copying object to artefacts: {}".format(result["Results"][0]["Message"]))
+
+    return result
+
+
+def stage_artefacts(
+    task_payload: TaskPayload,
+    packages: list[PackageDetails],
+    max_workers: int = DEFAULT_STAGING_WORKERS,
+    object_names: list[str] | None = None,
+) -> dict:
+    """
+    Copies several packages to the artefacts bucket concurrently
+
+    Each package is staged under the deployment of the task payload with the
+    file name of its key (e.g. "app-web.zip", "vars.zip") unless object names
+    are given.  Copies run on a bounded worker pool.  If any copy fails, the
+    staging is rolled back so the deployment is never left partially staged:
+    objects that did not exist before are deleted, and objects that were
+    overwritten are restored to their previous version.  In a bucket without
+    versioning an overwritten object cannot be restored and is kept.
+
+    Args:
+        task_payload (TaskPayload): The task payload (provides the deployment details)
+        packages (list[PackageDetails]): The source objects to stage
+        max_workers (int): Maximum number of concurrent copies
+        object_names (list[str], optional): The object name of each package
+
+    Raises:
+        ValueError: Two packages would be staged to the same object name
+
+    Returns:
+        dict: {"Status": "ok" | "error", "Results": [{"Source", "Destination", "Status", "Message"}]}
+    """
+    dd = task_payload.deployment_details
+
+    names = object_names or [os.path.basename(package.key or "") for package in packages]
+    if len(names) != len(packages):
+        raise ValueError("Expected one object name per package")
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError("Packages must have unique object names: {}".format(", ".join(sorted(duplicates))))
+
+    results: list[dict] = [
+        {"Source": f"s3://{package.bucket_name}/{package.key}", "Destination": None, "Status": STAGE_FAILED, "Message": None}
+        for package in packages
+    ]
+    # What was at each destination before this run, for the rollback
+    previous: dict[str, _PreviousObject] = {}
+
+    with tracing.start_span("invoker.stage_artefacts", {"count": len(packages), "max_workers": max_workers}):
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(packages) or 1))) as pool:
+            futures = {
+                pool.submit(contextvars.copy_context().run, _stage_package, package, dd, name): index
+                for index, (package, name) in enumerate(zip(packages, names))
+            }
+            for future in as_completed(futures):
+                result = results[futures[future]]
+                try:
+                    _response, destination_key, before = future.result()
+                    result["Destination"] = destination_key
+                    result["Status"] = STAGE_COPIED
+                    previous[destination_key] = before
+                except Exception as e:
+                    log.error("Failed to stage {}: {}", result["Source"], e)
+                    result["Message"] = str(e)
+
+        failed = any(result["Status"] == STAGE_FAILED for result in results)
+        if failed:
+            _rollback_staging(results, previous)
+
+    return {"Status": "error" if failed else "ok", "Results": results}
+
+
+@dataclass
+class _PreviousObject:
+    """The object at a staging destination before it was overwritten."""
+
+    existed: bool
+    version_id: str | None = None
+
+
+def _head_object(artefact_bucket, key: str) -> _PreviousObject:
+    """
+    Returns whether an object exists, and its version
+
+    Args:
+        artefact_bucket: The bucket
+        key (str): The object key
+
+    Returns:
+        _PreviousObject: The state of the object
+    """
+    obj = artefact_bucket.Object(key)
+    try:
+        obj.load()
+    except Exception:
+        return _PreviousObject(existed=False)
+    version_id = getattr(obj, "version_id", None)
+    return _PreviousObject(existed=True, version_id=None if version_id in (None, "null") else version_id)
+
+
+def _stage_package(package: PackageDetails, dd: DeploymentDetails, object_name: str) -> tuple[dict, str, _PreviousObject]:
+    """
+    Records the object at the destination of a package, then copies the package
+
+    Args:
+        package (PackageDetails): The source object
+        dd (DeploymentDetails): The deployment to stage the package for
+        object_name (str): The object name under the deployment artefacts folder
+
+    Raises:
+        RuntimeError: The package bucket is not in the artefacts region
+        ValueError: Package key not found
+
+    Returns:
+        tuple[dict, str, _PreviousObject]: results of the copy, the destination key and the previous object
+    """
+    _validate_package(package)
+
+    artefact_bucket = MagicS3Client.get_bucket(Region=util.get_artefact_bucket_region(), BucketName=util.get_artefact_bucket_name())
+    before = _head_object(artefact_bucket, _destination_key(package, dd, object_name))
+
+    response, destination_key = _copy_package(package, dd, object_name)
+    return response, destination_key, before
+
+
+def _rollback_staging(results: list[dict], previous: dict[str, _PreviousObject]) -> None:
+    """
+    Undo the copies of a failed staging run
+
+    New objects are deleted and overwritten objects are restored to their
+    previous version.  Overwritten objects without a version are kept.
+
+    Args:
+        results (list[dict]): The per-object results, updated in place
+        previous (dict[str, _PreviousObject]): The object at each destination before the run
+    """
     artefact_bucket_name = util.get_artefact_bucket_name()
+    artefact_bucket = MagicS3Client.get_bucket(Region=util.get_artefact_bucket_region(), BucketName=artefact_bucket_name)
+
+    for result in results:
+        if result["Status"] != STAGE_COPIED:
+            continue
+        destination_key = result["Destination"]
+        before = previous.get(destination_key) or _PreviousObject(existed=False)
+        try:
+            if not before.existed:
+                artefact_bucket.Object(destination_key).delete()
+                result["Status"] = STAGE_ROLLED_BACK
+            elif before.version_id:
+                artefact_bucket.Object(destination_key).copy_from(
+                    ACL="bucket-owner-full-control",
+                    CopySource={"Bucket": artefact_bucket_name, "Key": destination_key, "VersionId": before.version_id},
+                    ServerSideEncryption="AES256",
+                )
+                result["Status"] = STAGE_ROLLED_BACK
+                result["Message"] = "Restored version {}".format(before.version_id)
+            else:
+                log.warning("Cannot restore {}: the artefacts bucket is not versioned", destination_key)
+                result["Status"] = STAGE_KEPT
+                result["Message"] = "Overwrote an existing object that cannot be restored"
+        except Exception as e:
+            log.error("Failed to roll back staged object {}: {}", destination_key, e)
+            result["Message"] = "Rollback failed: {}".format(e)
+
+
+def _validate_package(package: PackageDetails) -> None:
+    """
+    Checks that a package can be copied to the artefacts bucket
+
+    Args:
+        package (PackageDetails): The source object
 
-    package = task_payload.package
+    Raises:
+        RuntimeError: The package bucket is not in the artefacts region
+        ValueError: Package key not found
+    """
+    artefact_bucket_region = util.get_artefact_bucket_region()
     if package.bucket_region != artefact_bucket_region:
         raise RuntimeError(
             artefact_bucket_region,
@@ -121,10 +432,33 @@ def copy_to_artefacts(task_payload: TaskPayload) -> dict:
     if not package.key:
         raise ValueError("Package key not found in task payload")
 
-    object_name = "package.zip"  # package.get_name()
 
-    dd = task_payload.deployment_details
-    destination_key = dd.get_object_key(OBJ_ARTEFACTS, object_name, s3=package.mode == V_SERVICE)
+def _destination_key(package: PackageDetails, dd: DeploymentDetails, object_name: str) -> str:
+    """Returns the artefacts key of a package for a deployment"""
+    return dd.get_object_key(OBJ_ARTEFACTS, object_name, s3=package.mode == V_SERVICE)
+
+
+def _copy_package(package: PackageDetails, dd: DeploymentDetails, object_name: str) -> tuple[dict, str]:
+    """
+    Copies one package to the artefacts folder of a deployment
+
+    The package must have been checked with ``_validate_package``.
+
+    Args:
+        package (PackageDetails): The source object
+        dd (DeploymentDetails): The deployment to stage the package for
+        object_name (str): The object name under the deployment artefacts folder
+
+    Raises:
+        Exception: The copy failed
+
+    Returns:
+        tuple[dict, str]: results of the copy and the destination key
+    """
+    artefact_bucket_region = util.get_artefact_bucket_region()
+    artefact_bucket_name = util.get_artefact_bucket_name()
+
+    destination_key = _destination_key(package, dd, object_name)
 
     copy_source = {"Bucket": package.bucket_name, "Key": package.key, "VersionId": None}
 
@@ -139,18 +473,19 @@ def copy_to_artefacts(task_payload: TaskPayload) -> dict:
         details=OrderedDict([("Source", copy_source), ("Destination", destination)]),
     )
 
-    artefact_bucket = MagicS3Client.get_bucket(Region=artefact_bucket_region, BucketName=artefact_bucket_name)
+    with tracing.start_span("invoker.copy_to_artefacts", {"source": package.key, "destination": destination_key}):
+        artefact_bucket = MagicS3Client.get_bucket(Region=artefact_bucket_region, BucketName=artefact_bucket_name)
 
-    destination_object = artefact_bucket.Object(destination_key)
+        destination_object = artefact_bucket.Object(destination_key)
 
-    # Copy the object
-    response = destination_object.copy_from(
-        ACL="bucket-owner-full-control",
-        CopySource=copy_source,
-        ServerSideEncryption="AES256",
-    )
+        # Copy the object
+        response = destination_object.copy_from(
+            ACL="bucket-owner-full-control",
+            CopySource=copy_source,
+            ServerSideEncryption="AES256",
+        )
 
     if "Error" in response:
         raise Exception("Error copying object to artefacts: {}".format(response["Error"]))
 
-    return response
+    return response, destination_key
@@ -0,0 +1,370 @@
+"""
+Deployspec plan: preview the changes of a deploy with CloudFormation change sets.
+
+The plan reuses the artefacts of the deployspec compile: the compiled
+actions are read from ``task_payload.actions`` and every stack action points
+at an already-rendered template (``TemplateUrl``), so nothing is compiled or
+rendered again.  The package is compiled first only when no compiled actions
+exist yet.
+
+For every stack action (one account and one region each) a change set is
+created and described.  Targets run in parallel on a bounded pool, so the
+preview takes about as long as the slowest target rather than the sum of all
+targets.  Each target's diff is logged as soon as it is ready (and passed to
+an optional ``on_result`` callback); the response aggregates the diffs of
+all targets:
+
+    {
+        "Status": "ok" | "error",
+        "Summary": {"Targets": 3, "Failed": 0, "Add": 2, "Modify": 1, "Remove": 0, "Replace": 0},
+        "Targets": [{"Label": ..., "Account": ..., "Region": ..., "StackName": ...,
+                     "ChangeSetType": "CREATE" | "UPDATE", "Status": "ok" | "error",
+                     "Changes": [{"Action": ..., "LogicalId": ..., "ResourceType": ..., "Replacement": ...}]}],
+        "Skipped": [<labels of actions that do not deploy a stack>]
+    }
+
+Change sets are removed once described; a plan never changes a stack.
+"""
+
+from typing import Any, Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import re
+import time
+import contextvars
+
+import core_logging as log
+
+import core_framework as util
+from core_framework.models import TaskPayload
+
+import core_helper.aws as aws
+from core_helper.magic import MagicS3Client
+
+from . import tracing
+from .invoker import execute_deployspec_compiler
+
+DEFAULT_MAX_PARALLEL = 8
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_TIMEOUT = 300.0
+
+PLAN_OK = "ok"
+PLAN_ERROR = "error"
+
+CHANGE_SET_CREATE = "CREATE"
+CHANGE_SET_UPDATE = "UPDATE"
+
+CAPABILITIES = ["CAPABILITY_IAM", "CAPABILITY_NAMED_IAM", "CAPABILITY_AUTO_EXPAND"]
+
+# Stacks in this state only exist because of a change set and have no resources yet
+_REVIEW_IN_PROGRESS = "REVIEW_IN_PROGRESS"
+
+# The reason CloudFormation gives when a change set would not change anything
+_NO_CHANGES = ("didn't contain changes", "No updates are to be performed")
+
+CfnClientFactory = Callable[[str, str], Any]
+
+
+def default_client_factory(account: str, region: str) -> Any:
+    """Return a CloudFormation client for an account and region using the provisioning role."""
+    return aws.cfn_client(region=region, role=util.get_provisioning_role_arn(account))
+
+
+_client_factory: CfnClientFactory = default_client_factory
+
+
+def set_client_factory(factory: CfnClientFactory | None) -> None:
+    """Install the factory that creates CloudFormation clients.  Pass None to restore the default.
+
+    The factory is called with the account and region of a target and returns
+    a boto3-like CloudFormation client.
+    """
+    global _client_factory
+    _client_factory = factory or default_client_factory
+
+
+def _param(params: dict, *names: str, default: Any = None) -> Any:
+    for name in names:
+        if name in params:
+            return params[name]
+    return default
+
+
+def _action_kind(action: dict) -> str:
+    kind = _param(action, "Kind", "kind", "Type", "type", default="")
+    return re.sub(r"[^a-z]", "", str(kind).lower())
+
+
+def load_actions(task_payload: TaskPayload) -> list[dict] | None:
+    """Read the compiled actions of a deployspec.
+
+    Args:
+        task_payload (TaskPayload): The task.  ``task_payload.actions`` locates the actions file.
+
+    Returns:
+        list[dict] | None: The actions, or None if they have not been compiled yet.
+    """
+    actions = task_payload.actions
+    bucket = MagicS3Client.get_bucket(Region=actions.bucket_region, BucketName=actions.bucket_name)
+    try:
+        body = bucket.Object(actions.key).get()["Body"].read()
+    except Exception as e:
+        log.debug("No compiled actions at {}: {}", actions.key, e)
+        return None
+
+    data = util.from_yaml(body.decode("utf-8") if isinstance(body, bytes) else body)
+    if isinstance(data, dict):
+        data = data.get("Actions", data.get("actions", []))
+    return data or []
+
+
+def stack_targets(actions: list[dict]) -> tuple[list[dict], list[str]]:
+    """Select the actions that deploy a stack.
+
+    Args:
+        actions (list[dict]): The compiled actions.
+
+    Returns:
+        tuple[list[dict], list[str]]: The targets and the labels of the skipped actions.
+    """
+    targets = []
+    skipped = []
+    for action in actions:
+        label = _param(action, "Label", "label", "Name", "name", default="")
+        params = _param(action, "Params", "params", "Spec", "spec", default={}) or {}
+        template_url = _param(params, "TemplateUrl", "TemplateURL", "template_url")
+        if "createstack" not in _action_kind(action) or not template_url:
+            skipped.append(label)
+            continue
+        stack_parameters = _param(params, "StackParameters", "stack_parameters", "Parameters", "parameters", default={}) or {}
+        tags = _param(params, "Tags", "tags", default={}) or {}
+        targets.append(
+            {
+                "Label": label,
+                "Account": str(_param(params, "Account", "account", default="")),
+                "Region": _param(params, "Region", "region", default=util.get_region()),
+                "StackName": _param(params, "StackName", "stack_name"),
+                "TemplateUrl": template_url,
+                "Parameters": [{"ParameterKey": k, "ParameterValue": str(v)} for k, v in stack_parameters.items()],
+                "Tags": [{"Key": k, "Value": str(v)} for k, v in tags.items()],
+            }
+        )
+    return targets, skipped
+
+
+def change_set_name(task_payload: TaskPayload) -> str:
+    """Return a valid change set name for the plan of this task."""
+    name = re.sub(r"[^a-zA-Z0-9-]", "-", f"core-plan-{task_payload.correlation_id}")
+    return name[:128]
+
+
+def _stack_status(client: Any, stack_name: str) -> str | None:
+    try:
+        stacks = client.describe_stacks(StackName=stack_name).get("Stacks", [])
+    except Exception as e:
+        if "does not exist" in str(e):
+            return None
+        raise
+    return stacks[0].get("StackStatus") if stacks else None
+
+
+def _wait_for_change_set(client: Any, stack_name: str, name: str, poll_interval: float, timeout: float) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        response = client.describe_change_set(StackName=stack_name, ChangeSetName=name)
+        status = response.get("Status")
+        if status in ("CREATE_COMPLETE", "FAILED", "DELETE_COMPLETE", "DELETE_FAILED"):
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Change set {name} for stack {stack_name} is still {status}")
+        time.sleep(poll_interval)
+
+    changes = list(response.get("Changes", []))
+    next_token = response.get("NextToken")
+    while next_token:
+        page = client.describe_change_set(StackName=stack_name, ChangeSetName=name, NextToken=next_token)
+        changes.extend(page.get("Changes", []))
+        next_token = page.get("NextToken")
+    return dict(response, Changes=changes)
+
+
+def _summarize_change(change: dict) -> dict:
+    resource = change.get("ResourceChange", change)
+    return {
+        "Action": resource.get("Action"),
+        "LogicalId": resource.get("LogicalResourceId"),
+        "ResourceType": resource.get("ResourceType"),
+        "Replacement": resource.get("Replacement"),
+    }
+
+
+def plan_target(
+    target: dict,
+    name: str,
+    client: Any,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> dict:
+    """Create, describe and remove the change set of one target.
+
+    Args:
+        target (dict): A target returned by ``stack_targets``.
+        name (str): The change set name.
+        client (Any): The CloudFormation client for the target's account and region.
+        poll_interval (float): Seconds between change set status checks.
+        timeout (float): Seconds to wait for the change set.
+
+    Returns:
+        dict: The diff of the target.
+    """
+    stack_name = target["StackName"]
+    result = {key: target[key] for key in ("Label", "Account", "Region", "StackName")}
+
+    status = _stack_status(client, stack_name)
+    change_set_type = CHANGE_SET_UPDATE if status not in (None, _REVIEW_IN_PROGRESS) else CHANGE_SET_CREATE
+    result["ChangeSetType"] = change_set_type
+
+    client.create_change_set(
+        StackName=stack_name,
+        ChangeSetName=name,
+        ChangeSetType=change_set_type,
+        TemplateURL=target["TemplateUrl"],
+        Parameters=target["Parameters"],
+        Tags=target["Tags"],
+        Capabilities=CAPABILITIES,
+        Description="Plan preview",
+    )
+    try:
+        response = _wait_for_change_set(client, stack_name, name, poll_interval, timeout)
+    finally:
+        try:
+            if status is None:
+                # The change set created an empty stack to hold it.  A stack that already
+                # existed (even in REVIEW_IN_PROGRESS) is never deleted by a plan.
+                client.delete_stack(StackName=stack_name)
+            else:
+                client.delete_change_set(StackName=stack_name, ChangeSetName=name)
+        except Exception as e:
+            log.warning("Could not remove change set {} of stack {}: {}", name, stack_name, e)
+
+    reason = response.get("StatusReason") or ""
+    if response.get("Status") == "FAILED" and not any(text in reason for text in _NO_CHANGES):
+        result.update(Status=PLAN_ERROR, Message=reason, Changes=[])
+        return result
+
+    result.update(Status=PLAN_OK, Changes=[_summarize_change(change) for change in response.get("Changes", [])])
+    return result
+
+
+def _summary(results: list[dict]) -> dict:
+    summary = {"Targets": len(results), "Failed": 0, "Add": 0, "Modify": 0, "Remove": 0, "Replace": 0}
+    for result in results:
+        if result["Status"] != PLAN_OK:
+            summary["Failed"] += 1
+        for change in result.get("Changes", []):
+            if change["Action"] in summary:
+                summary[change["Action"]] += 1
+            if change["Replacement"] == "True":
+                summary["Replace"] += 1
+    return summary
+
+
+def plan_changes(
+    task_payload: TaskPayload,
+    actions: list[dict],
+    max_parallel: int = DEFAULT_MAX_PARALLEL,
+    client_factory: CfnClientFactory | None = None,
+    on_result: Callable[[dict], None] | None = None,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> dict:
+    """Preview the stack changes of compiled actions.
+
+    Args:
+        task_payload (TaskPayload): The plan task.
+        actions (list[dict]): The compiled actions.
+        max_parallel (int): Maximum number of targets planned at the same time.
+        client_factory (Callable, optional): Creates the CloudFormation client of a target.
+            Defaults to the installed factory.
+        on_result (Callable, optional): Called with each target's diff as soon as it is ready.
+        poll_interval (float): Seconds between change set status checks.
+        timeout (float): Seconds to wait for each change set.
+
+    Returns:
+        dict: The aggregated diff.
+    """
+    client_factory = client_factory or _client_factory
+    targets, skipped = stack_targets(actions)
+    name = change_set_name(task_payload)
+
+    def run(target: dict) -> dict:
+        attributes = {"account": target["Account"], "region": target["Region"], "stack": target["StackName"]}
+        with tracing.start_span("invoker.plan.target", attributes):
+            client = client_factory(target["Account"], target["Region"])
+            return plan_target(target, name, client, poll_interval=poll_interval, timeout=timeout)
+
+    log.info("Planning {} stacks ({} actions skipped)", len(targets), len(skipped))
+
+    results = []
+    with tracing.start_span("invoker.plan", {"targets": len(targets)}):
+        with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(targets) or 1))) as pool:
+            futures = {pool.submit(contextvars.copy_context().run, run, target): target for target in targets}
+            for future in as_completed(futures):
+                target = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {key: target[key] for key in ("Label", "Account", "Region", "StackName")}
+                    result.update(Status=PLAN_ERROR, Message=str(e), Changes=[])
+
+                log.info(
+                    "Plan {} {}/{}: {} changes",
+                    result["StackName"],
+                    result["Account"],
+                    result["Region"],
+                    len(result["Changes"]) if result["Status"] == PLAN_OK else result["Status"],
+                    details=result,
+                )
+                if on_result is not None:
+                    on_result(result)
+                results.append(result)
+
+    # as_completed returns targets in completion order; report them in action order
+    order = {target["Label"]: index for index, target in enumerate(targets)}
+    results.sort(key=lambda result: order.get(result["Label"], 0))
+
+    summary = _summary(results)
+    return {
+        "Status": PLAN_ERROR if summary["Failed"] else PLAN_OK,
+        "Summary": summary,
+        "Targets": results,
+        "Skipped": skipped,
+    }
+
+
+def execute_plan(task_payload: TaskPayload, compile_actions: Callable[[TaskPayload], Any] | None = None, **kwargs) -> dict:
+    """Plan a deployspec from its compiled actions, compiling it first if needed.
+
+    Args:
+        task_payload (TaskPayload): The plan task.
+        compile_actions (Callable, optional): Compiles the deployspec when no compiled
+            actions exist.  Defaults to ``execute_deployspec_compiler``.
+        **kwargs: Passed to ``plan_changes``.
+
+    Returns:
+        dict: The aggregated diff.
+
+    Raises:
+        RuntimeError: If the deployspec has no compiled actions after compiling.
+    """
+    compile_actions = compile_actions or execute_deployspec_compiler
+
+    actions = load_actions(task_payload)
+    if actions is None:
+        log.info("No compiled actions found, compiling the deployspec first")
+        compile_actions(task_payload)
+        actions = load_actions(task_payload)
+        if actions is None:
+            raise RuntimeError("Deployspec compile did not produce actions at {}".format(task_payload.actions.key))
+
+    return plan_changes(task_payload, actions, **kwargs)
@@ -0,0 +1,328 @@
+"""
+Execution policy: run a downstream stage in-process or on its own Lambda.
+
+Historically the choice is all-or-nothing: ``util.is_local_mode()`` runs
+every compiler and the runner in-process, otherwise every stage is an
+``aws.invoke_lambda`` call.  For small packages the Lambda hop costs more
+than the compile itself.
+
+``CORE_INVOKER_EXECUTION`` selects the mode:
+
+* "local"  - always in-process (the default in local mode)
+* "remote" - always invoke the target Lambda (the default otherwise)
+* "hybrid" - decide per task
+
+In hybrid mode a stage runs in-process when the package is small
+(``CORE_INVOKER_HYBRID_MAX_PACKAGE_MB``, default 5), the expected in-process
+latency fits comfortably in the remaining Lambda time, and in-process has
+not been slower than remote so far.  Latency is tracked per target and mode
+as an exponentially weighted moving average.  Every decision and its
+outcome are logged and attached to the active span so the thresholds can be
+tuned from metrics.
+
+Neither outcome is final.  A target that failed in-process several times in
+a row runs remote for a cool-down period and is then tried in-process again.
+Every ``explore_every``-th eligible task runs in the mode that is not
+preferred, so the latency of both modes stays measured.
+"""
+
+from typing import Any
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+
+import os
+import time
+import threading
+
+import core_logging as log
+
+import core_framework as util
+from core_framework.models import TaskPayload
+
+from core_helper.magic import MagicS3Client
+
+from . import tracing
+
+EXECUTION_ENV = "CORE_INVOKER_EXECUTION"
+MAX_LOCAL_PACKAGE_ENV = "CORE_INVOKER_HYBRID_MAX_PACKAGE_MB"
+
+MODE_LOCAL = "local"
+MODE_REMOTE = "remote"
+MODE_HYBRID = "hybrid"
+
+DEFAULT_MAX_LOCAL_PACKAGE_MB = 5
+
+# Use at most this fraction of the remaining Lambda time for an in-process stage
+DEFAULT_HEADROOM = 0.5
+
+# Assumed in-process latency of a target we have not measured yet
+DEFAULT_LOCAL_ESTIMATE_MS = 5000.0
+
+# Consecutive in-process failures after which a target is sent remote
+MAX_LOCAL_FAILURES = 3
+
+# Seconds a failing target runs remote before it is tried in-process again
+LOCAL_FAILURE_COOLDOWN = 300.0
+
+# Every n-th eligible task runs in the mode that is not preferred
+DEFAULT_EXPLORE_EVERY = 20
+
+EWMA_ALPHA = 0.3
+
+_MB = 1024 * 1024
+
+_MAX_PACKAGE_SIZES = 1024
+
+_lambda_context: ContextVar[Any | None] = ContextVar("core_invoker_lambda_context", default=None)
+
+
+def set_lambda_context(context: Any | None) -> None:
+    """Remember the Lambda context of the current invocation."""
+    _lambda_context.set(context)
+
+
+def remaining_time_ms() -> int | None:
+    """Return the remaining time of the current Lambda invocation, or None outside Lambda."""
+    context = _lambda_context.get()
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return None
+    return context.get_remaining_time_in_millis()
+
+
+def execution_mode() -> str:
+    """Return the configured execution mode."""
+    mode = os.getenv(EXECUTION_ENV, "").lower()
+    if mode in (MODE_LOCAL, MODE_REMOTE, MODE_HYBRID):
+        return mode
+    return MODE_LOCAL if util.is_local_mode() else MODE_REMOTE
+
+
+@dataclass
+class Decision:
+    """Where a stage runs and why.
+
+    Attributes:
+        target (str): The downstream target, e.g. "deployspec_compiler".
+        mode (str): "local" or "remote".
+        reason (str): Why the mode was chosen.
+        package_bytes (int | None): The package size, if known.
+        remaining_ms (int | None): Remaining Lambda time when the decision was made.
+        local_estimate_ms (float | None): Expected in-process latency.
+        remote_estimate_ms (float | None): Expected remote latency.
+        duration_ms (float | None): Measured latency, set by ``ExecutionPolicy.record``.
+        ok (bool | None): Outcome, set by ``ExecutionPolicy.record``.
+    """
+
+    target: str
+    mode: str
+    reason: str
+    package_bytes: int | None = None
+    remaining_ms: int | None = None
+    local_estimate_ms: float | None = None
+    remote_estimate_ms: float | None = None
+    duration_ms: float | None = None
+    ok: bool | None = None
+
+
+@dataclass
+class _Stats:
+    ewma_ms: float | None = None
+    count: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    last_failure: float = 0.0
+
+
+class ExecutionPolicy:
+    """Chooses between in-process and remote execution per task.
+
+    Args:
+        max_local_package_bytes (int, optional): Largest package compiled in-process.
+        headroom (float): Fraction of the remaining Lambda time an in-process stage may use.
+        alpha (float): Weight of the newest sample in the latency average.
+        explore_every (int): Run every n-th eligible task in the other mode.  0 switches exploration off.
+        failure_cooldown (float): Seconds a target that keeps failing in-process runs remote.
+    """
+
+    def __init__(
+        self,
+        max_local_package_bytes: int | None = None,
+        headroom: float = DEFAULT_HEADROOM,
+        alpha: float = EWMA_ALPHA,
+        explore_every: int = DEFAULT_EXPLORE_EVERY,
+        failure_cooldown: float = LOCAL_FAILURE_COOLDOWN,
+    ):
+        if max_local_package_bytes is None:
+            max_local_package_bytes = int(float(os.getenv(MAX_LOCAL_PACKAGE_ENV, DEFAULT_MAX_LOCAL_PACKAGE_MB)) * _MB)
+        self.max_local_package_bytes = max_local_package_bytes
+        self.headroom = headroom
+        self.alpha = alpha
+        self.explore_every = explore_every
+        self.failure_cooldown = failure_cooldown
+        self._lock = threading.Lock()
+        self._stats: dict[tuple[str, str], _Stats] = {}
+        self._eligible: dict[str, int] = {}
+        self._package_sizes: dict[tuple[str, str], int | None] = {}
+
+    def _estimate(self, target: str, mode: str) -> float | None:
+        with self._lock:
+            stats = self._stats.get((target, mode))
+            return stats.ewma_ms if stats else None
+
+    def _local_failing(self, target: str) -> bool:
+        with self._lock:
+            stats = self._stats.get((target, MODE_LOCAL))
+            if not stats or stats.consecutive_failures < MAX_LOCAL_FAILURES:
+                return False
+            # After the cool-down one task is tried in-process again
+            return time.monotonic() - stats.last_failure < self.failure_cooldown
+
+    def _explore(self, target: str) -> bool:
+        with self._lock:
+            count = self._eligible[target] = self._eligible.get(target, 0) + 1
+        return self.explore_every > 0 and count % self.explore_every == 0
+
+    def package_size(self, task_payload: TaskPayload) -> int | None:
+        """Return the size of the task package in bytes (cached), or None if it cannot be read."""
+        package = task_payload.package
+        if package is None or not package.key:
+            return None
+        cache_key = (package.bucket_name, package.key)
+        with self._lock:
+            if cache_key in self._package_sizes:
+                return self._package_sizes[cache_key]
+
+        # Read outside the lock; concurrent readers of the same package store the same size
+        try:
+            bucket = MagicS3Client.get_bucket(Region=package.bucket_region, BucketName=package.bucket_name)
+            size = int(bucket.Object(package.key).content_length)
+        except Exception as e:
+            log.debug("Cannot read the size of package {}: {}", package.key, e)
+            size = None
+
+        with self._lock:
+            if len(self._package_sizes) >= _MAX_PACKAGE_SIZES:
+                self._package_sizes.clear()
+            self._package_sizes[cache_key] = size
+        return size
+
+    def decide(self, target: str, task_payload: TaskPayload, remaining_ms: int | None = None) -> Decision:
+        """Decide where to run a stage.
+
+        Args:
+            target (str): The downstream target.
+            task_payload (TaskPayload): The task.
+            remaining_ms (int, optional): Remaining Lambda time.  Defaults to the current Lambda context.
+
+        Returns:
+            Decision: The decision.
+        """
+        mode = execution_mode()
+        if mode != MODE_HYBRID:
+            return Decision(target=target, mode=mode, reason="configured")
+
+        if remaining_ms is None:
+            remaining_ms = remaining_time_ms()
+
+        local_estimate = self._estimate(target, MODE_LOCAL)
+        remote_estimate = self._estimate(target, MODE_REMOTE)
+        size = self.package_size(task_payload)
+
+        decision = Decision(
+            target=target,
+            mode=MODE_REMOTE,
+            reason="",
+            package_bytes=size,
+            remaining_ms=remaining_ms,
+            local_estimate_ms=local_estimate,
+            remote_estimate_ms=remote_estimate,
+        )
+
+        expected_local = local_estimate if local_estimate is not None else DEFAULT_LOCAL_ESTIMATE_MS
+
+        if size is None:
+            decision.reason = "package size unknown"
+        elif size > self.max_local_package_bytes:
+            decision.reason = "package too large"
+        elif self._local_failing(target):
+            decision.reason = "in-process failures"
+        elif remaining_ms is not None and expected_local > remaining_ms * self.headroom:
+            decision.reason = "not enough remaining time"
+        else:
+            if local_estimate is not None and remote_estimate is not None and local_estimate > remote_estimate:
+                decision.mode, decision.reason = MODE_REMOTE, "remote is faster"
+            else:
+                decision.mode, decision.reason = MODE_LOCAL, "small package"
+            if self._explore(target):
+                decision.mode = MODE_REMOTE if decision.mode == MODE_LOCAL else MODE_LOCAL
+                decision.reason = "exploring"
+
+        return decision
+
+    def record(self, decision: Decision, duration_ms: float, ok: bool) -> None:
+        """Record the outcome of a decision.
+
+        Args:
+            decision (Decision): The decision that was executed.
+            duration_ms (float): The measured latency of the stage.
+            ok (bool): True if the stage succeeded.
+        """
+        decision.duration_ms = duration_ms
+        decision.ok = ok
+
+        with self._lock:
+            stats = self._stats.setdefault((decision.target, decision.mode), _Stats())
+            stats.count += 1
+            if ok:
+                stats.consecutive_failures = 0
+                if stats.ewma_ms is None:
+                    stats.ewma_ms = duration_ms
+                else:
+                    stats.ewma_ms = self.alpha * duration_ms + (1 - self.alpha) * stats.ewma_ms
+            else:
+                stats.failures += 1
+                stats.consecutive_failures += 1
+                stats.last_failure = time.monotonic()
+
+        span = tracing.current_span()
+        if span is not None:
+            span.set_attribute("execution_mode", decision.mode)
+            span.set_attribute("execution_reason", decision.reason)
+
+        log.info(
+            "Executed {} {} in {:.0f} ms ({})",
+            decision.target,
+            decision.mode,
+            duration_ms,
+            decision.reason,
+            details=asdict(decision),
+        )
+
+    def snapshot(self) -> dict:
+        """Return the latency statistics as a dictionary keyed by "target:mode"."""
+        with self._lock:
+            return {
+                f"{target}:{mode}": {
+                    "Count": stats.count,
+                    "Failures": stats.failures,
+                    "AverageMs": round(stats.ewma_ms, 1) if stats.ewma_ms is not None else None,
+                }
+                for (target, mode), stats in self._stats.items()
+            }
+
+
+_policy: ExecutionPolicy | None = None
+
+
+def set_policy(policy: ExecutionPolicy | None) -> None:
+    """Install the execution policy.  Pass None to restore the default."""
+    global _policy
+    _policy = policy
+
+
+def get_policy() -> ExecutionPolicy:
+    """Return the process-wide execution policy."""
+    global _policy
+    if _policy is None:
+        _policy = ExecutionPolicy()
+    return _policy
@@ -0,0 +1,307 @@
+"""
+Opt-in peak-memory profiling for invoker routes.
+
+When enabled, every ``(type, task)`` invocation records its own peak RSS
+(the process peak is reset when the invocation starts, so a warm container
+does not charge every route with an earlier route's peak) and the
+tracemalloc peak and top allocation sites.  Each profile is logged,
+attached to the active span and aggregated into a histogram of Lambda memory
+sizes so the invoker memory setting can be chosen from data.
+
+Profiling is off by default because tracemalloc slows allocation-heavy code.
+Enable it with ``CORE_INVOKER_PROFILE=true`` or ``enable_profiling()``.
+
+Example:
+    >>> enable_profiling()
+    >>> with profile("deployspec", "compile"):
+    ...     run_the_compiler()
+    >>> get_histogram().recommend_memory("deployspec", "compile")
+    512
+"""
+
+from typing import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+
+import os
+import sys
+import time
+import threading
+import tracemalloc
+
+import core_logging as log
+
+from . import tracing
+
+PROFILE_ENV = "CORE_INVOKER_PROFILE"
+
+DEFAULT_TOP_ALLOCATIONS = 10
+
+# The memory sizes (MB) we would realistically configure on the Lambda function
+LAMBDA_MEMORY_SIZES = [128, 256, 512, 1024, 1536, 2048, 3008, 4096, 6144, 8192, 10240]
+
+_MB = 1024 * 1024
+
+
+@dataclass
+class MemoryProfile:
+    """The memory profile of one invocation.
+
+    Attributes:
+        type (str): The task type, e.g. "pipeline" or "deployspec".
+        task (str): The task, e.g. "compile".
+        peak_rss_mb (float): Peak resident set size of the process during the invocation in MB.
+        traced_peak_mb (float): Peak memory allocated by Python during the invocation in MB.
+        duration_ms (float): Elapsed time of the invocation in milliseconds.
+        top_allocations (list[str]): The largest allocation sites at the end of the invocation.
+        overlapped (bool): Other profiled invocations ran at the same time, so the peaks cover them too.
+    """
+
+    type: str
+    task: str
+    peak_rss_mb: float
+    traced_peak_mb: float
+    duration_ms: float
+    top_allocations: list[str] = field(default_factory=list)
+    overlapped: bool = False
+
+
+class MemoryHistogram:
+    """Counts peak RSS per ``(type, task)`` in Lambda memory size buckets.
+
+    Invocations larger than the largest Lambda size are counted in an
+    overflow bucket keyed by ``None``.
+    """
+
+    def __init__(self, buckets: list[int] | None = None):
+        self.buckets = sorted(buckets or LAMBDA_MEMORY_SIZES)
+        self._lock = threading.Lock()
+        self._counts: dict[tuple[str, str], dict[int | None, int]] = {}
+        self._peaks: dict[tuple[str, str], float] = {}
+
+    def _bucket(self, value_mb: float) -> int | None:
+        for bucket in self.buckets:
+            if value_mb <= bucket:
+                return bucket
+        return None
+
+    def observe(self, profile: MemoryProfile) -> None:
+        """Add a profile to the histogram."""
+        key = (profile.type, profile.task)
+        bucket = self._bucket(profile.peak_rss_mb)
+        with self._lock:
+            counts = self._counts.setdefault(key, {})
+            counts[bucket] = counts.get(bucket, 0) + 1
+            self._peaks[key] = max(self._peaks.get(key, 0.0), profile.peak_rss_mb)
+
+    def snapshot(self) -> dict:
+        """Return the histogram as a dictionary keyed by "type:task".
+
+        Returns:
+            dict: ``{"deployspec:compile": {"Count": 3, "MaxMB": 301.2, "Buckets": {"512": 3}}}``
+        """
+        with self._lock:
+            result = {}
+            for (type_, task), counts in self._counts.items():
+                result[f"{type_}:{task}"] = {
+                    "Count": sum(counts.values()),
+                    "MaxMB": round(self._peaks[(type_, task)], 1),
+                    "Buckets": {str(b) if b is not None else "overflow": n for b, n in sorted(counts.items(), key=_bucket_order)},
+                }
+            return result
+
+    def recommend_memory(self, type_: str, task: str, percentile: float = 0.99) -> int | None:
+        """Return the smallest Lambda memory size that covers ``percentile`` of the observed invocations.
+
+        Args:
+            type_ (str): The task type.
+            task (str): The task.
+            percentile (float): The fraction of invocations that must fit.  Defaults to 0.99.
+
+        Returns:
+            int | None: The memory size in MB, or None if nothing was observed or the
+            invocations do not fit the largest Lambda size.
+        """
+        with self._lock:
+            counts = dict(self._counts.get((type_, task), {}))
+        total = sum(counts.values())
+        if total == 0:
+            return None
+        running = 0
+        for bucket in self.buckets:
+            running += counts.get(bucket, 0)
+            if running / total >= percentile:
+                return bucket
+        return None
+
+    def clear(self) -> None:
+        """Forget all observations."""
+        with self._lock:
+            self._counts.clear()
+            self._peaks.clear()
+
+
+def _bucket_order(item: tuple[int | None, int]) -> float:
+    return item[0] if item[0] is not None else float("inf")
+
+
+_enabled: bool | None = None
+_top_allocations = DEFAULT_TOP_ALLOCATIONS
+_histogram = MemoryHistogram()
+
+# Profiles may run concurrently (SQS batches, bulk waves); the peaks are
+# process-wide, so they are only reset when no other profile is running.
+_state_lock = threading.Lock()
+_active = 0
+_started = 0
+_rss_peak_reset = False
+
+
+def enable_profiling(top_allocations: int = DEFAULT_TOP_ALLOCATIONS) -> None:
+    """Turn on memory profiling for subsequent invocations.
+
+    Args:
+        top_allocations (int): The number of allocation sites to report.  Defaults to 10.
+    """
+    global _enabled, _top_allocations
+    _enabled = True
+    _top_allocations = top_allocations
+
+
+def disable_profiling() -> None:
+    """Turn off memory profiling and stop tracemalloc if we started it."""
+    global _enabled
+    _enabled = False
+    with _state_lock:
+        if _active == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def is_profiling_enabled() -> bool:
+    """Return True if profiling was enabled in code or by ``CORE_INVOKER_PROFILE``."""
+    if _enabled is not None:
+        return _enabled
+    return os.getenv(PROFILE_ENV, "false").lower() in ("1", "true", "yes")
+
+
+def get_histogram() -> MemoryHistogram:
+    """Return the process-wide histogram of profiled invocations."""
+    return _histogram
+
+
+def _proc_status_mb(name: str) -> float | None:
+    """Read a memory line (e.g. "VmHWM") of /proc/self/status in MB, or None if unavailable."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(name + ":"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _reset_rss_peak() -> bool:
+    """Reset the peak RSS (VmHWM) of the process.  Returns False where that is not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _max_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / _MB if sys.platform == "darwin" else peak / 1024
+
+
+def _window_peak_rss_mb(start_max_rss_mb: float, start_rss_mb: float) -> float:
+    """Return the peak RSS since the peak was last reset.
+
+    Where the peak cannot be reset, the lifetime peak only counts if it grew
+    during the block; otherwise the RSS sampled at the start and end is used.
+    """
+    if _rss_peak_reset:
+        hwm = _proc_status_mb("VmHWM")
+        if hwm is not None:
+            return hwm
+    max_rss_mb = _max_rss_mb()
+    if max_rss_mb > start_max_rss_mb:
+        return max_rss_mb
+    return max(start_rss_mb, _proc_status_mb("VmRSS") or 0.0)
+
+
+@contextmanager
+def profile(type_: str, task: str) -> Iterator[MemoryProfile | None]:
+    """Profile the memory used by the enclosed block.
+
+    Does nothing (and yields None) unless profiling is enabled.  The peaks are
+    reset when the block starts, so each profile measures its own invocation
+    rather than the lifetime peak of a warm container.  When blocks overlap
+    (concurrent invocations in one process) the peaks cover all of them and
+    the profile is marked ``overlapped``; that is the memory the process needed.
+
+    Args:
+        type_ (str): The task type.
+        task (str): The task.
+
+    Yields:
+        MemoryProfile | None: The profile, populated when the block exits.
+    """
+    global _active, _started, _rss_peak_reset
+
+    if not is_profiling_enabled():
+        yield None
+        return
+
+    with _state_lock:
+        overlapped = _active > 0
+        if not overlapped:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            _rss_peak_reset = _reset_rss_peak()
+        _active += 1
+        _started += 1
+        started = _started
+
+    result = MemoryProfile(type=type_, task=task, peak_rss_mb=0.0, traced_peak_mb=0.0, duration_ms=0.0)
+    start_max_rss_mb = _max_rss_mb()
+    start_rss_mb = _proc_status_mb("VmRSS") or 0.0
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result.duration_ms = (time.perf_counter() - start) * 1000.0
+        with _state_lock:
+            _current, peak = tracemalloc.get_traced_memory()
+            result.traced_peak_mb = peak / _MB
+            result.peak_rss_mb = _window_peak_rss_mb(start_max_rss_mb, start_rss_mb)
+            result.overlapped = overlapped or _started != started or _active > 1
+            _active -= 1
+        result.top_allocations = [str(stat) for stat in tracemalloc.take_snapshot().statistics("lineno")[:_top_allocations]]
+        _report(result)
+
+
+def _report(result: MemoryProfile) -> None:
+    _histogram.observe(result)
+
+    span = tracing.current_span()
+    if span is not None:
+        span.set_attribute("peak_rss_mb", round(result.peak_rss_mb, 1))
+        span.set_attribute("traced_peak_mb", round(result.traced_peak_mb, 1))
+
+    log.info(
+        "Memory profile for {}:{}: peak RSS {:.1f} MB, traced peak {:.1f} MB",
+        result.type,
+        result.task,
+        result.peak_rss_mb,
+        result.traced_peak_mb,
+        details=asdict(result),
+    )
@@ -0,0 +1,76 @@
+"""
+Per-target projections of the task payload.
+
+Every downstream hop used to receive the complete ``TaskPayload.model_dump()``,
+including defaults, None values and sections the target never reads.  A
+projection lists the top-level fields a target consumes; the payload sent
+downstream is dumped with only those fields and without defaults or None
+values.  The downstream handler validates the payload with
+``TaskPayload.model_validate``, which fills the omitted defaults back in.
+
+Targets without a projection receive the full dump.
+"""
+
+from core_framework.models import TaskPayload
+
+# Fields every target needs to identify and log the task
+_COMMON_FIELDS = frozenset(
+    {
+        "client",
+        "task",
+        "type",
+        "force",
+        "dry_run",
+        "identity",
+        "correlation_id",
+        "deployment_details",
+    }
+)
+
+# The compilers read the package and write the actions and state artefacts
+COMPILER_FIELDS = _COMMON_FIELDS | {"package", "actions", "state"}
+
+# The runner executes the compiled actions and keeps the state; it never reads the package
+RUNNER_FIELDS = _COMMON_FIELDS | {"actions", "state", "flow_control"}
+
+PROJECTIONS: dict[str, frozenset[str]] = {
+    "pipeline_compiler": COMPILER_FIELDS,
+    "deployspec_compiler": COMPILER_FIELDS,
+    "runner": RUNNER_FIELDS,
+}
+
+
+def get_fields(target: str | None) -> set[str] | None:
+    """
+    Return the top-level TaskPayload fields sent to a target.
+
+    Fields that the installed TaskPayload model does not define are dropped,
+    so a projection never asks for a field the model cannot dump.
+
+    Args:
+        target (str, optional): the name of the target, e.g. "runner"
+
+    Returns:
+        set[str] | None: the fields, or None if the target receives the full payload
+    """
+    fields = PROJECTIONS.get(target) if target else None
+    if fields is None:
+        return None
+    return set(fields) & set(TaskPayload.model_fields)
+
+
+def project(task_payload: TaskPayload, target: str | None = None) -> dict:
+    """
+    Dump the task payload for a target.
+
+    Args:
+        task_payload (TaskPayload): the task definition
+        target (str, optional): the name of the target.  None dumps the full payload.
+
+    Returns:
+        dict: the payload for the target
+    """
+    fields = get_fields(target)
+    if fields is None:
+        return task_payload.model_dump()
+    return task_payload.model_dump(include=fields, exclude_defaults=True, exclude_none=True)
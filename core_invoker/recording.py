@@ -0,0 +1,488 @@
+"""
+Record and replay invoker traffic for offline performance regression tests.
+
+Recording captures, in a gzip-compressed JSON-lines file:
+
+* every event received by ``handler`` with its response and duration,
+* every downstream request and response, both remote (``aws.invoke_lambda``)
+  and in-process (the compiler and runner handlers in local mode),
+* the S3 object calls made while staging artefacts (``load``, ``copy_from``,
+  ``delete``), including the attributes ``load`` sets and the errors raised.
+
+Values of keys that look sensitive (passwords, secrets, tokens, credentials,
+session and authorization data) are redacted before they are written.
+
+Start recording with ``CORE_INVOKER_RECORD=/path/to/traffic.jsonl.gz`` or
+``start_recording(path)``.  Entries are buffered and appended as one
+complete gzip member per flush, so a recording that was never stopped (a
+Lambda container that is frozen or killed) can still be read up to its last
+flush.  Replay the file with ``replay(path)``: the same
+events are sent through ``handler`` while the downstream Lambdas, compiler
+handlers and S3 are replaced by stand-ins answering from the recording, so
+no network access is needed.  Arrival times and downstream latencies are
+scaled by ``speedup``, and ``concurrency`` bounds the events in flight.
+
+Example:
+    >>> report = replay("traffic.jsonl.gz", speedup=10, concurrency=8)
+    >>> report["Latency"]["p99"]
+    41.7
+"""
+
+from typing import Any, Callable
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
+
+import os
+import re
+import copy
+import gzip
+import json
+import time
+import atexit
+import threading
+
+import core_logging as log
+
+import core_helper.aws as aws
+
+from . import buckets
+from .responses import is_failure
+
+RECORD_ENV = "CORE_INVOKER_RECORD"
+
+KIND_EVENT = "event"
+KIND_DOWNSTREAM = "downstream"
+KIND_S3 = "s3"
+
+REDACTED = "***REDACTED***"
+
+# Seconds between flushes of the compressed file; each flush appends one gzip member
+FLUSH_INTERVAL = 5.0
+
+_SENSITIVE_KEY = re.compile(r"(password|passwd|secret|token|credential|session|authorization|private[_-]?key)", re.IGNORECASE)
+
+# In-process downstream handlers looked up by the invoker module at call time
+_LOCAL_HANDLERS = ["component_compiler_handler", "deployspec_compiler_handler", "runner_handler"]
+
+_RECORDED_S3_OPERATIONS = ["load", "copy_from", "delete"]
+
+# Object attributes set by ``load`` (a HEAD request), recorded as its response
+_LOADED_ATTRIBUTES = ["version_id", "content_length", "e_tag", "last_modified"]
+
+
+def redact(value: Any) -> Any:
+    """Return a copy of ``value`` with the values of sensitive keys replaced.
+
+    Args:
+        value (Any): A JSON-like structure.
+
+    Returns:
+        Any: The redacted copy.
+    """
+    if isinstance(value, dict):
+        return {k: REDACTED if _SENSITIVE_KEY.search(str(k)) else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+def _correlation_id(payload: Any) -> str | None:
+    if isinstance(payload, dict):
+        return payload.get("correlation_id") or payload.get("CorrelationId")
+    return None
+
+
+class _Patches:
+    """Sets attributes and puts the original values back, in reverse order."""
+
+    def __init__(self):
+        self._saved: list[tuple[Any, str, Any, bool]] = []
+
+    def set(self, target: Any, name: str, value: Any) -> None:
+        present = name in vars(target)
+        self._saved.append((target, name, vars(target).get(name), present))
+        setattr(target, name, value)
+
+    def restore(self) -> None:
+        while self._saved:
+            target, name, value, present = self._saved.pop()
+            if present:
+                setattr(target, name, value)
+            else:
+                delattr(target, name)
+
+
+def _invoker_module():
+    from . import invoker
+
+    return invoker
+
+
+class _RecordingObject:
+    def __init__(self, recorder: "Recorder", bucket_name: str, obj: Any, key: str):
+        self._recorder = recorder
+        self._bucket_name = bucket_name
+        self._object = obj
+        self._key = key
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._object, name)
+        if name not in _RECORDED_S3_OPERATIONS:
+            return attr
+
+        def call(**kwargs):
+            start = time.perf_counter()
+            entry = {"kind": KIND_S3, "op": name, "bucket": self._bucket_name, "key": self._key, "args": kwargs}
+            try:
+                response = attr(**kwargs)
+            except Exception as e:
+                entry.update(error=str(e), duration_ms=(time.perf_counter() - start) * 1000.0)
+                self._recorder.write(entry)
+                raise
+            if name == "load":
+                entry["response"] = {attribute: getattr(self._object, attribute, None) for attribute in _LOADED_ATTRIBUTES}
+            else:
+                entry["response"] = response
+            entry["duration_ms"] = (time.perf_counter() - start) * 1000.0
+            self._recorder.write(entry)
+            return response
+
+        return call
+
+
+class _RecordingBucket:
+    def __init__(self, recorder: "Recorder", bucket: Any, bucket_name: str):
+        self._recorder = recorder
+        self._bucket = bucket
+        self._bucket_name = bucket_name
+
+    def Object(self, key: str) -> _RecordingObject:
+        return _RecordingObject(self._recorder, self._bucket_name, self._bucket.Object(key), key)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._bucket, name)
+
+
+class Recorder:
+    """Writes invoker traffic to a compressed JSON-lines file.
+
+    Entries are flushed to disk at most every ``flush_interval`` seconds and
+    when the recorder is closed.
+
+    Args:
+        path (str): The file to write.  Parent folders are created if needed.
+        flush_interval (float): Seconds between flushes.
+    """
+
+    def __init__(self, path: str, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._buffer: list[str] = []
+        self._start = time.monotonic()
+        self._flushed = self._start
+        self._closed = False
+        self._patches = _Patches()
+
+    def write(self, entry: dict) -> None:
+        """Append one redacted entry."""
+        entry = redact(entry)
+        entry.setdefault("t", time.monotonic() - self._start)
+        line = json.dumps(entry, default=str, separators=(",", ":"))
+        with self._lock:
+            if self._closed:
+                # A bucket wrapped before the recording stopped is still in use
+                return
+            self._buffer.append(line)
+            now = time.monotonic()
+            if now - self._flushed >= self.flush_interval:
+                self._flush()
+                self._flushed = now
+
+    def _flush(self) -> None:
+        """Append the buffered lines as one complete gzip member.  Call with the lock held."""
+        if not self._buffer:
+            return
+        data = "".join(line + "\n" for line in self._buffer).encode("utf-8")
+        self._buffer.clear()
+        with open(self.path, "ab") as f:
+            f.write(gzip.compress(data))
+
+    def _wrap_downstream(self, target: str, fn: Callable) -> Callable:
+        def call(*args, **kwargs):
+            payload = args[1] if target == "lambda" else args[0]
+            name = args[0] if target == "lambda" else target
+            start = time.perf_counter()
+            response = fn(*args, **kwargs)
+            self.write(
+                {
+                    "kind": KIND_DOWNSTREAM,
+                    "target": name,
+                    "correlation_id": _correlation_id(payload),
+                    "request": payload,
+                    "response": response,
+                    "duration_ms": (time.perf_counter() - start) * 1000.0,
+                }
+            )
+            return response
+
+        return call
+
+    def install(self) -> None:
+        """Start intercepting downstream and S3 calls."""
+        invoker = _invoker_module()
+        self._patches.set(aws, "invoke_lambda", self._wrap_downstream("lambda", aws.invoke_lambda))
+        for name in _LOCAL_HANDLERS:
+            self._patches.set(invoker, name, self._wrap_downstream(name, getattr(invoker, name)))
+
+        buckets.add_wrapper(self._wrap_bucket)
+
+    def _wrap_bucket(self, get_bucket, *args, **kwargs) -> Any:
+        bucket = get_bucket(*args, **kwargs)
+        return _RecordingBucket(self, bucket, kwargs.get("BucketName") or getattr(bucket, "name", ""))
+
+    def close(self) -> None:
+        """Stop intercepting and close the file."""
+        buckets.remove_wrapper(self._wrap_bucket)
+        self._patches.restore()
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._flush()
+
+    def record_invocation(self, fn: Callable[[dict, Any], dict], event: dict, context: Any) -> dict:
+        """Call the handler and record the event, the response and the duration."""
+        received = copy.deepcopy(event)
+        start = time.perf_counter()
+        offset = time.monotonic() - self._start
+        response = fn(event, context)
+        self.write(
+            {
+                "kind": KIND_EVENT,
+                "t": offset,
+                "correlation_id": _correlation_id(received),
+                "event": received,
+                "response": response,
+                "duration_ms": (time.perf_counter() - start) * 1000.0,
+            }
+        )
+        return response
+
+
+_recorder: Recorder | None = None
+_recorder_lock = threading.Lock()
+
+
+def start_recording(path: str) -> Recorder:
+    """Record all invoker traffic to ``path`` until ``stop_recording()`` is called."""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is not None:
+            raise RuntimeError(f"Already recording to {_recorder.path}")
+        _recorder = Recorder(path)
+        _recorder.install()
+        log.info("Recording invoker traffic to {}", path)
+        return _recorder
+
+
+def stop_recording() -> None:
+    """Stop recording and close the file."""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is not None:
+            _recorder.close()
+            _recorder = None
+
+
+def get_recorder() -> Recorder | None:
+    """Return the active recorder, starting one if ``CORE_INVOKER_RECORD`` is set.
+
+    A recorder started from the environment is stopped when the process exits.
+    """
+    if _recorder is None and os.getenv(RECORD_ENV):
+        try:
+            recorder = start_recording(os.environ[RECORD_ENV])
+        except RuntimeError:
+            return _recorder
+        atexit.register(stop_recording)
+        return recorder
+    return _recorder
+
+
+def load(path: str) -> list[dict]:
+    """Read the entries of a recording."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class _Playback:
+    """Answers downstream and S3 calls from the recorded responses."""
+
+    def __init__(self, entries: list[dict], speedup: float | None):
+        self.speedup = speedup
+        self._lock = threading.Lock()
+        self._by_correlation: dict[tuple, deque] = defaultdict(deque)
+        self._by_target: dict[str, deque] = defaultdict(deque)
+        self._s3: dict[tuple, deque] = defaultdict(deque)
+        self.misses = 0
+        for entry in entries:
+            if entry["kind"] == KIND_DOWNSTREAM:
+                self._by_correlation[(entry["target"], entry.get("correlation_id"))].append(entry)
+                self._by_target[entry["target"]].append(entry)
+            elif entry["kind"] == KIND_S3:
+                self._s3[(entry["op"], entry["key"])].append(entry)
+
+    def _delay(self, entry: dict) -> None:
+        if self.speedup:
+            time.sleep(entry.get("duration_ms", 0.0) / 1000.0 / self.speedup)
+
+    def downstream(self, target: str, payload: dict) -> dict:
+        with self._lock:
+            queue = self._by_correlation.get((target, _correlation_id(payload)))
+            if not queue:
+                queue = self._by_target.get(target)
+            if not queue:
+                self.misses += 1
+                raise RuntimeError(f"No recorded response for {target}")
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+        self._delay(entry)
+        return copy.deepcopy(entry["response"])
+
+    def s3(self, op: str, key: str) -> Any:
+        with self._lock:
+            queue = self._s3.get((op, key))
+            if not queue:
+                self.misses += 1
+                return {}
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+        self._delay(entry)
+        if "error" in entry:
+            raise RuntimeError(entry["error"])
+        return copy.deepcopy(entry.get("response"))
+
+
+class _StandInObject:
+    def __init__(self, playback: _Playback, key: str):
+        self._playback = playback
+        self.key = key
+        self._loaded: dict = {}
+
+    def load(self, **kwargs) -> None:
+        self._loaded = self._playback.s3("load", self.key) or {}
+
+    def __getattr__(self, name: str) -> Any:
+        if name in _LOADED_ATTRIBUTES:
+            return self._loaded.get(name)
+        return lambda *args, **kwargs: self._playback.s3(name, self.key)
+
+
+class _StandInBucket:
+    def __init__(self, playback: _Playback, bucket_name: str):
+        self._playback = playback
+        self.name = bucket_name
+
+    def Object(self, key: str) -> _StandInObject:
+        return _StandInObject(self._playback, key)
+
+    def __getattr__(self, name: str) -> Any:
+        return lambda *args, **kwargs: {}
+
+
+def _normalise(value: Any) -> Any:
+    """Round-trip through JSON so replayed responses compare equal to recorded ones."""
+    return json.loads(json.dumps(value, default=str))
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def replay(
+    path: str,
+    speedup: float | None = 1.0,
+    concurrency: int = 1,
+    handler: Callable[[dict, Any], dict] | None = None,
+) -> dict:
+    """Send recorded events through the invoker against recorded stand-ins.
+
+    Args:
+        path (str): The recording.
+        speedup (float | None): Divides arrival gaps and downstream latencies.  None replays
+            as fast as possible with no simulated latency.
+        concurrency (int): Maximum number of events in flight.
+        handler (Callable, optional): The handler to drive.  Defaults to ``core_invoker.handler.handler``.
+
+    Returns:
+        dict: {"Events", "Errors", "Mismatches", "Misses", "Elapsed", "Latency": {"p50", "p95", "p99", "max"}}
+    """
+    if handler is None:
+        from .handler import handler
+
+    entries = load(path)
+    events = sorted((e for e in entries if e["kind"] == KIND_EVENT), key=lambda e: e.get("t", 0.0))
+    playback = _Playback(entries, speedup)
+
+    patches = _Patches()
+    invoker = _invoker_module()
+    patches.set(aws, "invoke_lambda", lambda arn, payload, *args, **kwargs: playback.downstream(arn, payload))
+    for name in _LOCAL_HANDLERS:
+        patches.set(invoker, name, (lambda target: lambda payload, context=None: playback.downstream(target, payload))(name))
+
+    def stand_in_bucket(get_bucket, *args, **kwargs) -> _StandInBucket:
+        return _StandInBucket(playback, kwargs.get("BucketName", ""))
+
+    buckets.add_wrapper(stand_in_bucket, innermost=True)
+
+    latencies: list[float] = []
+    errors = 0
+    mismatches = 0
+    lock = threading.Lock()
+    origin = events[0].get("t", 0.0) if events else 0.0
+    started = time.monotonic()
+
+    def send(entry: dict) -> None:
+        nonlocal errors, mismatches
+        if speedup:
+            wait = (entry.get("t", 0.0) - origin) / speedup - (time.monotonic() - started)
+            if wait > 0:
+                time.sleep(wait)
+        start = time.perf_counter()
+        try:
+            response = handler(copy.deepcopy(entry["event"]), None)
+        except Exception as e:
+            log.warning("Replayed event raised: {}", e)
+            response = None
+        elapsed = (time.perf_counter() - start) * 1000.0
+        with lock:
+            latencies.append(elapsed)
+            if is_failure(response):
+                errors += 1
+            if _normalise(redact(response)) != entry["response"]:
+                mismatches += 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            list(pool.map(send, events))
+    finally:
+        buckets.remove_wrapper(stand_in_bucket)
+        patches.restore()
+
+    return {
+        "Events": len(events),
+        "Errors": errors,
+        "Mismatches": mismatches,
+        "Misses": playback.misses,
+        "Elapsed": time.monotonic() - started,
+        "Latency": {
+            "p50": _percentile(latencies, 0.50),
+            "p95": _percentile(latencies, 0.95),
+            "p99": _percentile(latencies, 0.99),
+            "max": max(latencies, default=0.0),
+        },
+    }
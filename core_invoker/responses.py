@@ -0,0 +1,34 @@
+"""
+Classification of invoker responses.
+
+A task did not complete when its response reports an error, when admission
+control shed it ("retry") or when it stopped before its deadline
+("continue").  The SQS and S3 adapters, bulk operations and traffic replay
+all use ``is_failure`` so they agree on what a failed task is.
+"""
+
+from typing import Any
+
+from core_framework.constants import TR_RESPONSE
+
+from .admission import STATUS_RETRY
+from .deadline import STATUS_CONTINUE
+
+STATUS_ERROR = "error"
+
+FAILURE_STATUSES = (STATUS_ERROR, STATUS_RETRY, STATUS_CONTINUE)
+
+
+def is_failure(response: Any) -> bool:
+    """Return True if a response shows that the task did not complete.
+
+    Args:
+        response (Any): The invoker response, e.g. {"Response": {"Status": "error", ...}}.
+
+    Returns:
+        bool: True for a missing or malformed response and for "error", "retry" and "continue".
+    """
+    if not isinstance(response, dict):
+        return True
+    body = response.get(TR_RESPONSE, response)
+    return isinstance(body, dict) and str(body.get("Status", "")).lower() in FAILURE_STATUSES
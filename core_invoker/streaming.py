@@ -0,0 +1,252 @@
+"""
+Streaming progress for long-running tasks.
+
+``stream(event)`` runs the invoker on a worker thread and yields progress
+events while the task runs, ending with the usual final response:
+
+    >>> for event in stream(task_payload.model_dump()):
+    ...     print(event["type"], event.get("stage", ""))
+    stage_started copy
+    artefact_written
+    stage_finished copy
+    stage_started compile
+    ...
+    response
+
+Event types:
+
+* "stage_started" / "stage_finished" - a stage (copy, compile, runner) started or finished
+* "artefact_written" - an object was written to the artefacts bucket
+  (the package copy and every compiler write, seen through ``buckets.add_wrapper``)
+* "plan_target" - the diff of one plan target is ready
+* "response" - the final invoker response (always the last event)
+
+Closing the generator cancels the task cooperatively: the next progress
+event emitted by the task stops it, so a stage that has not started yet is
+never started.
+
+``ndjson_stream(event, context)`` yields the same events as newline-delimited
+JSON bytes, for an HTTP response stream (Lambda function URLs with response
+streaming, e.g. through the Lambda Web Adapter, since the managed Python
+runtime does not stream natively).
+"""
+
+from typing import Any, Callable, Iterator
+from contextvars import ContextVar
+
+import json
+import queue
+import time
+import threading
+import contextvars
+
+import core_logging as log
+import core_framework as util
+
+from . import buckets
+
+EVENT_STAGE_STARTED = "stage_started"
+EVENT_STAGE_FINISHED = "stage_finished"
+EVENT_ARTEFACT_WRITTEN = "artefact_written"
+EVENT_PLAN_TARGET = "plan_target"
+EVENT_RESPONSE = "response"
+
+
+class Cancelled(Exception):
+    """Raised inside a streamed task when the consumer has stopped listening."""
+
+
+class _Stream:
+    """The progress channel of one streamed invocation."""
+
+    def __init__(self):
+        self.events: queue.Queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def put(self, event_type: str, fields: dict) -> None:
+        with self._lock:
+            self._sequence += 1
+            event = {"type": event_type, "sequence": self._sequence, "timestamp": time.time(), **fields}
+        self.events.put(event)
+
+
+_stream: ContextVar[_Stream | None] = ContextVar("core_invoker_stream", default=None)
+_open_lock = threading.Lock()
+_open_streams = 0
+
+
+def is_streaming() -> bool:
+    """Return True if the current invocation streams its progress."""
+    return _stream.get() is not None
+
+
+def emit(event_type: str, **fields: Any) -> None:
+    """Publish a progress event to the consumer of the current invocation.
+
+    Does nothing when the invocation is not streamed.
+
+    Args:
+        event_type (str): The event type, e.g. "stage_started".
+        **fields: The event fields.
+
+    Raises:
+        Cancelled: If the consumer has closed the stream.
+    """
+    channel = _stream.get()
+    if channel is None:
+        return
+    if channel.cancelled.is_set():
+        raise Cancelled("The stream was closed by the client")
+    channel.put(event_type, fields)
+
+
+class _StreamingObject:
+    """Wraps an S3 object so that writes to it are published as "artefact_written"."""
+
+    def __init__(self, bucket_name: str, obj: Any, key: str):
+        self._bucket_name = bucket_name
+        self._object = obj
+        self._key = key
+
+    def put(self, **kwargs) -> Any:
+        response = self._object.put(**kwargs)
+        emit(EVENT_ARTEFACT_WRITTEN, bucket=self._bucket_name, key=self._key)
+        return response
+
+    def copy_from(self, **kwargs) -> Any:
+        response = self._object.copy_from(**kwargs)
+        if not (isinstance(response, dict) and "Error" in response):
+            emit(EVENT_ARTEFACT_WRITTEN, bucket=self._bucket_name, key=self._key, source=kwargs.get("CopySource", {}).get("Key"))
+        return response
+
+    def upload_file(self, Filename: str, *args, **kwargs) -> Any:
+        response = self._object.upload_file(Filename, *args, **kwargs)
+        emit(EVENT_ARTEFACT_WRITTEN, bucket=self._bucket_name, key=self._key)
+        return response
+
+    def upload_fileobj(self, Fileobj: Any, *args, **kwargs) -> Any:
+        response = self._object.upload_fileobj(Fileobj, *args, **kwargs)
+        emit(EVENT_ARTEFACT_WRITTEN, bucket=self._bucket_name, key=self._key)
+        return response
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._object, name)
+
+
+class _StreamingBucket:
+    """Wraps the artefacts bucket so that writes are published as "artefact_written"."""
+
+    def __init__(self, bucket: Any, bucket_name: str):
+        self._bucket = bucket
+        self._bucket_name = bucket_name
+
+    def Object(self, key: str) -> _StreamingObject:
+        return _StreamingObject(self._bucket_name, self._bucket.Object(key), key)
+
+    def put_object(self, **kwargs) -> Any:
+        response = self._bucket.put_object(**kwargs)
+        emit(EVENT_ARTEFACT_WRITTEN, bucket=self._bucket_name, key=kwargs["Key"])
+        return response
+
+    def upload_file(self, Filename: str, Key: str, *args, **kwargs) -> Any:
+        response = self._bucket.upload_file(Filename, Key, *args, **kwargs)
+        emit(EVENT_ARTEFACT_WRITTEN, bucket=self._bucket_name, key=Key)
+        return response
+
+    def upload_fileobj(self, Fileobj: Any, Key: str, *args, **kwargs) -> Any:
+        response = self._bucket.upload_fileobj(Fileobj, Key, *args, **kwargs)
+        emit(EVENT_ARTEFACT_WRITTEN, bucket=self._bucket_name, key=Key)
+        return response
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._bucket, name)
+
+
+def _wrap_bucket(get_bucket, *args, **kwargs) -> Any:
+    bucket = get_bucket(*args, **kwargs)
+    if _stream.get() is None:
+        return bucket
+    bucket_name = kwargs.get("BucketName") or getattr(bucket, "name", "")
+    if bucket_name != util.get_artefact_bucket_name():
+        return bucket
+    return _StreamingBucket(bucket, bucket_name)
+
+
+def _open() -> None:
+    """Publish writes to the artefacts bucket while at least one stream is active."""
+    global _open_streams
+    with _open_lock:
+        _open_streams += 1
+        buckets.add_wrapper(_wrap_bucket)
+
+
+def _close() -> None:
+    global _open_streams
+    with _open_lock:
+        _open_streams -= 1
+        if _open_streams == 0:
+            buckets.remove_wrapper(_wrap_bucket)
+
+
+def stream(event: dict, context: Any | None = None, handler: Callable[[dict, Any], dict] | None = None) -> Iterator[dict]:
+    """Run an invocation and yield its progress events, ending with the final response.
+
+    Args:
+        event (dict): The invoker event.
+        context (Any, optional): Lambda context object.
+        handler (Callable, optional): The handler to run.  Defaults to ``core_invoker.handler.handler``.
+
+    Yields:
+        dict: Progress events; the last one has type "response" and the invoker response.
+    """
+    if handler is None:
+        # Imported here because the handler itself publishes progress through this module
+        from .handler import handler
+
+    channel = _Stream()
+    done = object()
+
+    def run() -> None:
+        _stream.set(channel)
+        try:
+            response = handler(event, context)
+        except Exception as e:
+            response = {"Response": {"Status": "error", "Message": str(e)}}
+        finally:
+            _close()
+        channel.put(EVENT_RESPONSE, {"response": response})
+        channel.events.put(done)
+
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(run,), name="core-invoker-stream", daemon=True)
+    _open()
+    worker.start()
+
+    finished = False
+    try:
+        while True:
+            item = channel.events.get()
+            if item is done:
+                finished = True
+                return
+            yield item
+    finally:
+        if not finished:
+            log.info("Stream closed by the client, cancelling the task")
+            channel.cancelled.set()
+
+
+def ndjson_stream(event: dict, context: Any | None = None, handler: Callable[[dict, Any], dict] | None = None) -> Iterator[bytes]:
+    """Yield the progress events of an invocation as newline-delimited JSON.
+
+    Args:
+        event (dict): The invoker event.
+        context (Any, optional): Lambda context object.
+        handler (Callable, optional): The handler to run.
+
+    Yields:
+        bytes: One JSON document per line.
+    """
+    for progress in stream(event, context, handler):
+        yield (json.dumps(progress, default=str) + "\n").encode("utf-8")
@@ -0,0 +1,306 @@
+"""
+Span tracing for the invoker and the stages it drives.
+
+The correlation_id ties log lines together; spans add timing.  Every hop the
+invoker makes (copy, compile, runner) is recorded as a span and the active
+trace context is propagated downstream in the payload as W3C ``traceparent``
+and ``tracestate`` fields so the next Lambda can continue the same trace.
+
+Finished spans are handed to a pluggable exporter.  The default exporter
+writes spans to the log at debug level.  Set ``CORE_INVOKER_TRACE_FILE`` to
+write JSON lines to a file instead, or call ``set_exporter()`` with an
+``InMemorySpanExporter`` for local testing.
+
+Example:
+    >>> exporter = InMemorySpanExporter()
+    >>> set_exporter(exporter)
+    >>> with start_span("invoker.handler") as span:
+    ...     payload = inject({"task": "compile"})
+    >>> exporter.get_finished_spans()[0].name
+    'invoker.handler'
+"""
+
+from typing import Any, Iterator, Protocol
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, asdict
+
+import os
+import re
+import json
+import time
+import secrets
+import threading
+
+import core_logging as log
+
+TRACE_CONTEXT = "trace_context"
+TRACEPARENT = "traceparent"
+TRACESTATE = "tracestate"
+
+TRACE_FILE_ENV = "CORE_INVOKER_TRACE_FILE"
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+_TRACEPARENT_RE = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+@dataclass
+class SpanContext:
+    """The identity of a span as carried across process boundaries.
+
+    Attributes:
+        trace_id (str): 32 hex character trace identifier shared by all spans of a trace.
+        span_id (str): 16 hex character identifier of this span.
+        flags (str): 2 hex character W3C trace flags ("01" = sampled).
+        state (str): Opaque vendor ``tracestate`` value, passed through unchanged.
+    """
+
+    trace_id: str
+    span_id: str
+    flags: str = "01"
+    state: str = ""
+
+    @property
+    def traceparent(self) -> str:
+        """str: The W3C ``traceparent`` header value for this context."""
+        return f"00-{self.trace_id}-{self.span_id}-{self.flags}"
+
+
+@dataclass
+class Span:
+    """A timed unit of work.
+
+    Attributes:
+        name (str): The span name, e.g. "invoker.execute_runner".
+        context (SpanContext): The identity of this span.
+        parent_id (str | None): The span_id of the parent span, if any.
+        correlation_id (str | None): The correlation id active when the span started.
+        attributes (dict): Free form attributes describing the work.
+        start_time (float): Epoch seconds when the span started.
+        end_time (float | None): Epoch seconds when the span ended.
+        status (str): "ok" or "error".
+    """
+
+    name: str
+    context: SpanContext
+    parent_id: str | None = None
+    correlation_id: str | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    start_time: float = field(default_factory=time.time)
+    end_time: float | None = None
+    status: str = STATUS_OK
+
+    @property
+    def duration_ms(self) -> float | None:
+        """float | None: Elapsed time in milliseconds, or None if the span has not ended."""
+        if self.end_time is None:
+            return None
+        return (self.end_time - self.start_time) * 1000.0
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Set a single attribute on the span."""
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        """Return the span as a JSON serialisable dictionary."""
+        data = asdict(self)
+        data["trace_id"] = self.context.trace_id
+        data["span_id"] = self.context.span_id
+        data["duration_ms"] = self.duration_ms
+        del data["context"]
+        return data
+
+
+class SpanExporter(Protocol):
+    """Receives finished spans."""
+
+    def export(self, span: Span) -> None:  # pragma: no cover - protocol
+        ...
+
+
+class LogSpanExporter:
+    """Writes finished spans to the log at debug level."""
+
+    def export(self, span: Span) -> None:
+        log.debug("Span {} finished in {:.1f} ms", span.name, span.duration_ms or 0.0, details=span.to_dict())
+
+
+class InMemorySpanExporter:
+    """Keeps finished spans in memory.  Intended for local testing."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans: list[Span] = []
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+
+    def get_finished_spans(self) -> list[Span]:
+        """Return a copy of the spans exported so far."""
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self) -> None:
+        """Forget all exported spans."""
+        with self._lock:
+            self._spans.clear()
+
+
+class FileSpanExporter:
+    """Appends finished spans to a file as JSON lines.
+
+    Args:
+        path (str): The file to append to.  Parent folders are created if needed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+def _default_exporter() -> SpanExporter:
+    path = os.getenv(TRACE_FILE_ENV)
+    if path:
+        return FileSpanExporter(path)
+    return LogSpanExporter()
+
+
+_exporter: SpanExporter | None = None
+
+_current_span: ContextVar[Span | None] = ContextVar("core_invoker_current_span", default=None)
+
+
+def set_exporter(exporter: SpanExporter | None) -> None:
+    """Install the exporter that receives finished spans.
+
+    Args:
+        exporter (SpanExporter | None): The exporter, or None to restore the default.
+    """
+    global _exporter
+    _exporter = exporter
+
+
+def get_exporter() -> SpanExporter:
+    """Return the active exporter, creating the default one on first use."""
+    global _exporter
+    if _exporter is None:
+        _exporter = _default_exporter()
+    return _exporter
+
+
+def current_span() -> Span | None:
+    """Return the span that is active in the current context, if any."""
+    return _current_span.get()
+
+
+@contextmanager
+def start_span(
+    name: str,
+    attributes: dict | None = None,
+    parent: SpanContext | None = None,
+    correlation_id: str | None = None,
+) -> Iterator[Span]:
+    """Start a span, make it current for the duration of the block and export it on exit.
+
+    The parent is, in order of preference, the ``parent`` argument (a context
+    extracted from an incoming event) or the currently active span.  If there
+    is neither, a new trace is started.
+
+    Args:
+        name (str): The span name.
+        attributes (dict, optional): Initial span attributes.
+        parent (SpanContext, optional): Remote parent context.
+        correlation_id (str, optional): Correlation id to record.  Inherited from the active span if omitted.
+
+    Yields:
+        Span: The active span.
+    """
+    active = _current_span.get()
+    if parent is None and active is not None:
+        parent = active.context
+    if correlation_id is None and active is not None:
+        correlation_id = active.correlation_id
+
+    if parent is not None:
+        context = SpanContext(trace_id=parent.trace_id, span_id=secrets.token_hex(8), flags=parent.flags, state=parent.state)
+        parent_id = parent.span_id
+    else:
+        context = SpanContext(trace_id=secrets.token_hex(16), span_id=secrets.token_hex(8))
+        parent_id = None
+
+    span = Span(
+        name=name,
+        context=context,
+        parent_id=parent_id,
+        correlation_id=correlation_id,
+        attributes=dict(attributes or {}),
+    )
+
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.status = STATUS_ERROR
+        span.set_attribute("error", str(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end_time = time.time()
+        try:
+            get_exporter().export(span)
+        except Exception as e:  # an exporter must never break a deployment
+            log.warning("Failed to export span {}: {}", span.name, e)
+
+
+def inject(payload: dict) -> dict:
+    """Add the active trace context to an outgoing payload.
+
+    Args:
+        payload (dict): The payload to be sent downstream (usually ``TaskPayload.model_dump()``).
+
+    Returns:
+        dict: The same payload with a ``trace_context`` entry when a span is active.
+    """
+    span = _current_span.get()
+    if span is not None:
+        payload[TRACE_CONTEXT] = {TRACEPARENT: span.context.traceparent, TRACESTATE: span.context.state}
+    return payload
+
+
+def extract(event: dict) -> SpanContext | None:
+    """Read and remove the trace context from an incoming event.
+
+    The ``trace_context`` entry is removed so the remaining event validates
+    as a plain TaskPayload.  Malformed values are ignored.
+
+    Args:
+        event (dict): The incoming event.
+
+    Returns:
+        SpanContext | None: The remote parent context, or None.
+    """
+    trace_context = event.pop(TRACE_CONTEXT, None)
+    if not isinstance(trace_context, dict):
+        return None
+
+    match = _TRACEPARENT_RE.match(str(trace_context.get(TRACEPARENT, "")).strip().lower())
+    if not match:
+        return None
+
+    _version, trace_id, span_id, flags = match.groups()
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+
+    return SpanContext(trace_id=trace_id, span_id=span_id, flags=flags, state=trace_context.get(TRACESTATE) or "")
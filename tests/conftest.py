@@ -1,3 +1,13 @@
+import io
+import copy
+import time
+import threading
+
+import pytest
+
+from core_helper.magic import MagicS3Client
+
+
 def pytest_addoption(parser):
     parser.addoption(
         "--real-aws",
@@ -5,3 +15,232 @@ def pytest_addoption(parser):
         default=False,
         help="Run tests with real AWS integration",
     )
+
+
+class FakeDeployment:
+    """Minimal stand-in for DeploymentDetails."""
+
+    def __init__(self, build: str = "1"):
+        self.build = build
+
+    def get_object_key(self, object_type: str, name: str, s3: bool = False) -> str:
+        return f"{object_type}/portfolio/app/main/{self.build}/{name}"
+
+
+class FakePackage:
+    """Minimal stand-in for PackageDetails."""
+
+    def __init__(self, key: str, bucket_region: str = "us-east-1", bucket_name: str = "packages"):
+        self.bucket_name = bucket_name
+        self.bucket_region = bucket_region
+        self.key = key
+        self.mode = "local"
+
+
+class FakePayload:
+    """Minimal stand-in for a TaskPayload.
+
+    Extra keyword arguments are returned by ``model_dump`` as payload fields.
+    """
+
+    def __init__(
+        self,
+        task: str = "deploy",
+        type: str = "deployspec",
+        correlation_id: str = "exec-0001",
+        package: FakePackage | None = None,
+        deployment_details: FakeDeployment | None = None,
+        **fields,
+    ):
+        self.task = task
+        self.type = type
+        self.correlation_id = correlation_id
+        self.package = package
+        self.deployment_details = deployment_details or FakeDeployment()
+        self.fields = fields
+
+    def model_dump(self, **kwargs) -> dict:
+        return {"task": self.task, "type": self.type, "correlation_id": self.correlation_id, **copy.deepcopy(self.fields)}
+
+
+class FakeLambdaContext:
+    """Stand-in Lambda context with a fixed remaining time."""
+
+    def __init__(self, remaining_ms: int):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self) -> int:
+        return self.remaining_ms
+
+
+class FakeObject:
+    """Stand-in for an S3 Object resource of a ``FakeBucket``."""
+
+    def __init__(self, bucket: "FakeBucket", key: str):
+        self.bucket = bucket
+        self.key = key
+        self.version_id = None
+
+    def load(self) -> None:
+        with self.bucket.lock:
+            self.bucket.heads += 1
+            if self.key not in self.bucket.objects:
+                raise RuntimeError(f"Not Found: {self.key}")
+            versions = self.bucket.versions.get(self.key)
+            self.version_id = f"v{len(versions)}" if versions else None
+
+    def get(self, **kwargs) -> dict:
+        with self.bucket.lock:
+            self.bucket.reads += 1
+            data = self.bucket.objects[self.key]
+        return {"Body": io.BytesIO(data)}
+
+    def put(self, **kwargs) -> dict:
+        return self.bucket.put_object(Key=self.key, **kwargs)
+
+    def copy_from(self, CopySource: dict, **kwargs) -> dict:
+        bucket = self.bucket
+        source = CopySource["Key"]
+        with bucket.lock:
+            bucket.active += 1
+            bucket.max_active = max(bucket.max_active, bucket.active)
+        try:
+            if bucket.copy_barrier is not None:
+                bucket.copy_barrier.wait()
+            time.sleep(bucket.copy_delay)
+        finally:
+            with bucket.lock:
+                bucket.active -= 1
+        if source in bucket.fail:
+            raise RuntimeError(f"Access denied for {source}")
+        with bucket.lock:
+            if CopySource.get("VersionId"):
+                data = bucket.versions[source][int(CopySource["VersionId"][1:]) - 1]
+            elif CopySource.get("Bucket") == bucket.name and source in bucket.objects:
+                data = bucket.objects[source]
+            else:
+                data = source.encode("utf-8")
+        bucket.write(self.key, data)
+        return {"CopyObjectResult": {}}
+
+    def delete(self) -> dict:
+        with self.bucket.lock:
+            self.bucket.objects.pop(self.key, None)
+        return {}
+
+
+class FakeBucket:
+    """In-memory stand-in for an S3 Bucket resource.
+
+    ``put_object`` only accepts the keyword arguments of the real API, so
+    ``ExtraArgs`` (an upload_file argument) is rejected.
+
+    Attributes:
+        objects (dict): Object content by key.
+        reads (int): Number of ``Object.get`` calls.
+        heads (int): Number of ``Object.load`` calls.
+        fail (set): Copy sources that fail with an access error.
+        active (int): Copies running now.
+        max_active (int): Most copies that ran at the same time.
+        copy_delay (float): Seconds a copy takes.
+        copy_barrier (threading.Barrier, optional): Copies wait for each other on it.
+        write_gate (threading.Event, optional): Writes block until it is set.
+        versioned (bool): Keep every version of an object in ``versions``.
+    """
+
+    def __init__(self, name: str = "artefacts"):
+        self.name = name
+        self.lock = threading.Lock()
+        self.objects: dict[str, bytes] = {}
+        self.reads = 0
+        self.heads = 0
+        self.fail: set = set()
+        self.active = 0
+        self.max_active = 0
+        self.copy_delay = 0.0
+        self.copy_barrier: threading.Barrier | None = None
+        self.write_gate: threading.Event | None = None
+        self.versioned = False
+        self.versions: dict[str, list[bytes]] = {}
+
+    def Object(self, key: str) -> FakeObject:
+        return FakeObject(self, key)
+
+    def put_object(
+        self,
+        Key: str,
+        Body=b"",
+        ContentType: str | None = None,
+        ServerSideEncryption: str | None = None,
+        Metadata: dict | None = None,
+    ) -> dict:
+        if self.write_gate is not None:
+            self.write_gate.wait(5)
+        data = Body.read() if hasattr(Body, "read") else Body
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.write(Key, data)
+        return {}
+
+    def write(self, key: str, data: bytes) -> None:
+        with self.lock:
+            self.objects[key] = data
+            if self.versioned:
+                self.versions.setdefault(key, []).append(data)
+
+
+@pytest.fixture
+def make_payload():
+    """
+    Build TaskPayload stand-ins.
+
+    :returns: A factory taking the ``FakePayload`` arguments
+    :rtype: Callable[..., FakePayload]
+    """
+    return FakePayload
+
+
+@pytest.fixture
+def make_package():
+    """
+    Build PackageDetails stand-ins.
+
+    :returns: A factory taking the ``FakePackage`` arguments
+    :rtype: Callable[..., FakePackage]
+    """
+    return FakePackage
+
+
+@pytest.fixture
+def make_deployment():
+    """
+    Build DeploymentDetails stand-ins.
+
+    :returns: A factory taking the build number
+    :rtype: Callable[..., FakeDeployment]
+    """
+    return FakeDeployment
+
+
+@pytest.fixture
+def lambda_context():
+    """
+    Build Lambda context stand-ins.
+
+    :returns: A factory taking the remaining time in milliseconds
+    :rtype: Callable[[int], FakeLambdaContext]
+    """
+    return FakeLambdaContext
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    """
+    Serve an in-memory bucket from MagicS3Client.get_bucket.
+
+    :returns: The stand-in bucket
+    :rtype: FakeBucket
+    """
+    bucket = FakeBucket()
+    monkeypatch.setattr(MagicS3Client, "get_bucket", classmethod(lambda cls, **kwargs: bucket))
+    return bucket
@@ -0,0 +1,114 @@
+"""
+Unit tests for the SQS and S3 event-source adapters.
+"""
+
+import json
+import threading
+
+import pytest
+
+from core_invoker import adapters
+
+
+def _sqs_event(bodies: list) -> dict:
+    return {
+        "Records": [
+            {"messageId": f"m{i}", "eventSource": "aws:sqs", "body": body if isinstance(body, str) else json.dumps(body)}
+            for i, body in enumerate(bodies)
+        ]
+    }
+
+
+def _s3_record(key: str) -> dict:
+    return {
+        "eventSource": "aws:s3",
+        "eventName": "ObjectCreated:Put",
+        "awsRegion": "us-east-1",
+        "s3": {"bucket": {"name": "client-packages"}, "object": {"key": key}},
+    }
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """
+    Replace the invoker handler with a stub that fails on request.
+
+    :returns: The events received by the stub
+    :rtype: list
+    """
+    received = []
+    lock = threading.Lock()
+
+    def fake_handler(event, context=None):
+        with lock:
+            received.append(event)
+        if event.get("fail") == "raise":
+            raise RuntimeError("boom")
+        if event.get("fail"):
+            return {"Response": {"Status": "error", "Message": "failed"}}
+        return {"Response": {"Status": "ok"}}
+
+    monkeypatch.setattr(adapters, "handler", fake_handler)
+    return received
+
+
+def test_sqs_partial_batch_failures(calls):
+    """Only the failed messages are reported for retry."""
+    event = _sqs_event([{"task": "deploy"}, {"fail": True}, "not json", {"fail": "raise"}, {"task": "compile"}])
+
+    response = adapters.sqs_handler(event)
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "m1"}, {"itemIdentifier": "m2"}, {"itemIdentifier": "m3"}]}
+    assert len(calls) == 4
+
+
+def test_sqs_all_succeed(calls):
+    """A clean batch reports no failures."""
+    response = adapters.sqs_handler(_sqs_event([{"task": "deploy"}] * 20), max_workers=4)
+
+    assert response == {"batchItemFailures": []}
+    assert len(calls) == 20
+
+
+def test_sqs_wrapped_s3_notification(calls):
+    """S3 notifications delivered through a queue become compile tasks."""
+    body = {"Records": [_s3_record("packages/portfolio/app/main/12/package.zip")]}
+
+    response = adapters.sqs_handler(_sqs_event([body]))
+
+    assert response == {"batchItemFailures": []}
+    assert calls[0]["task"] == "compile"
+
+
+def test_s3_upload_maps_to_compile(calls):
+    """A package upload is compiled from the uploaded object."""
+    response = adapters.s3_handler({"Records": [_s3_record("packages/portfolio/app/main/12/package.zip")]})
+
+    assert response["Results"] == [{"Response": {"Status": "ok"}}]
+    task_payload = adapters.TaskPayload.model_validate(calls[0])
+    assert task_payload.task == "compile"
+    assert task_payload.package.key == "packages/portfolio/app/main/12/package.zip"
+    assert task_payload.package.bucket_name == "client-packages"
+
+
+def test_s3_skips_objects_outside_packages_layout(calls):
+    """Objects outside the packages layout are skipped, so the rest of the batch is not retried."""
+    event = {"Records": [_s3_record("uploads/readme.txt"), _s3_record("packages/portfolio/app/main/12/package.zip")]}
+
+    response = adapters.s3_handler(event)
+
+    assert response["Results"] == [{"Response": {"Status": "ok"}}]
+    assert response["Skipped"] == ["uploads/readme.txt"]
+    assert len(calls) == 1
+
+    # The same notification through a queue does not fail the message
+    assert adapters.sqs_handler(_sqs_event([event])) == {"batchItemFailures": []}
+    assert len(calls) == 2
+
+
+def test_package_key_layout():
+    """Only keys in the packages layout are package keys."""
+    assert adapters.is_package_key("packages/portfolio/app/main/12/package.zip")
+    assert adapters.is_package_key("client/packages/portfolio/app/main/12/package.zip")
+    assert not adapters.is_package_key("uploads/package.zip")
+    assert not adapters.is_package_key("packages/portfolio/app/package.zip")
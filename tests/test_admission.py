@@ -0,0 +1,211 @@
+"""
+Unit tests for admission control, including an overload simulation.
+"""
+
+import threading
+import time
+
+import pytest
+
+from core_invoker import admission
+
+
+@pytest.fixture(autouse=True)
+def controller(monkeypatch):
+    """
+    Switch admission control on and install a fresh controller for every test.
+
+    :returns: The controller
+    :rtype: admission.AdmissionController
+    """
+    monkeypatch.setenv(admission.ADMISSION_ENV, "true")
+    installed = admission.AdmissionController(max_in_flight=4)
+    admission.set_controller(installed)
+    yield installed
+    admission.set_controller(None)
+
+
+def test_priority_from_event_or_task():
+    """An explicit priority wins; otherwise the task decides."""
+    event = {"task": "compile", "priority": "LOW"}
+    assert admission.priority_of(event, "compile") == "low"
+    assert "priority" not in event
+
+    assert admission.priority_of({}, "deploy") == "high"
+    assert admission.priority_of({}, "compile") == "normal"
+    assert admission.priority_of({}, "deploy", bulk=True) == "low"
+    assert admission.priority_of({"priority": "urgent"}, "plan") == "low"
+
+
+def test_low_priority_is_shed_first(controller):
+    """Low priority uses half of the in-flight limit, high priority all of it."""
+    low = [controller.try_acquire("runner", "low") for _ in range(3)]
+    assert [a.admitted for a in low] == [True, True, False]
+    assert low[2].retry_after >= admission.MIN_RETRY_AFTER
+
+    high = [controller.try_acquire("runner", "high") for _ in range(3)]
+    assert [a.admitted for a in high] == [True, True, False]
+
+    # Other targets are not affected
+    assert controller.try_acquire("deployspec_compiler", "low").admitted
+
+
+def test_latency_saturation_sheds_all_but_high(controller):
+    """When recent latency rises well above the baseline only high priority is admitted."""
+    for duration in [100, 100, 100, 100, 100, 1000, 1000, 1000]:
+        controller.release(controller.try_acquire("runner", "high"), duration)
+
+    # One probe gets through, the next task is shed
+    assert controller.try_acquire("runner", "normal").probe
+    assert not controller.try_acquire("runner", "normal").admitted
+    assert controller.try_acquire("runner", "high").admitted
+
+
+def test_probes_clear_latency_saturation(controller, monkeypatch):
+    """Probe tasks admitted while latency is high bring the signal back once the target recovers."""
+    now = [100.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    for duration in [100, 100, 100, 100, 100, 1000, 1000, 1000]:
+        controller.release(controller.try_acquire("runner", "high"), duration)
+
+    for _ in range(10):
+        probe = controller.try_acquire("runner", "low")
+        assert probe.admitted and probe.probe
+        assert not controller.try_acquire("runner", "low").admitted
+        controller.release(probe, 100)
+        now[0] += controller.probe_interval
+        if not controller._latency_saturated(controller._targets["runner"]):
+            break
+
+    assert controller.try_acquire("runner", "low").admitted
+    assert controller.try_acquire("runner", "low").admitted
+
+
+def test_release_requires_admitted_task(controller):
+    """Rejected tasks and tasks released twice do not change the in-flight count."""
+    for _ in range(2):
+        controller.try_acquire("plan", "low")
+    rejected = controller.try_acquire("plan", "low")
+
+    with pytest.raises(ValueError):
+        controller.release(rejected, 10)
+
+    admitted = controller.try_acquire("plan", "high")
+    controller.release(admitted, 10)
+    with pytest.raises(ValueError):
+        controller.release(admitted, 10)
+
+    assert controller.snapshot()["plan"]["InFlight"] == 2
+
+
+def test_disabled_by_default(controller, monkeypatch):
+    """Admission control is off unless switched on."""
+    monkeypatch.delenv(admission.ADMISSION_ENV)
+    assert not admission.is_enabled()
+
+
+def test_retry_response(controller):
+    """A shed task gets a structured retry response without running."""
+    for _ in range(2):
+        controller.try_acquire("plan", "low")
+
+    ran = []
+    response = admission.run("plan", "low", lambda: ran.append(1) or {"Response": {}})
+
+    assert ran == []
+    assert response["Response"]["Status"] == "retry"
+    assert response["Response"]["RetryAfter"] >= 1
+    assert response["Response"]["Target"] == "plan"
+
+
+def test_disabled(controller, monkeypatch):
+    """Admission control can be switched off."""
+    monkeypatch.setenv(admission.ADMISSION_ENV, "false")
+    for _ in range(10):
+        controller.try_acquire("runner", "low")
+
+    assert admission.run("runner", "low", lambda: {"Response": "ok"}) == {"Response": "ok"}
+
+
+# Time the simulated downstream takes per task, in seconds
+SERVICE_TIME = 0.02
+
+
+def _p99(latencies: list[float]) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(round(0.99 * (len(ordered) - 1))))]
+
+
+def _simulate(shedding: bool, monkeypatch) -> dict:
+    """
+    Drive a slow downstream with more concurrent callers than it can serve.
+
+    The downstream serves 4 tasks at a time in ``SERVICE_TIME`` each; callers
+    beyond that queue for a slot.  16 low priority and 4 high priority callers
+    each send 10 tasks.
+
+    :returns: The admitted, queued and shed task counts per priority, and the
+        latencies of admitted tasks in seconds under "latency"
+    :rtype: dict
+    """
+    monkeypatch.setenv(admission.ADMISSION_ENV, "true" if shedding else "false")
+
+    slots = threading.Semaphore(4)
+    lock = threading.Lock()
+    result = {name: {"low": 0, "high": 0} for name in ("admitted", "queued", "shed")}
+    result["latency"] = {"low": [], "high": []}
+
+    def downstream(priority: str) -> dict:
+        if not slots.acquire(blocking=False):
+            with lock:
+                result["queued"][priority] += 1
+            slots.acquire()
+        try:
+            time.sleep(SERVICE_TIME)
+        finally:
+            slots.release()
+        return {"Response": {"Status": "ok"}}
+
+    def caller(priority: str) -> None:
+        for _ in range(10):
+            start = time.perf_counter()
+            response = admission.run("runner", priority, lambda: downstream(priority))
+            elapsed = time.perf_counter() - start
+            outcome = "shed" if response["Response"]["Status"] == "retry" else "admitted"
+            with lock:
+                result[outcome][priority] += 1
+                if outcome == "admitted":
+                    result["latency"][priority].append(elapsed)
+            if outcome == "shed":
+                time.sleep(0.005)
+
+    threads = [threading.Thread(target=caller, args=("low",)) for _ in range(16)]
+    threads += [threading.Thread(target=caller, args=("high",)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return result
+
+
+def test_overload_keeps_high_priority_out_of_the_queue(monkeypatch):
+    """Under overload, shedding keeps the downstream within its capacity so the high priority p99 stays stable."""
+    baseline = _simulate(shedding=False, monkeypatch=monkeypatch)
+
+    admission.set_controller(admission.AdmissionController(max_in_flight=4))
+    shedding = _simulate(shedding=True, monkeypatch=monkeypatch)
+
+    # Without shedding 20 callers queue for 4 slots
+    assert baseline["shed"] == {"low": 0, "high": 0}
+    assert baseline["queued"]["low"] + baseline["queued"]["high"] > 0
+
+    # With shedding no more than 4 tasks are in flight, so nothing waits for a slot
+    assert shedding["queued"] == {"low": 0, "high": 0}
+    # Nearly all of the shedding falls on low priority
+    assert shedding["shed"]["low"] > 4 * shedding["shed"]["high"]
+    assert shedding["admitted"]["high"] >= 30
+
+    # High priority latency stays near the service time instead of growing with the queue
+    high_p99 = _p99(shedding["latency"]["high"])
+    assert high_p99 < 2 * SERVICE_TIME
+    assert high_p99 < 0.5 * _p99(baseline["latency"]["high"])
@@ -0,0 +1,128 @@
+"""
+Unit tests for the local-mode in-process artefact cache.
+"""
+
+import io
+import threading
+
+import pytest
+
+from core_invoker import artefact_cache, recording
+from core_helper.magic import MagicS3Client
+
+from core_invoker.artefact_cache import ArtefactCache
+
+
+@pytest.fixture
+def slow_bucket(bucket):
+    """
+    The in-memory bucket with writes that wait for ``write_gate``, and an empty cache.
+
+    :returns: The stand-in bucket
+    :rtype: FakeBucket
+    """
+    bucket.write_gate = threading.Event()
+    artefact_cache.get_cache().clear()
+    return bucket
+
+
+def test_lru_eviction_by_size():
+    """The least recently used objects are evicted to stay within the size bound."""
+    cache = ArtefactCache(max_bytes=10)
+    cache.put("b", "one", b"1234")
+    cache.put("b", "two", b"5678")
+    assert cache.get("b", "one") == b"1234"
+
+    cache.put("b", "three", b"9999")
+
+    assert cache.get("b", "two") is None
+    assert cache.get("b", "one") == b"1234"
+    assert cache.size == 8
+    assert cache.evictions == 1
+
+
+def test_compile_output_served_from_memory(slow_bucket):
+    """Reads of objects written in the same process do not go to S3, and writes land on exit."""
+    with artefact_cache.scope(enabled=True) as cache:
+        compiler_bucket = MagicS3Client.get_bucket(Region="us-east-1", BucketName="artefacts")
+        compiler_bucket.put_object(Key="artefacts/app/template.yaml", Body=io.BytesIO(b"Resources: {}"))
+
+        # The write is still pending, but the runner sees the content
+        assert "artefacts/app/template.yaml" not in slow_bucket.objects
+        runner_bucket = MagicS3Client.get_bucket(Region="us-east-1", BucketName="artefacts")
+        body = runner_bucket.Object("artefacts/app/template.yaml").get()["Body"].read()
+        assert body == b"Resources: {}"
+        assert slow_bucket.reads == 0
+        assert cache.hits == 1
+
+        slow_bucket.write_gate.set()
+
+    assert slow_bucket.objects["artefacts/app/template.yaml"] == b"Resources: {}"
+    assert not isinstance(MagicS3Client.get_bucket(BucketName="artefacts"), artefact_cache.CachingBucket)
+
+
+def test_objects_only_read_are_not_cached(slow_bucket):
+    """Objects written by other processes are always read from S3."""
+    slow_bucket.objects["artefacts/app/package.zip"] = b"zip"
+
+    with artefact_cache.scope(enabled=True):
+        s3 = MagicS3Client.get_bucket(BucketName="artefacts")
+        s3.Object("artefacts/app/package.zip").get()
+        s3.Object("artefacts/app/package.zip").get()
+
+    assert slow_bucket.reads == 2
+
+
+def test_disabled_scope_is_transparent(slow_bucket):
+    """With the cache disabled buckets are not wrapped."""
+    with artefact_cache.scope(enabled=False) as cache:
+        assert cache is None
+        assert MagicS3Client.get_bucket(BucketName="artefacts") is slow_bucket
+
+
+def test_each_scope_flushes_its_own_writes(slow_bucket):
+    """A scope that exits while another one is still open makes its own writes durable."""
+    entered = threading.Event()
+    leave = threading.Event()
+
+    def other_invocation():
+        with artefact_cache.scope(enabled=True):
+            entered.set()
+            leave.wait(5)
+
+    thread = threading.Thread(target=other_invocation)
+    thread.start()
+    assert entered.wait(5)
+    try:
+        with artefact_cache.scope(enabled=True):
+            MagicS3Client.get_bucket(BucketName="artefacts").put_object(Key="artefacts/app/actions.yaml", Body=b"[]")
+            slow_bucket.write_gate.set()
+
+        assert slow_bucket.objects["artefacts/app/actions.yaml"] == b"[]"
+    finally:
+        leave.set()
+        thread.join()
+
+
+def test_recording_stopped_inside_a_scope(slow_bucket, tmp_path):
+    """Stopping a recorder while a cache scope is open neither breaks the scope nor leaves the recorder installed."""
+    slow_bucket.write_gate.set()
+    slow_bucket.objects["artefacts/app/source.zip"] = b"zip"
+    recording.start_recording(str(tmp_path / "traffic.jsonl.gz"))
+    try:
+        with artefact_cache.scope(enabled=True):
+            wrapped = MagicS3Client.get_bucket(BucketName="artefacts")
+            recording.stop_recording()
+
+            # The bucket wrapped by the stopped recorder still works
+            source = {"Bucket": "artefacts", "Key": "artefacts/app/source.zip"}
+            wrapped.Object("artefacts/app/package.zip").copy_from(CopySource=source)
+
+            current = MagicS3Client.get_bucket(BucketName="artefacts")
+            assert isinstance(current, artefact_cache.CachingBucket)
+            assert current._bucket is slow_bucket
+    finally:
+        recording.stop_recording()
+
+    assert slow_bucket.objects["artefacts/app/package.zip"] == b"zip"
+    assert MagicS3Client.get_bucket(BucketName="artefacts") is slow_bucket
@@ -0,0 +1,180 @@
+"""
+Unit tests for the content-addressed artefact store.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import core_invoker.handler as handler
+from core_invoker import artefact_store
+from core_invoker.artefact_store import ContentAddressedStore, MemoryBackend, S3Backend, compute_digest
+
+
+@pytest.fixture
+def store() -> ContentAddressedStore:
+    """
+    Create a store over an in-memory stand-in for S3.
+
+    :returns: The store
+    :rtype: ContentAddressedStore
+    """
+    return ContentAddressedStore(MemoryBackend())
+
+
+def test_unchanged_content_only_writes_refs(store, make_deployment):
+    """A second build with identical content reuses every blob."""
+    files = {"package.zip": b"zip-bytes", "actions.yaml": b"- name: deploy"}
+
+    first = store.stage(make_deployment("1"), files)
+    second = store.stage(make_deployment("2"), files)
+
+    assert first["Written"] == 2
+    assert second["Written"] == 0
+    assert second["Reused"] == 2
+    assert store.read_object(make_deployment("2"), "package.zip") == b"zip-bytes"
+
+
+def test_promote_writes_ref_only(store, make_deployment):
+    """Promotion points the release at the same digests without copying blobs."""
+    store.stage(make_deployment("latest"), {"template.yaml": b"Resources: {}"})
+    blobs_before = list(store.backend.list(f"{store.prefix}/blobs/"))
+
+    ref = store.promote(make_deployment("latest"), make_deployment("1.0.0"))
+
+    assert list(store.backend.list(f"{store.prefix}/blobs/")) == blobs_before
+    assert ref["Objects"]["template.yaml"]["Digest"] == compute_digest(b"Resources: {}")
+    assert store.read_object(make_deployment("1.0.0"), "template.yaml") == b"Resources: {}"
+
+
+def test_promote_missing_source(store, make_deployment):
+    """Promoting a deployment without a ref fails."""
+    with pytest.raises(KeyError):
+        store.promote(make_deployment("missing"), make_deployment("1.0.0"))
+
+
+def test_capture_existing_artefacts(store, make_deployment):
+    """Objects written by the compilers to the classic layout are captured."""
+    store.backend.put("artefacts/portfolio/app/main/7/package.zip", b"pkg")
+    store.backend.put("artefacts/portfolio/app/main/7/stack/template.yaml", b"tpl")
+
+    result = store.capture(make_deployment("7"))
+
+    assert sorted(result["Ref"]["Objects"]) == ["package.zip", "stack/template.yaml"]
+
+
+def test_garbage_collection(store, make_deployment):
+    """Only blobs that no ref points at are collected."""
+    store.stage(make_deployment("1"), {"package.zip": b"old"})
+    store.stage(make_deployment("1"), {"package.zip": b"new"})
+
+    # Fresh blobs are protected by the grace period
+    assert store.collect_garbage()["Deleted"] == []
+
+    report = store.collect_garbage(grace=timedelta(0), dry_run=True)
+    assert report["Deleted"] == [compute_digest(b"old")]
+    assert store.get_blob(compute_digest(b"old")) == b"old"
+
+    report = store.collect_garbage(grace=timedelta(0))
+    assert report["Deleted"] == [compute_digest(b"old")]
+    with pytest.raises(KeyError):
+        store.get_blob(compute_digest(b"old"))
+    assert store.read_object(make_deployment("1"), "package.zip") == b"new"
+
+
+def test_reused_blob_is_refreshed(store, make_deployment):
+    """Reusing a blob moves it back inside the garbage collection grace period."""
+    store.stage(make_deployment("1"), {"package.zip": b"shared"})
+    key = store.blob_key(compute_digest(b"shared"))
+    store.backend._objects[key] = (b"shared", datetime.now(timezone.utc) - timedelta(days=1))
+
+    store.stage(make_deployment("2"), {"package.zip": b"shared"})
+
+    modified = dict(store.backend.list(key))[key]
+    assert modified > datetime.now(timezone.utc) - timedelta(minutes=1)
+
+
+def test_garbage_collection_rereads_refs(make_deployment):
+    """A ref written while the blobs are listed keeps the blob it points at."""
+    digest = compute_digest(b"old")
+
+    class _Backend(MemoryBackend):
+        def list(self, prefix):
+            items = list(super().list(prefix))
+            if "/blobs/" in prefix:
+                # A concurrent build reuses the blob and writes its ref
+                store.write_ref(make_deployment("2"), {"package.zip": {"Digest": digest, "Size": 3}})
+            yield from items
+
+    store = ContentAddressedStore(_Backend())
+    store.put_blob(b"old")
+
+    report = store.collect_garbage(grace=timedelta(0))
+
+    assert report["Deleted"] == []
+    assert store.read_object(make_deployment("2"), "package.zip") == b"old"
+
+
+def test_garbage_collection_skips_blob_reused_during_scan(make_deployment):
+    """A blob reused after the scan, but before its ref is written, is not deleted."""
+    digest = compute_digest(b"old")
+
+    class _Backend(MemoryBackend):
+        def list(self, prefix):
+            items = list(super().list(prefix))
+            if "/blobs/" in prefix:
+                # A concurrent build reuses the blob; its ref is written after the collection
+                store.put_blob(b"old")
+            yield from items
+
+    store = ContentAddressedStore(_Backend())
+    store.put_blob(b"old")
+    key = store.blob_key(digest)
+    store.backend._objects[key] = (b"old", datetime.now(timezone.utc) - timedelta(days=1))
+
+    report = store.collect_garbage(grace=timedelta(hours=1))
+
+    assert report["Deleted"] == []
+    assert store.get_blob(digest) == b"old"
+
+
+@pytest.mark.parametrize("type_", ["deployspec", "pipeline"])
+def test_promoted_build_is_not_recompiled(monkeypatch, make_payload, make_deployment, type_):
+    """A compile of a promoted build writes the promoted artefacts instead of copying and compiling."""
+    monkeypatch.setenv(artefact_store.STORE_ENV, "true")
+    store = ContentAddressedStore(MemoryBackend())
+    artefact_store.set_store(store)
+    compiled = []
+
+    def compile_latest(task_payload):
+        compiled.append(task_payload.deployment_details.build)
+        store.backend.put(f"artefacts/portfolio/app/main/{task_payload.deployment_details.build}/actions.yaml", b"- deploy")
+        return {"Status": artefact_store.STATUS_COMPILE_COMPLETE}
+
+    monkeypatch.setattr(handler, "copy_to_artefacts", lambda task_payload: None)
+    monkeypatch.setattr(handler, "execute_deployspec_compiler", compile_latest)
+    monkeypatch.setattr(handler, "execute_pipeline_compiler", compile_latest)
+    try:
+        # Compiling "latest" captures its artefacts
+        latest = make_payload(task="compile", type=type_, deployment_details=make_deployment("latest"))
+        handler._route(latest, run_async=False, bulk_selector=None)
+        store.promote(make_deployment("latest"), make_deployment("1.0.0"))
+
+        release = make_payload(task="compile", type=type_, deployment_details=make_deployment("1.0.0"))
+        response = handler._route(release, run_async=False, bulk_selector=None)
+    finally:
+        artefact_store.set_store(None)
+
+    assert compiled == ["latest"]
+    assert response["Status"] == artefact_store.STATUS_COMPILE_COMPLETE
+    assert store.backend.get("artefacts/portfolio/app/main/1.0.0/actions.yaml") == b"- deploy"
+
+
+def test_s3_backend(bucket):
+    """Blobs are written with server-side encryption and touched in place."""
+    backend = S3Backend(region="us-east-1", bucket_name="artefacts")
+
+    backend.put("artefacts/cas/blob", b"data")
+    backend.touch("artefacts/cas/blob")
+
+    assert bucket.objects["artefacts/cas/blob"] == b"data"
@@ -0,0 +1,220 @@
+"""
+Unit tests for dependency-ordered bulk deploy and teardown.
+"""
+
+import threading
+import time
+
+import pytest
+
+from core_framework.models import TaskPayload
+
+import core_invoker.handler as handler
+from core_invoker import bulk, deadline, executions
+from core_invoker.bulk import BulkNode
+
+
+class _Template:
+    """Minimal stand-in for the template TaskPayload."""
+
+    def __init__(self, task: str):
+        self.task = task
+
+
+class _AppPayload:
+    def __init__(self, app: str):
+        self.app = app
+
+
+def _factory(task_payload, app: str) -> _AppPayload:
+    return _AppPayload(app)
+
+
+# network <- db <- web, network <- cache <- web, batch (independent)
+NODES = [
+    BulkNode("network"),
+    BulkNode("db", ["network"]),
+    BulkNode("cache", ["network"]),
+    BulkNode("web", ["db", "cache"]),
+    BulkNode("batch"),
+]
+
+
+def test_waves_deploy_and_teardown():
+    """Deploys run dependencies first, teardowns run dependants first."""
+    assert bulk.build_waves(NODES) == [["batch", "network"], ["cache", "db"], ["web"]]
+    assert bulk.build_waves(NODES, reverse=True) == [["batch", "web"], ["cache", "db"], ["network"]]
+
+
+def test_cycle_detected():
+    """A dependency cycle is rejected."""
+    with pytest.raises(ValueError):
+        bulk.build_waves([BulkNode("a", ["b"]), BulkNode("b", ["a"])])
+
+
+def test_failure_skips_downstream_only():
+    """A failed app skips its dependants but independent branches finish."""
+
+    def execute(payload):
+        if payload.app == "db":
+            return {"Response": {"Status": "error", "Message": "stack failed"}}
+        return {"Response": {"Status": "ok"}}
+
+    result = bulk.execute_bulk(_Template("deploy"), NODES, execute=execute, payload_factory=_factory)
+
+    statuses = {app: r["Status"] for app, r in result["Results"].items()}
+    assert result["Status"] == "error"
+    assert statuses == {
+        "network": bulk.NODE_SUCCEEDED,
+        "batch": bulk.NODE_SUCCEEDED,
+        "db": bulk.NODE_FAILED,
+        "cache": bulk.NODE_SUCCEEDED,
+        "web": bulk.NODE_SKIPPED,
+    }
+
+
+@pytest.mark.parametrize("status", ["retry", "continue"])
+def test_unfinished_app_blocks_dependants(status):
+    """An app that was shed or stopped before its deadline did not deploy, so its dependants are skipped."""
+
+    def execute(payload):
+        return {"Response": {"Status": status if payload.app == "network" else "ok"}}
+
+    result = bulk.execute_bulk(_Template("deploy"), NODES, execute=execute, payload_factory=_factory)
+
+    assert result["Results"]["network"]["Status"] == bulk.NODE_FAILED
+    assert result["Results"]["web"]["Status"] == bulk.NODE_SKIPPED
+
+
+def test_waves_wait_for_step_functions(monkeypatch):
+    """A wave ends when the step functions of its apps end, and a failed execution skips its dependants."""
+    running = {}
+    order = []
+
+    def execute(payload):
+        order.append(("start", payload.app))
+        running[payload.app] = 2
+        return {"Response": {"Status": "STARTED", "executionArn": f"arn:aws:states:us-east-1:1:execution:runner:{payload.app}"}}
+
+    def describe_execution(arn):
+        app = arn.rsplit(":", 1)[-1]
+        running[app] -= 1
+        if running[app] > 0:
+            return {"Status": executions.STATUS_RUNNING, "ExecutionArn": arn}
+        order.append(("end", app))
+        if app == "db":
+            return {"Status": executions.STATUS_FAILED, "ExecutionArn": arn, "Message": "Stack create failed"}
+        return {"Status": executions.STATUS_COMPLETE, "ExecutionArn": arn}
+
+    monkeypatch.setattr(executions, "describe_execution", describe_execution)
+
+    nodes = [BulkNode("network"), BulkNode("db", ["network"]), BulkNode("web", ["db"])]
+    result = bulk.execute_bulk(_Template("deploy"), nodes, execute=execute, payload_factory=_factory, poll_interval=0)
+
+    assert order == [("start", "network"), ("end", "network"), ("start", "db"), ("end", "db")]
+    assert result["Results"]["db"]["Message"] == "Stack create failed"
+    assert result["Results"]["web"]["Status"] == bulk.NODE_SKIPPED
+
+
+def test_bulk_rejects_async(make_payload):
+    """A bulk task cannot be started fire-and-forget."""
+    with pytest.raises(ValueError):
+        handler._route(make_payload(task="deploy"), run_async=True, bulk_selector={"apps": ["web"]})
+
+
+def test_bulk_runs_in_runner_stage(monkeypatch, make_payload, lambda_context):
+    """A bulk task that does not fit in the time left stops before it starts any app."""
+    monkeypatch.setattr(bulk, "execute_bulk", lambda *args, **kwargs: pytest.fail("bulk started"))
+    deadline.set_current(deadline.from_invocation({}, lambda_context(2000)))
+    try:
+        with pytest.raises(deadline.DeadlineExceeded):
+            handler._handle_bulk(make_payload(task="deploy"), {"apps": ["web"]})
+    finally:
+        deadline.set_current(None)
+
+
+def test_waves_run_in_parallel_within_bound():
+    """Apps of a wave run concurrently up to max_parallel."""
+    lock = threading.Lock()
+    active = {"now": 0, "max": 0}
+    order = []
+
+    def execute(payload):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+            order.append(payload.app)
+        time.sleep(0.05)
+        with lock:
+            active["now"] -= 1
+        return {"Response": {"Status": "ok"}}
+
+    nodes = [BulkNode(f"app-{i}") for i in range(6)] + [BulkNode("last", [f"app-{i}" for i in range(6)])]
+
+    result = bulk.execute_bulk(_Template("teardown"), nodes, max_parallel=3, execute=execute, payload_factory=_factory)
+
+    assert result["Status"] == "ok"
+    assert active["max"] == 3
+    # teardown: "last" depends on every app, so it is removed first
+    assert order[0] == "last"
+
+
+def test_selector_resolver_include():
+    """The include patterns filter the selected apps."""
+    selector = {"apps": ["web-a", {"app": "web-b", "depends_on": ["db"]}, "db"], "include": ["web-*"]}
+
+    nodes = bulk.selector_resolver(None, selector)
+
+    assert [(n.app, n.depends_on) for n in nodes] == [("web-a", []), ("web-b", ["db"])]
+
+
+def test_app_payload_keeps_template_options():
+    """Every app inherits the options of the template; only the app locations change."""
+    template = TaskPayload.from_arguments(
+        task="deploy",
+        client="client",
+        portfolio="portfolio",
+        app="web",
+        branch="main",
+        build="7",
+    )
+    template.dry_run = True
+    template.force = True
+
+    app_payload = bulk.app_task_payload(template, "db")
+
+    assert app_payload.dry_run and app_payload.force
+    assert app_payload.identity == template.identity
+    assert app_payload.deployment_details.app == "db"
+    assert app_payload.deployment_details.build == "7"
+    assert template.deployment_details.app == "web"
+
+
+def test_registry_resolver(monkeypatch):
+    """Without an app list the apps and their dependencies come from the app registry."""
+    registry = pytest.importorskip("core_db.registry.app")
+
+    class _Facts:
+        def __init__(self, app_regex: str, metadata: dict | None = None):
+            self.AppRegex = app_regex
+            self.Metadata = metadata
+
+    class _Model:
+        @staticmethod
+        def query(portfolio):
+            return [
+                _Facts(f"^prn:{portfolio}:network:.*:.*$"),
+                _Facts(f"^prn:{portfolio}:web-a:.*:.*$", {bulk.DEPENDS_ON_METADATA: ["network"]}),
+                _Facts(f"^prn:{portfolio}:.*:.*:.*$"),
+            ]
+
+    monkeypatch.setattr(registry.AppFactsFactory, "get_model", lambda client: _Model)
+
+    class _Template:
+        class deployment_details:
+            client = "client"
+            portfolio = "portfolio"
+
+    nodes = bulk.resolve_apps(_Template(), {"include": ["*"]})
+
+    assert [(n.app, n.depends_on) for n in nodes] == [("network", []), ("web-a", ["network"])]
@@ -0,0 +1,114 @@
+"""
+Unit tests for deadline-aware execution and stage checkpoints.
+"""
+
+import time
+
+import pytest
+
+import core_invoker.handler as handler
+from core_invoker import deadline
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    """Start every test with the default stage budgets and no current deadline."""
+    deadline.get_budgets().reset()
+    yield
+    deadline.get_budgets().reset()
+    deadline.set_current(None)
+
+
+def test_from_invocation_uses_earliest_deadline(lambda_context):
+    """The earlier of the Lambda timeout and the requested deadline wins."""
+    now = time.time() * 1000.0
+    event = {"task": "compile", "deadline": now + 5000, "checkpoint": {"completed": ["copy"]}}
+
+    budget = deadline.from_invocation(event, lambda_context(60000))
+
+    assert event == {"task": "compile"}
+    assert 4000 < budget.remaining_ms() <= 5000
+    assert budget.completed == ["copy"]
+
+    assert 50000 < deadline.from_invocation({}, lambda_context(60000)).remaining_ms() <= 60000
+    assert deadline.from_invocation({}, None).remaining_ms() is None
+
+
+def test_stage_that_does_not_fit_is_not_started():
+    """A stage whose budget exceeds the time left raises before it runs."""
+    budget = deadline.Deadline(expires_at_ms=time.time() * 1000.0 + 5000, completed=["copy"])
+    started = []
+
+    with pytest.raises(deadline.DeadlineExceeded) as e:
+        budget.run_stage(deadline.STAGE_COMPILE, lambda: started.append("compile"))
+
+    assert started == []
+    response = deadline.continue_response(e.value)["Response"]
+    assert response["Status"] == "continue"
+    assert response["Stage"] == "compile"
+    assert response["Checkpoint"] == {"completed": ["copy"]}
+
+
+def test_budgets_follow_measured_durations():
+    """Once measured, a stage budget is its duration with a margin, never below the default."""
+    budgets = deadline.get_budgets()
+    budgets.record(deadline.STAGE_COPY, 100.0)
+    assert budgets.budget(deadline.STAGE_COPY) == deadline.DEFAULT_STAGE_BUDGETS_MS[deadline.STAGE_COPY]
+
+    budgets.reset()
+    budgets.record(deadline.STAGE_COMPILE, 20000.0)
+    assert budgets.budget(deadline.STAGE_COMPILE) == 30000.0
+
+
+def test_pipeline_compile_resumes_from_checkpoint(monkeypatch, make_payload, lambda_context):
+    """A compile that runs out of time returns a checkpoint and the next invocation skips the copy."""
+    calls = []
+    monkeypatch.setattr(handler, "copy_to_artefacts", lambda task_payload: calls.append("copy"))
+    monkeypatch.setattr(handler, "execute_pipeline_compiler", lambda task_payload: calls.append("compile") or {"Status": "ok"})
+
+    # Enough time to copy (2 s budget) but not to compile (10 s budget)
+    deadline.set_current(deadline.from_invocation({}, lambda_context(5000)))
+    with pytest.raises(deadline.DeadlineExceeded) as e:
+        handler._handle_pipeline(make_payload(task="compile", type="pipeline"))
+    assert calls == ["copy"]
+
+    checkpoint = deadline.continue_response(e.value)["Response"]["Checkpoint"]
+
+    deadline.set_current(deadline.from_invocation({"checkpoint": checkpoint}, lambda_context(60000)))
+    assert handler._handle_pipeline(make_payload(task="compile", type="pipeline")) == {"Status": "ok"}
+    assert calls == ["copy", "compile"]
+
+
+def test_plan_that_does_not_fit_is_not_started(monkeypatch, make_payload, lambda_context):
+    """A plan that does not fit in the time left returns a checkpoint before any change set is created."""
+    monkeypatch.setattr(handler.plan, "execute_plan", lambda *args, **kwargs: pytest.fail("plan started"))
+
+    deadline.set_current(deadline.from_invocation({}, lambda_context(5000)))
+    response = handler._route(make_payload(task="plan", type="deployspec"), run_async=False, bulk_selector=None)
+
+    assert response["Response"]["Status"] == deadline.STATUS_CONTINUE
+    assert response["Response"]["Stage"] == deadline.STAGE_PLAN
+
+
+@pytest.mark.parametrize("task, type_, stage", [("compile", "pipeline", "compile"), ("deploy", "deployspec", "runner")])
+def test_completed_checkpoint_returns_completed(monkeypatch, make_payload, lambda_context, task, type_, stage):
+    """A checkpoint that includes the last stage is answered with a "completed" response and nothing runs again."""
+    monkeypatch.setattr(handler, "copy_to_artefacts", lambda task_payload: pytest.fail("copy ran again"))
+    monkeypatch.setattr(handler, "execute_pipeline_compiler", lambda task_payload: pytest.fail("compile ran again"))
+    monkeypatch.setattr(handler, "_run", lambda task_payload, run_async: pytest.fail("runner ran again"))
+
+    checkpoint = {"completed": ["copy", "compile", "runner"]}
+    deadline.set_current(deadline.from_invocation({"checkpoint": checkpoint}, lambda_context(60000)))
+    response = handler._route(make_payload(task=task, type=type_), run_async=False, bulk_selector=None)
+
+    assert response["Response"]["Status"] == deadline.STATUS_COMPLETED
+    assert response["Response"]["Stage"] == stage
+    assert response["Response"]["Checkpoint"] == checkpoint
+
+
+def test_deadline_is_passed_downstream():
+    """The current deadline is added to downstream payloads."""
+    assert deadline.inject({"task": "deploy"}) == {"task": "deploy"}
+
+    deadline.set_current(deadline.Deadline(expires_at_ms=1234567.8))
+    assert deadline.inject({"task": "deploy"}) == {"task": "deploy", "deadline": 1234567}
@@ -0,0 +1,177 @@
+"""
+Unit tests for fire-and-forget runner execution and the status task.
+"""
+
+import threading
+
+import pytest
+
+import core_invoker.invoker as invoker
+from core_invoker import executions
+from core_invoker.handler import handler
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """
+    Run in local mode with a fresh in-memory execution store.
+
+    :returns: The execution store
+    :rtype: executions.InMemoryExecutionStore
+    """
+    monkeypatch.setattr(invoker.util, "is_local_mode", lambda: True)
+    store = executions.InMemoryExecutionStore()
+    executions.set_store(store)
+    yield store
+    executions.set_store(None)
+
+
+def test_start_runner_returns_handle_immediately(store, monkeypatch, make_payload):
+    """The handle is returned before the runner finishes and status follows progress."""
+    release = threading.Event()
+    finished = threading.Event()
+
+    def slow_runner(event, context):
+        release.wait(5)
+        finished.set()
+        return {"Response": {"Status": "STARTED"}}
+
+    monkeypatch.setattr(invoker, "runner_handler", slow_runner)
+
+    response = invoker.start_runner(make_payload())
+
+    assert response["Response"]["ExecutionId"] == "exec-0001"
+    assert response["Response"]["Status"] in (executions.STATUS_SUBMITTED, executions.STATUS_RUNNING)
+
+    release.set()
+    assert finished.wait(5)
+    invoker._background_runner.shutdown(wait=True)
+    invoker._background_runner = None
+
+    # The runner returned after starting the step function; the deployment is not complete yet
+    status = handler({"task": executions.TASK_STATUS, "correlation_id": "exec-0001"})
+    assert status["Response"]["Status"] == executions.STATUS_STARTED
+    assert status["Response"]["Result"] == {"Status": "STARTED"}
+
+
+def test_background_failure_recorded(store, monkeypatch, make_payload):
+    """A failing runner is reported as FAILED by the status task."""
+
+    def failing_runner(event, context):
+        raise RuntimeError("step function refused")
+
+    monkeypatch.setattr(invoker, "runner_handler", failing_runner)
+
+    invoker.start_runner(make_payload())
+    invoker._background_runner.shutdown(wait=True)
+    invoker._background_runner = None
+
+    record = executions.get_status({"task": "status", "correlation_id": "exec-0001"})["Response"]
+    assert record["Status"] == executions.STATUS_FAILED
+    assert "step function refused" in record["Message"]
+
+
+def test_status_unknown_execution(store):
+    """Unknown executions are reported rather than raising."""
+    response = handler({"task": "status", "correlation_id": "nope"})
+    assert response["Response"]["Status"] == executions.STATUS_UNKNOWN
+
+
+def test_destination_record_updates_status(store):
+    """The Lambda destination record completes an asynchronous execution."""
+    executions.update("exec-0002", executions.STATUS_SUBMITTED)
+
+    event = {
+        "version": "1.0",
+        "requestContext": {"condition": "Success", "functionArn": "arn:runner"},
+        "requestPayload": {"correlation_id": "exec-0002"},
+        "responsePayload": {"Response": {"Status": "STARTED"}},
+    }
+    handler(event)
+
+    record = store.get("exec-0002")
+    assert record["Status"] == executions.STATUS_STARTED
+    assert record["Result"] == {"Status": "STARTED"}
+
+
+class _StepFunctions:
+    """Stand-in Step Functions client that reports a scripted sequence of statuses."""
+
+    def __init__(self, statuses: list[str]):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def describe_execution(self, executionArn):
+        self.calls += 1
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        response = {"executionArn": executionArn, "status": status}
+        if status == "FAILED":
+            response.update(error="States.TaskFailed", cause="Stack create failed")
+        return response
+
+
+EXECUTION_ARN = "arn:aws:states:us-east-1:111111111111:execution:runner:exec-0003"
+
+
+@pytest.fixture
+def step_functions():
+    """
+    Install a factory of stand-in Step Functions clients.
+
+    :returns: The factory; set ``factory.statuses`` before use
+    :rtype: Callable
+    """
+    clients = []
+
+    def factory(region):
+        assert region == "us-east-1"
+        if not clients:
+            clients.append(_StepFunctions(factory.statuses))
+        return clients[0]
+
+    factory.statuses = ["RUNNING"]
+    factory.clients = clients
+    executions.set_client_factory(factory)
+    yield factory
+    executions.set_client_factory(None)
+
+
+def test_status_follows_step_function(store, step_functions):
+    """The status task resolves a started execution from its step function."""
+    step_functions.statuses = ["RUNNING", "FAILED"]
+    executions.record_runner_result("exec-0003", {"Status": "STARTED", "executionArn": EXECUTION_ARN})
+
+    assert store.get("exec-0003")["ExecutionArn"] == EXECUTION_ARN
+    assert handler({"task": "status", "correlation_id": "exec-0003"})["Response"]["Status"] == executions.STATUS_RUNNING
+
+    record = handler({"task": "status", "correlation_id": "exec-0003"})["Response"]
+    assert record["Status"] == executions.STATUS_FAILED
+    assert record["Message"] == "Stack create failed"
+
+    # A finished execution is not looked up again
+    handler({"task": "status", "correlation_id": "exec-0003"})
+    assert step_functions.clients[0].calls == 2
+
+
+def test_wait_for_execution(step_functions):
+    """Waiting polls until the step function ends, or returns RUNNING when the timeout passes."""
+    step_functions.statuses = ["RUNNING", "RUNNING", "SUCCEEDED"]
+    assert executions.wait_for_execution(EXECUTION_ARN, poll_interval=0)["Status"] == executions.STATUS_COMPLETE
+
+    step_functions.statuses = ["RUNNING"]
+    step_functions.clients.clear()
+    assert executions.wait_for_execution(EXECUTION_ARN, poll_interval=0.01, timeout=0.05)["Status"] == executions.STATUS_RUNNING
+
+
+def test_in_memory_store_is_bounded():
+    """The in-memory store drops the least recently updated records."""
+    store = executions.InMemoryExecutionStore(max_records=2)
+    for execution_id in ("a", "b", "c"):
+        store.put(execution_id, {"ExecutionId": execution_id})
+    store.put("b", {"ExecutionId": "b", "Status": executions.STATUS_RUNNING})
+    store.put("d", {"ExecutionId": "d"})
+
+    assert store.get("a") is None
+    assert store.get("c") is None
+    assert store.get("b")["Status"] == executions.STATUS_RUNNING
+
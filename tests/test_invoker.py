@@ -19,6 +19,8 @@ from core_db.registry.zone import ZoneFactsModel
 from core_db.facter import get_facts
 
 from core_invoker.handler import handler as invoker
+import core_invoker.invoker as invoker_module
+from core_invoker import projections, policy, tracing, deadline, plan, executions
 
 from core_framework.constants import (
     TASK_DEPLOY,
@@ -160,6 +162,76 @@ def test_run_ds_compile(task_payload: TaskPayload, facts_data: dict):
     assert response["Status"] == "COMPILE_COMPLETE"
 
 
+def _compile_completed(response: dict) -> bool:
+    """The compiler reports COMPILE_COMPLETE."""
+    return response.get("Status") == "COMPILE_COMPLETE"
+
+
+def _runner_started(response: dict) -> bool:
+    """The runner started the step function and returned its execution ARN."""
+    result = response["Response"]
+    return "Error" not in result and executions.execution_arn(result) is not None
+
+
+@pytest.mark.parametrize(
+    "execute, handler_name, target, succeeded",
+    [
+        (invoker_module.execute_deployspec_compiler, "deployspec_compiler_handler", "deployspec_compiler", _compile_completed),
+        (invoker_module.execute_runner, "runner_handler", "runner", _runner_started),
+    ],
+)
+def test_run_ds_projection(task_payload: TaskPayload, monkeypatch, execute, handler_name: str, target: str, succeeded):
+    """Test that the real downstream handlers accept their payload projection."""
+    real_handler = getattr(invoker_module, handler_name)
+    received = []
+
+    def spy(event, context=None):
+        received.append(dict(event))
+        return real_handler(event, context)
+
+    monkeypatch.setenv(policy.EXECUTION_ENV, policy.MODE_LOCAL)
+    monkeypatch.setattr(invoker_module, handler_name, spy)
+
+    task_payload.set_task(TASK_DEPLOY if target == "runner" else TASK_COMPILE)
+    task_payload.type = V_DEPLOYSPEC
+
+    response = execute(task_payload)
+
+    assert response is not None
+    assert succeeded(response), response
+
+    fields = projections.get_fields(target)
+    assert set(received[0]) - {tracing.TRACE_CONTEXT, deadline.DEADLINE} <= fields
+
+    dropped = set(TaskPayload.model_fields) - fields
+    assert not dropped & set(received[0])
+    if target == "runner":
+        # The runner projection drops the package section
+        assert "package" in dropped
+
+
+class PlanCfnClient:
+    """
+    Stand-in CloudFormation client for plan tasks.
+
+    No stack exists yet, so every change set creates its stack and adds one bucket.
+    """
+
+    CHANGE = {"Action": "Add", "LogicalResourceId": "Bucket", "ResourceType": "AWS::S3::Bucket"}
+
+    def describe_stacks(self, StackName):
+        raise RuntimeError(f"Stack with id {StackName} does not exist")
+
+    def create_change_set(self, **kwargs):
+        return {"Id": kwargs["ChangeSetName"]}
+
+    def describe_change_set(self, StackName, ChangeSetName, NextToken=None):
+        return {"Status": "CREATE_COMPLETE", "Changes": [{"ResourceChange": self.CHANGE}]}
+
+    def delete_stack(self, StackName):
+        pass
+
+
 def test_run_ds_plan(task_payload: TaskPayload, facts_data: dict):
     """Test deployspec plan task."""
     assert facts_data is not None
@@ -167,11 +239,33 @@ def test_run_ds_plan(task_payload: TaskPayload, facts_data: dict):
     task_payload.set_task(TASK_PLAN)
     task_payload.type = V_DEPLOYSPEC
 
-    response = invoker(task_payload.model_dump(), None)
+    plan.set_client_factory(lambda account, region: PlanCfnClient())
+    try:
+        response = invoker(task_payload.model_dump(), None)
+    finally:
+        plan.set_client_factory(None)
 
     assert response is not None
-    assert "Error" in response
-    assert response["Error"] == "Not implemented"
+    assert "Response" in response
+    assert response["Response"]["Status"] == "ok"
+
+    targets, skipped = plan.stack_targets(plan.load_actions(task_payload))
+    assert targets
+    assert response["Response"]["Skipped"] == skipped
+
+    change = {"Action": "Add", "LogicalId": "Bucket", "ResourceType": "AWS::S3::Bucket", "Replacement": None}
+    assert response["Response"]["Targets"] == [
+        {
+            "Label": target["Label"],
+            "Account": target["Account"],
+            "Region": target["Region"],
+            "StackName": target["StackName"],
+            "ChangeSetType": "CREATE",
+            "Status": "ok",
+            "Changes": [change],
+        }
+        for target in targets
+    ]
 
 
 def test_run_ds_apply(task_payload: TaskPayload, facts_data: dict):
@@ -0,0 +1,191 @@
+"""
+Unit tests for the deployspec plan engine.
+"""
+
+import threading
+import time
+
+import pytest
+
+from core_invoker import plan
+
+
+@pytest.fixture
+def payload(make_payload):
+    """
+    A plan task.
+
+    :returns: The TaskPayload stand-in
+    :rtype: FakePayload
+    """
+    return make_payload(task="plan", correlation_id="abc_123")
+
+
+class _Cfn:
+    """Stand-in CloudFormation client with a fixed latency per change set."""
+
+    def __init__(self, account: str, region: str, existing: dict, delay: float, failing: set, log: list, lock):
+        self.account = account
+        self.region = region
+        self.existing = existing
+        self.delay = delay
+        self.failing = failing
+        self.log = log
+        self.lock = lock
+        self._status: dict[str, str] = {}
+
+    def _record(self, call: str, stack: str) -> None:
+        with self.lock:
+            self.log.append((call, self.account, self.region, stack))
+
+    def describe_stacks(self, StackName):
+        if StackName not in self.existing:
+            raise RuntimeError(f"Stack with id {StackName} does not exist")
+        return {"Stacks": [{"StackName": StackName, "StackStatus": self.existing[StackName]}]}
+
+    def create_change_set(self, **kwargs):
+        self._record("create_change_set", kwargs["StackName"])
+        assert kwargs["Parameters"] == [{"ParameterKey": "Size", "ParameterValue": "2"}]
+        self._status[kwargs["StackName"]] = kwargs["ChangeSetType"]
+        return {"Id": kwargs["ChangeSetName"]}
+
+    def describe_change_set(self, StackName, ChangeSetName, NextToken=None):
+        time.sleep(self.delay)
+        if StackName in self.failing:
+            return {"Status": "FAILED", "StatusReason": "Template error"}
+        if NextToken:
+            return {"Status": "CREATE_COMPLETE", "Changes": [{"ResourceChange": {"Action": "Add", "LogicalResourceId": "Queue"}}]}
+        action = "Add" if self._status[StackName] == "CREATE" else "Modify"
+        change = {"Action": action, "LogicalResourceId": "Bucket", "ResourceType": "AWS::S3::Bucket", "Replacement": "False"}
+        return {"Status": "CREATE_COMPLETE", "Changes": [{"ResourceChange": change}], "NextToken": "page-2"}
+
+    def delete_change_set(self, StackName, ChangeSetName):
+        self._record("delete_change_set", StackName)
+
+    def delete_stack(self, StackName):
+        self._record("delete_stack", StackName)
+
+
+def _action(label: str, account: str, region: str, stack: str) -> dict:
+    return {
+        "Label": label,
+        "Type": "create_stack",
+        "Params": {
+            "Account": account,
+            "Region": region,
+            "StackName": stack,
+            "TemplateUrl": f"https://bucket.s3.amazonaws.com/artefacts/{stack}.yaml",
+            "StackParameters": {"Size": 2},
+        },
+    }
+
+
+@pytest.fixture
+def cfn():
+    """
+    Build a factory of stand-in CloudFormation clients.
+
+    :returns: The factory, with the recorded calls in ``factory.calls``
+    :rtype: Callable
+    """
+    calls = []
+    lock = threading.Lock()
+
+    def factory(account, region):
+        return _Cfn(account, region, factory.existing, factory.delay, factory.failing, calls, lock)
+
+    factory.calls = calls
+    factory.existing = {"app-east": "CREATE_COMPLETE"}
+    factory.delay = 0.0
+    factory.failing = set()
+    return factory
+
+
+def test_plan_aggregates_diffs(cfn, payload):
+    """Every stack target gets a change set and the diffs are aggregated in action order."""
+    actions = [
+        _action("east", "111111111111", "us-east-1", "app-east"),
+        _action("west", "222222222222", "us-west-2", "app-west"),
+        {"Label": "grant", "Type": "put_user", "Params": {"Account": "111111111111"}},
+    ]
+    streamed = []
+
+    result = plan.plan_changes(payload, actions, client_factory=cfn, on_result=streamed.append, poll_interval=0)
+
+    assert result["Status"] == "ok"
+    assert [t["Label"] for t in result["Targets"]] == ["east", "west"]
+    assert result["Skipped"] == ["grant"]
+    assert sorted(t["Label"] for t in streamed) == ["east", "west"]
+
+    east, west = result["Targets"]
+    assert (east["ChangeSetType"], west["ChangeSetType"]) == ("UPDATE", "CREATE")
+    assert [c["Action"] for c in east["Changes"]] == ["Modify", "Add"]
+    assert result["Summary"] == {"Targets": 2, "Failed": 0, "Add": 3, "Modify": 1, "Remove": 0, "Replace": 0}
+
+    # Nothing is left behind: updates drop the change set, creates drop the empty stack
+    assert ("delete_change_set", "111111111111", "us-east-1", "app-east") in cfn.calls
+    assert ("delete_stack", "222222222222", "us-west-2", "app-west") in cfn.calls
+
+
+def test_plan_keeps_stack_in_review(cfn, payload):
+    """A stack that already exists in REVIEW_IN_PROGRESS gets a CREATE change set, but only the change set is removed."""
+    cfn.existing["app-west"] = "REVIEW_IN_PROGRESS"
+
+    actions = [_action("west", "222222222222", "us-west-2", "app-west")]
+
+    result = plan.plan_changes(payload, actions, client_factory=cfn, poll_interval=0)
+
+    assert result["Targets"][0]["ChangeSetType"] == "CREATE"
+    assert ("delete_change_set", "222222222222", "us-west-2", "app-west") in cfn.calls
+    assert not any(call[0] == "delete_stack" for call in cfn.calls)
+
+
+def test_plan_reports_failed_targets(cfn, payload):
+    """A failing target is reported without stopping the others."""
+    cfn.failing = {"app-west"}
+    actions = [_action("east", "1", "us-east-1", "app-east"), _action("west", "2", "us-west-2", "app-west")]
+
+    result = plan.plan_changes(payload, actions, client_factory=cfn, poll_interval=0)
+
+    assert result["Status"] == "error"
+    assert result["Summary"]["Failed"] == 1
+    assert result["Targets"][1]["Message"] == "Template error"
+    assert result["Targets"][0]["Status"] == "ok"
+
+
+def test_plan_scales_with_slowest_target(cfn, payload):
+    """Targets are planned in parallel, bounded by max_parallel."""
+    cfn.delay = 0.1
+    actions = [_action(f"t{i}", str(i), "us-east-1", f"stack-{i}") for i in range(8)]
+
+    start = time.perf_counter()
+    result = plan.plan_changes(payload, actions, max_parallel=8, client_factory=cfn, poll_interval=0)
+    elapsed = time.perf_counter() - start
+
+    # Each target takes two describe calls (0.2 s); sequentially this would take 1.6 s
+    assert result["Summary"]["Targets"] == 8
+    assert elapsed < 0.8
+
+
+def test_execute_plan_compiles_when_needed(monkeypatch, cfn, payload):
+    """The deployspec is compiled only when no compiled actions exist."""
+    stored = []
+    compiled = []
+
+    monkeypatch.setattr(plan, "load_actions", lambda task_payload: stored[0] if stored else None)
+
+    def compile_actions(task_payload):
+        compiled.append(task_payload)
+        stored.append([_action("east", "1", "us-east-1", "app-east")])
+
+    result = plan.execute_plan(payload, compile_actions=compile_actions, client_factory=cfn, poll_interval=0)
+    assert len(compiled) == 1
+    assert result["Summary"]["Targets"] == 1
+
+    plan.execute_plan(payload, compile_actions=compile_actions, client_factory=cfn, poll_interval=0)
+    assert len(compiled) == 1
+
+
+def test_change_set_name_is_valid(payload):
+    """Change set names only contain letters, digits and hyphens."""
+    assert plan.change_set_name(payload) == "core-plan-abc-123"
@@ -0,0 +1,139 @@
+"""
+Unit tests for the hybrid in-process / remote execution policy.
+"""
+
+import pytest
+
+import core_invoker.invoker as invoker
+from core_invoker import policy
+
+
+@pytest.fixture
+def payload(make_payload):
+    """
+    A compile task.
+
+    :returns: The TaskPayload stand-in
+    :rtype: FakePayload
+    """
+    return make_payload(task="compile")
+
+
+@pytest.fixture
+def hybrid(monkeypatch):
+    """
+    Enable hybrid mode with a policy that sees a 1 MB package.
+
+    :returns: The installed policy
+    :rtype: policy.ExecutionPolicy
+    """
+    monkeypatch.setenv(policy.EXECUTION_ENV, policy.MODE_HYBRID)
+    execution_policy = policy.ExecutionPolicy(max_local_package_bytes=5 * 1024 * 1024)
+    monkeypatch.setattr(execution_policy, "package_size", lambda task_payload: 1024 * 1024)
+    policy.set_policy(execution_policy)
+    yield execution_policy
+    policy.set_policy(None)
+
+
+def test_configured_modes(monkeypatch, payload):
+    """Outside hybrid mode the configured mode always wins."""
+    monkeypatch.setenv(policy.EXECUTION_ENV, policy.MODE_REMOTE)
+    assert policy.ExecutionPolicy().decide("runner", payload).mode == policy.MODE_REMOTE
+
+    monkeypatch.setenv(policy.EXECUTION_ENV, policy.MODE_LOCAL)
+    assert policy.ExecutionPolicy().decide("runner", payload).mode == policy.MODE_LOCAL
+
+
+def test_small_package_runs_in_process(hybrid, payload):
+    """A small package with plenty of time left is compiled in-process."""
+    decision = hybrid.decide("deployspec_compiler", payload, remaining_ms=60000)
+    assert decision.mode == policy.MODE_LOCAL
+
+
+def test_large_package_runs_remote(hybrid, monkeypatch, payload):
+    """A package over the limit is sent to the compiler Lambda."""
+    monkeypatch.setattr(hybrid, "package_size", lambda task_payload: 50 * 1024 * 1024)
+    decision = hybrid.decide("deployspec_compiler", payload, remaining_ms=60000)
+    assert (decision.mode, decision.reason) == (policy.MODE_REMOTE, "package too large")
+
+
+def test_remaining_time_and_history(hybrid, payload):
+    """Measured latency steers later decisions."""
+    local = hybrid.decide("deployspec_compiler", payload, remaining_ms=60000)
+    hybrid.record(local, 8000, ok=True)
+
+    # 8 s in-process does not fit in half of 10 s
+    assert hybrid.decide("deployspec_compiler", payload, remaining_ms=10000).reason == "not enough remaining time"
+
+    remote = policy.Decision(target="deployspec_compiler", mode=policy.MODE_REMOTE, reason="test")
+    hybrid.record(remote, 2000, ok=True)
+    assert hybrid.decide("deployspec_compiler", payload, remaining_ms=60000).reason == "remote is faster"
+
+    snapshot = hybrid.snapshot()
+    assert snapshot["deployspec_compiler:local"]["AverageMs"] == 8000
+    assert snapshot["deployspec_compiler:remote"]["Count"] == 1
+
+
+def test_repeated_local_failures_go_remote(hybrid, payload):
+    """A target that keeps failing in-process is sent remote."""
+    for _ in range(policy.MAX_LOCAL_FAILURES):
+        hybrid.record(hybrid.decide("runner", payload, remaining_ms=60000), 10, ok=False)
+
+    assert hybrid.decide("runner", payload, remaining_ms=60000).reason == "in-process failures"
+
+
+def test_local_failures_expire(hybrid, monkeypatch, payload):
+    """After the cool-down a failing target is tried in-process again; another failure starts a new cool-down."""
+    now = [1000.0]
+    monkeypatch.setattr(policy.time, "monotonic", lambda: now[0])
+    for _ in range(policy.MAX_LOCAL_FAILURES):
+        hybrid.record(hybrid.decide("runner", payload, remaining_ms=60000), 10, ok=False)
+
+    now[0] += hybrid.failure_cooldown + 1
+    probe = hybrid.decide("runner", payload, remaining_ms=60000)
+    assert probe.mode == policy.MODE_LOCAL
+
+    hybrid.record(probe, 10, ok=False)
+    assert hybrid.decide("runner", payload, remaining_ms=60000).reason == "in-process failures"
+
+
+def test_exploration_measures_both_modes(hybrid, payload):
+    """Every n-th eligible task runs in the other mode, so a slower mode gets measured again."""
+    hybrid.explore_every = 5
+    modes = []
+    for _ in range(10):
+        decision = hybrid.decide("deployspec_compiler", payload, remaining_ms=60000)
+        hybrid.record(decision, 1000 if decision.mode == policy.MODE_LOCAL else 200, ok=True)
+        modes.append((decision.mode, decision.reason))
+
+    # Local wins until the first exploration measures remote as faster
+    assert modes[:4] == [(policy.MODE_LOCAL, "small package")] * 4
+    assert modes[4] == (policy.MODE_REMOTE, "exploring")
+    assert modes[5:9] == [(policy.MODE_REMOTE, "remote is faster")] * 4
+    assert modes[9] == (policy.MODE_LOCAL, "exploring")
+
+
+def test_dispatch_follows_decision(hybrid, monkeypatch, payload):
+    """The invoker runs the handler in-process when the policy says so and records the outcome."""
+    monkeypatch.setattr(invoker.aws, "invoke_lambda", lambda arn, payload: pytest.fail("remote call"))
+
+    response = invoker._dispatch("runner", lambda payload, context: {"Response": "ok"}, "arn:runner", payload)
+
+    assert response == {"Response": "ok"}
+    assert hybrid.snapshot()["runner:local"]["Count"] == 1
+
+
+def test_dispatch_counts_error_responses_as_failures(hybrid, payload):
+    """An in-process target that answers with errors is sent remote and its failed runs do not set the average."""
+
+    def failing(payload, context):
+        return {"Response": {"Status": "error", "Message": "boom"}}
+
+    for _ in range(policy.MAX_LOCAL_FAILURES):
+        invoker._dispatch("runner", failing, "arn:runner", payload)
+
+    stats = hybrid.snapshot()["runner:local"]
+    assert stats["Failures"] == policy.MAX_LOCAL_FAILURES
+    assert stats["AverageMs"] is None
+    assert hybrid.decide("runner", payload, remaining_ms=60000).reason == "in-process failures"
+
@@ -0,0 +1,90 @@
+"""
+Unit tests for per-route memory profiling.
+"""
+
+import threading
+
+import pytest
+
+from core_invoker import profiling
+
+
+@pytest.fixture
+def enabled():
+    """
+    Enable profiling with an empty histogram for the duration of a test.
+    """
+    profiling.get_histogram().clear()
+    profiling.enable_profiling(top_allocations=3)
+    yield profiling.get_histogram()
+    profiling.disable_profiling()
+    profiling.get_histogram().clear()
+
+
+def test_disabled_by_default(monkeypatch):
+    """Nothing is recorded unless profiling is switched on."""
+    monkeypatch.setattr(profiling, "_enabled", None)
+    monkeypatch.delenv(profiling.PROFILE_ENV, raising=False)
+
+    with profiling.profile("deployspec", "compile") as result:
+        assert result is None
+
+
+def test_profile_records_allocations(enabled):
+    """A profile captures the tracemalloc peak and the top allocation sites."""
+    with profiling.profile("deployspec", "compile") as result:
+        data = [bytearray(1024 * 1024) for _ in range(8)]
+        del data
+
+    assert result.traced_peak_mb >= 8
+    assert result.peak_rss_mb > 0
+    assert 0 < len(result.top_allocations) <= 3
+
+    snapshot = enabled.snapshot()
+    assert snapshot["deployspec:compile"]["Count"] == 1
+
+
+def test_histogram_recommendation():
+    """The recommendation covers the requested percentile of invocations."""
+    histogram = profiling.MemoryHistogram()
+    for peak in [100, 120, 200, 210, 220, 230, 240, 250, 260, 900]:
+        histogram.observe(profiling.MemoryProfile("pipeline", "compile", peak, 0.0, 0.0))
+
+    assert histogram.recommend_memory("pipeline", "compile", percentile=0.8) == 256
+    assert histogram.recommend_memory("pipeline", "compile", percentile=0.9) == 512
+    assert histogram.recommend_memory("pipeline", "compile", percentile=1.0) == 1024
+    assert histogram.recommend_memory("pipeline", "deploy") is None
+    assert histogram.snapshot()["pipeline:compile"]["Buckets"] == {"128": 2, "256": 6, "512": 1, "1024": 1}
+
+
+def test_peak_is_per_invocation(enabled):
+    """A small invocation after a large one is not charged with the earlier peak."""
+    with profiling.profile("deployspec", "compile") as large:
+        data = bytearray(128 * 1024 * 1024)
+        data[:: 4096] = b"x" * len(data[:: 4096])
+        del data
+
+    with profiling.profile("deployspec", "plan") as small:
+        pass
+
+    assert large.peak_rss_mb - small.peak_rss_mb > 64
+
+
+def test_profiles_run_concurrently(enabled):
+    """Concurrent invocations are profiled side by side and marked as overlapped."""
+    barrier = threading.Barrier(2, timeout=5)
+    results = []
+
+    def invocation():
+        with profiling.profile("pipeline", "deploy") as result:
+            barrier.wait()
+        results.append(result)
+
+    threads = [threading.Thread(target=invocation) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 2
+    assert all(result.overlapped for result in results)
@@ -0,0 +1,53 @@
+"""
+Unit tests for the per-target task payload projections.
+"""
+
+import pytest
+
+from core_framework.models import TaskPayload
+
+from core_invoker import projections
+
+
+@pytest.fixture
+def task_payload() -> TaskPayload:
+    """
+    Create a deploy TaskPayload.
+
+    :returns: The task payload
+    :rtype: TaskPayload
+    """
+    task_payload = TaskPayload.from_arguments(
+        task="deploy",
+        client="client",
+        portfolio="portfolio",
+        app="app",
+        branch="main",
+        build="12",
+    )
+    task_payload.type = "deployspec"
+    return task_payload
+
+
+@pytest.mark.parametrize("target", sorted(projections.PROJECTIONS))
+def test_projection_validates(task_payload, target):
+    """Each projection is smaller than the full dump and validates back to the same projected fields."""
+    payload = projections.project(task_payload, target)
+
+    assert len(str(payload)) < len(str(task_payload.model_dump()))
+    assert set(payload) <= projections.get_fields(target)
+
+    restored = TaskPayload.model_validate(payload)
+    fields = projections.get_fields(target)
+    assert restored.model_dump(include=fields) == task_payload.model_dump(include=fields)
+
+
+def test_runner_projection_omits_package(task_payload):
+    """The runner never receives the package section."""
+    assert "package" not in projections.project(task_payload, "runner")
+    assert "package" in projections.project(task_payload, "deployspec_compiler")
+
+
+def test_unknown_target_gets_full_payload(task_payload):
+    """Targets without a projection receive the full dump."""
+    assert projections.project(task_payload, "other") == task_payload.model_dump()
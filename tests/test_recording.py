@@ -0,0 +1,136 @@
+"""
+Unit tests for traffic recording and replay.
+"""
+
+import pytest
+
+from core_helper.magic import MagicS3Client
+
+import core_invoker.invoker as invoker
+from core_invoker import recording
+
+
+@pytest.fixture
+def deploy_handler(make_payload):
+    """
+    A handler that only starts the runner, like a deploy task.
+
+    :returns: The handler
+    :rtype: Callable[[dict, Any], dict]
+    """
+
+    def handler(event: dict, context=None) -> dict:
+        payload = make_payload(correlation_id=event["correlation_id"], identity={"session_token": "abc123"})
+        return invoker.execute_runner(payload)
+
+    return handler
+
+
+@pytest.fixture
+def local_runner(monkeypatch):
+    """
+    Run in local mode with a runner that echoes the correlation id.
+    """
+    monkeypatch.setattr(invoker.util, "is_local_mode", lambda: True)
+    monkeypatch.setattr(invoker, "runner_handler", lambda event, context: {"Response": {"Started": event["correlation_id"]}})
+
+
+def test_record_downstream_and_redact(tmp_path, local_runner, deploy_handler):
+    """Downstream requests are recorded with sensitive values redacted."""
+    path = str(tmp_path / "traffic.jsonl.gz")
+    recorder = recording.start_recording(path)
+    try:
+        recorder.record_invocation(deploy_handler, {"correlation_id": "c1", "password": "hunter2"}, None)
+    finally:
+        recording.stop_recording()
+
+    entries = recording.load(path)
+    kinds = [e["kind"] for e in entries]
+    assert kinds == [recording.KIND_DOWNSTREAM, recording.KIND_EVENT]
+
+    downstream, event = entries
+    assert downstream["target"] == "runner_handler"
+    assert downstream["request"]["identity"]["session_token"] == recording.REDACTED
+    assert event["event"]["password"] == recording.REDACTED
+    assert event["response"] == {"Response": {"Started": "c1"}}
+
+    # The original handler is restored
+    assert invoker.runner_handler({"correlation_id": "x"}, None) == {"Response": {"Started": "x"}}
+
+
+def test_replay_without_downstream(tmp_path, local_runner, deploy_handler, monkeypatch):
+    """Replayed events are answered from the recording, not by the real downstream."""
+    path = str(tmp_path / "traffic.jsonl.gz")
+    recorder = recording.start_recording(path)
+    try:
+        for i in range(5):
+            recorder.record_invocation(deploy_handler, {"correlation_id": f"c{i}"}, None)
+    finally:
+        recording.stop_recording()
+
+    def unreachable(event, context):
+        raise AssertionError("the real runner must not be called during replay")
+
+    monkeypatch.setattr(invoker, "runner_handler", unreachable)
+
+    report = recording.replay(path, speedup=None, concurrency=3, handler=deploy_handler)
+
+    assert report["Events"] == 5
+    assert report["Errors"] == 0
+    assert report["Mismatches"] == 0
+    assert report["Misses"] == 0
+    assert report["Latency"]["max"] >= report["Latency"]["p50"]
+
+
+def test_entries_are_not_flushed_one_by_one(tmp_path):
+    """Buffering between flushes keeps the gzip stream compact; close writes everything."""
+    sizes = {}
+    for interval in (0.0, recording.FLUSH_INTERVAL):
+        path = tmp_path / f"traffic-{interval}.jsonl.gz"
+        recorder = recording.Recorder(str(path), flush_interval=interval)
+        for i in range(200):
+            recorder.write({"kind": recording.KIND_EVENT, "correlation_id": f"c{i}", "event": {"task": "deploy"}})
+        recorder.close()
+        assert len(recording.load(str(path))) == 200
+        sizes[interval] = path.stat().st_size
+
+    assert sizes[recording.FLUSH_INTERVAL] < 0.75 * sizes[0.0]
+
+
+def test_load_recording_that_was_never_stopped(tmp_path):
+    """Every flush appends a complete gzip member, so an open recording can be read up to its last flush."""
+    path = str(tmp_path / "traffic.jsonl.gz")
+    recorder = recording.Recorder(path, flush_interval=0.0)
+    for i in range(3):
+        recorder.write({"kind": recording.KIND_EVENT, "correlation_id": f"c{i}", "event": {"task": "deploy"}})
+
+    assert [e["correlation_id"] for e in recording.load(path)] == ["c0", "c1", "c2"]
+    recorder.close()
+
+
+def test_replay_object_head(tmp_path, bucket):
+    """HEAD requests made before a staged copy are recorded and answered with their attributes on replay."""
+    bucket.versioned = True
+    bucket.write("artefacts/package.zip", b"zip")
+
+    def head_handler(event: dict, context=None) -> dict:
+        artefact_bucket = MagicS3Client.get_bucket(Region="us-east-1", BucketName="artefacts")
+        before = invoker._head_object(artefact_bucket, event["key"])
+        return {"Response": {"Existed": before.existed, "VersionId": before.version_id}}
+
+    path = str(tmp_path / "traffic.jsonl.gz")
+    recorder = recording.start_recording(path)
+    try:
+        existing = recorder.record_invocation(head_handler, {"correlation_id": "c1", "key": "artefacts/package.zip"}, None)
+        missing = recorder.record_invocation(head_handler, {"correlation_id": "c2", "key": "artefacts/missing.zip"}, None)
+    finally:
+        recording.stop_recording()
+
+    assert existing == {"Response": {"Existed": True, "VersionId": "v1"}}
+    assert missing == {"Response": {"Existed": False, "VersionId": None}}
+
+    report = recording.replay(path, speedup=None, handler=head_handler)
+
+    assert report["Misses"] == 0
+    assert report["Mismatches"] == 0
+
@@ -0,0 +1,110 @@
+"""
+Unit tests for concurrent multi-package artefact staging.
+"""
+
+import threading
+
+import pytest
+
+import core_invoker.invoker as invoker
+
+
+@pytest.fixture(autouse=True)
+def artefacts(bucket, monkeypatch):
+    """Stage to the in-memory bucket, with copies that take 50 ms."""
+    bucket.copy_delay = 0.05
+    monkeypatch.setattr(invoker.util, "get_artefact_bucket_region", lambda: "us-east-1")
+    monkeypatch.setattr(invoker.util, "get_artefact_bucket_name", lambda: "artefacts")
+
+
+def test_stage_packages_concurrently(bucket, make_payload, make_package):
+    """All packages are copied, in parallel, under the deployment folder."""
+    packages = [make_package(f"packages/app-{i}.zip") for i in range(6)]
+
+    # Every copy waits for the other five, so a sequential copy would fail
+    bucket.copy_barrier = threading.Barrier(6, timeout=5)
+    result = invoker.stage_artefacts(make_payload(), packages, max_workers=6)
+
+    assert result["Status"] == "ok"
+    assert all(r["Status"] == invoker.STAGE_COPIED for r in result["Results"])
+    assert "artefacts/portfolio/app/main/1/app-3.zip" in bucket.objects
+    assert bucket.max_active == 6
+
+
+def test_worker_pool_is_bounded(bucket, make_payload, make_package):
+    """No more than max_workers copies run at the same time."""
+    packages = [make_package(f"packages/app-{i}.zip") for i in range(8)]
+
+    invoker.stage_artefacts(make_payload(), packages, max_workers=2)
+
+    assert bucket.max_active <= 2
+
+
+def test_failure_rolls_back_partial_copies(bucket, make_payload, make_package):
+    """One failed copy removes the objects that were already staged."""
+    bucket.fail = {"packages/vars.zip"}
+    packages = [make_package("packages/app.zip"), make_package("packages/vars.zip"), make_package("packages/lib.zip")]
+
+    result = invoker.stage_artefacts(make_payload(), packages)
+
+    assert result["Status"] == "error"
+    statuses = {r["Source"]: r["Status"] for r in result["Results"]}
+    assert statuses["s3://packages/packages/vars.zip"] == invoker.STAGE_FAILED
+    assert statuses["s3://packages/packages/app.zip"] == invoker.STAGE_ROLLED_BACK
+    assert bucket.objects == {}
+
+
+def test_wrong_region_reported(bucket, make_payload, make_package):
+    """A package outside the artefacts region is reported as failed without touching the artefacts bucket."""
+    result = invoker.stage_artefacts(make_payload(), [make_package("packages/app.zip", bucket_region="eu-west-1")])
+
+    assert result["Status"] == "error"
+    assert result["Results"][0]["Status"] == invoker.STAGE_FAILED
+    assert bucket.heads == 0
+
+
+def test_duplicate_object_names_rejected(make_payload, make_package):
+    """Two packages cannot be staged to the same object name."""
+    with pytest.raises(ValueError):
+        invoker.stage_artefacts(make_payload(), [make_package("a/app.zip"), make_package("b/app.zip")])
+
+
+def test_rollback_restores_overwritten_objects(bucket, make_payload, make_package):
+    """Objects that existed before the run are restored, only new objects are deleted."""
+    bucket.versioned = True
+    bucket.write("artefacts/portfolio/app/main/1/app.zip", b"previous build")
+    bucket.fail = {"packages/vars.zip"}
+    packages = [make_package("packages/app.zip"), make_package("packages/vars.zip"), make_package("packages/lib.zip")]
+
+    result = invoker.stage_artefacts(make_payload(), packages)
+
+    assert result["Status"] == "error"
+    assert bucket.objects == {"artefacts/portfolio/app/main/1/app.zip": b"previous build"}
+
+
+def test_rollback_keeps_unversioned_overwrites(bucket, make_payload, make_package):
+    """An overwritten object that cannot be restored is not deleted."""
+    bucket.write("artefacts/portfolio/app/main/1/app.zip", b"previous build")
+    bucket.fail = {"packages/vars.zip"}
+
+    result = invoker.stage_artefacts(make_payload(), [make_package("packages/app.zip"), make_package("packages/vars.zip")])
+
+    statuses = {r["Source"]: r["Status"] for r in result["Results"]}
+    assert statuses["s3://packages/packages/app.zip"] == invoker.STAGE_KEPT
+    assert "artefacts/portfolio/app/main/1/app.zip" in bucket.objects
+
+
+def test_copy_to_artefacts_stages_the_package(bucket, make_payload, make_package):
+    """The compile copy stages the task package as package.zip and fails loudly."""
+    invoker.copy_to_artefacts(make_payload(package=make_package("packages/app.zip")))
+    assert "artefacts/portfolio/app/main/1/package.zip" in bucket.objects
+
+    bucket.fail = {"packages/broken.zip"}
+    with pytest.raises(RuntimeError):
+        invoker.copy_to_artefacts(make_payload(package=make_package("packages/broken.zip")))
+
+    # A package without a key is reported as such, before any request
+    heads = bucket.heads
+    with pytest.raises(ValueError):
+        invoker.copy_to_artefacts(make_payload(package=make_package("")))
+    assert bucket.heads == heads
@@ -0,0 +1,119 @@
+"""
+Unit tests for streaming progress events.
+"""
+
+import json
+import threading
+
+from core_helper.magic import MagicS3Client
+
+from core_invoker import deadline, streaming
+
+
+def _compile_handler(event, context=None):
+    """Stand-in invoker handler with a copy and a compile stage."""
+    stages = deadline.Deadline()
+    stages.run_stage(deadline.STAGE_COPY, lambda: streaming.emit(streaming.EVENT_ARTEFACT_WRITTEN, key="artefacts/package.zip"))
+    return {"Response": stages.run_stage(deadline.STAGE_COMPILE, lambda: {"Status": "COMPILE_COMPLETE"})}
+
+
+def test_stream_yields_progress_then_response():
+    """Progress events arrive in order and the final response is the last event."""
+    events = list(streaming.stream({"task": "compile"}, handler=_compile_handler))
+
+    assert [(e["type"], e.get("stage")) for e in events] == [
+        ("stage_started", "copy"),
+        ("artefact_written", None),
+        ("stage_finished", "copy"),
+        ("stage_started", "compile"),
+        ("stage_finished", "compile"),
+        ("response", None),
+    ]
+    assert events[1]["key"] == "artefacts/package.zip"
+    assert events[-1]["response"] == {"Response": {"Status": "COMPILE_COMPLETE"}}
+    assert [e["sequence"] for e in events] == list(range(1, 7))
+
+
+def test_compiler_writes_are_streamed(bucket, monkeypatch):
+    """Every write to the artefacts bucket during the compile is an "artefact_written" event."""
+    monkeypatch.setattr(streaming.util, "get_artefact_bucket_name", lambda: "artefacts")
+    bucket.write("packages/app/package.zip", b"zip")
+
+    def compiler():
+        artefacts = MagicS3Client.get_bucket(Region="us-east-1", BucketName="artefacts")
+        package = {"Bucket": "packages", "Key": "packages/app/package.zip"}
+        artefacts.Object("artefacts/app/package.zip").copy_from(CopySource=package)
+        artefacts.put_object(Key="artefacts/app/main.yaml", Body=b"{}")
+        artefacts.Object("artefacts/app/actions.yaml").put(Body=b"[]")
+        MagicS3Client.get_bucket(Region="us-east-1", BucketName="packages").put_object(Key="packages/app/other.zip", Body=b"")
+        return {"Status": "COMPILE_COMPLETE"}
+
+    def handler(event, context=None):
+        return {"Response": deadline.Deadline().run_stage(deadline.STAGE_COMPILE, compiler)}
+
+    events = list(streaming.stream({"task": "compile"}, handler=handler))
+
+    written = [e for e in events if e["type"] == streaming.EVENT_ARTEFACT_WRITTEN]
+    assert [(e["key"], e.get("source")) for e in written] == [
+        ("artefacts/app/package.zip", "packages/app/package.zip"),
+        ("artefacts/app/main.yaml", None),
+        ("artefacts/app/actions.yaml", None),
+    ]
+    assert all(e["bucket"] == "artefacts" for e in written)
+    assert MagicS3Client.get_bucket(BucketName="artefacts") is bucket
+
+
+def test_closing_the_stream_cancels_the_task():
+    """A stage that has not started when the client goes away is never started."""
+    gate = threading.Event()
+    finished = threading.Event()
+    ran = []
+    outcome = {}
+
+    def handler(event, context=None):
+        stages = deadline.Deadline()
+        try:
+            stages.run_stage(deadline.STAGE_COPY, lambda: ran.append("copy"))
+            gate.wait(5)
+            stages.run_stage(deadline.STAGE_COMPILE, lambda: ran.append("compile"))
+        except streaming.Cancelled as e:
+            outcome["cancelled"] = str(e)
+        finally:
+            finished.set()
+        return {"Response": {"Status": "ok"}}
+
+    events = streaming.stream({"task": "compile"}, handler=handler)
+    for event in events:
+        if event["type"] == "stage_finished":
+            break
+    events.close()
+    gate.set()
+
+    assert finished.wait(5)
+    assert ran == ["copy"]
+    assert "cancelled" in outcome
+
+
+def test_handler_errors_become_the_final_response():
+    """An exception in the handler ends the stream with an error response."""
+
+    def handler(event, context=None):
+        raise RuntimeError("boom")
+
+    events = list(streaming.stream({}, handler=handler))
+
+    assert events[-1]["response"] == {"Response": {"Status": "error", "Message": "boom"}}
+
+
+def test_emit_outside_a_stream_is_ignored():
+    """Progress events are dropped when nobody is listening."""
+    assert not streaming.is_streaming()
+    streaming.emit(streaming.EVENT_STAGE_STARTED, stage="copy")
+
+
+def test_ndjson_stream():
+    """Every event is one JSON line."""
+    lines = list(streaming.ndjson_stream({"task": "compile"}, handler=_compile_handler))
+
+    assert all(line.endswith(b"\n") for line in lines)
+    assert json.loads(lines[-1])["type"] == "response"
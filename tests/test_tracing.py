@@ -0,0 +1,111 @@
+"""
+Unit tests for span creation and trace-context propagation.
+"""
+
+import json
+
+import pytest
+
+import core_invoker.invoker as invoker
+from core_invoker import tracing
+
+
+@pytest.fixture
+def exporter():
+    """
+    Install an in-memory exporter for the duration of a test.
+
+    :returns: The installed exporter
+    :rtype: tracing.InMemorySpanExporter
+    """
+    exporter = tracing.InMemorySpanExporter()
+    tracing.set_exporter(exporter)
+    yield exporter
+    tracing.set_exporter(None)
+
+
+def test_nested_spans_share_trace(exporter):
+    """Child spans inherit the trace id, parent and correlation id."""
+    with tracing.start_span("parent", correlation_id="abc") as parent:
+        with tracing.start_span("child") as child:
+            pass
+
+    spans = exporter.get_finished_spans()
+    assert [s.name for s in spans] == ["child", "parent"]
+    assert child.context.trace_id == parent.context.trace_id
+    assert child.parent_id == parent.context.span_id
+    assert child.correlation_id == "abc"
+    assert parent.duration_ms is not None
+
+
+def test_inject_extract_round_trip(exporter):
+    """A payload injected by one hop continues the same trace in the next."""
+    with tracing.start_span("invoker.handler") as span:
+        payload = tracing.inject({"task": "compile"})
+
+    assert payload[tracing.TRACE_CONTEXT][tracing.TRACEPARENT] == span.context.traceparent
+
+    parent = tracing.extract(payload)
+    assert tracing.TRACE_CONTEXT not in payload
+    assert parent.trace_id == span.context.trace_id
+    assert parent.span_id == span.context.span_id
+
+    with tracing.start_span("compiler", parent=parent) as remote:
+        pass
+    assert remote.context.trace_id == span.context.trace_id
+    assert remote.parent_id == span.context.span_id
+
+
+@pytest.mark.parametrize(
+    "trace_context",
+    [None, "bad", {"traceparent": "00-xyz-1234-01"}, {"traceparent": "00-" + "0" * 32 + "-" + "1" * 16 + "-01"}],
+)
+def test_extract_ignores_invalid(trace_context):
+    """Malformed trace context starts a new trace instead of failing."""
+    assert tracing.extract({"trace_context": trace_context}) is None
+
+
+def test_error_status_recorded(exporter):
+    """Exceptions mark the span as failed and are re-raised."""
+    with pytest.raises(RuntimeError):
+        with tracing.start_span("failing"):
+            raise RuntimeError("boom")
+
+    span = exporter.get_finished_spans()[0]
+    assert span.status == tracing.STATUS_ERROR
+    assert span.attributes["error"] == "boom"
+
+
+def test_file_exporter(tmp_path):
+    """The file exporter writes one JSON document per span."""
+    path = tmp_path / "spans" / "trace.jsonl"
+    tracing.set_exporter(tracing.FileSpanExporter(str(path)))
+    try:
+        with tracing.start_span("one"):
+            pass
+        with tracing.start_span("two"):
+            pass
+    finally:
+        tracing.set_exporter(None)
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["name"] for line in lines] == ["one", "two"]
+    assert all(len(line["trace_id"]) == 32 for line in lines)
+
+
+def test_execute_runner_propagates_context(exporter, monkeypatch, make_payload):
+    """The runner receives the traceparent of the execute_runner span."""
+    received = {}
+
+    def fake_runner(event, context):
+        received.update(event)
+        return {"Response": "ok"}
+
+    monkeypatch.setattr(invoker.util, "is_local_mode", lambda: True)
+    monkeypatch.setattr(invoker, "runner_handler", fake_runner)
+
+    invoker.execute_runner(make_payload())
+
+    span = exporter.get_finished_spans()[-1]
+    assert span.name == "invoker.execute_runner"
+    assert received[tracing.TRACE_CONTEXT][tracing.TRACEPARENT] == span.context.traceparent